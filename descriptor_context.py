@@ -1,31 +1,164 @@
+from collections import deque
+from functools import cached_property
 from typing import List, Tuple
 from google.protobuf.descriptor_pb2 import (
     FileDescriptorProto,
     DescriptorProto,
 )
+from google.protobuf.compiler.plugin_pb2 import (
+    CodeGeneratorRequest,
+)
+from utils import get_id_from_string, get_method_full_name, get_namespace, to_camel_case
+
+SYMBOL_MESSAGE = "message"
+SYMBOL_ENUM = "enum"
+SYMBOL_SERVICE = "service"
+
+def get_full_name(scope:str,name:str) -> str:
+    # scope is a package or an enclosing message name, both without the leading '.'
+    if scope is None or scope == "":
+        return f".{name}"
+    return f".{scope}.{name}"
+
+class Symbol:
+    # a message, enum or service of the descriptor set; names and IDs are computed once per generation
+    def __init__(self, kind:str, full_name:str, descriptor, file:FileDescriptorProto, namespace:str, parent:"Symbol" = None) -> None:
+        self.kind = kind
+        self.full_name = full_name
+        self.descriptor = descriptor
+        self.file = file
+        self.csharp_namespace = namespace
+        self.parent = parent
+        self.nested_messages = []
+        self.ids = {}
+
+    @cached_property
+    def csharp_name(self) -> str:
+        # name relative to the namespace; protobuf C# declares nested types in a static Types class
+        if self.parent is None:
+            return to_camel_case(self.descriptor.name)
+        return f"{self.parent.csharp_name}.Types.{to_camel_case(self.descriptor.name)}"
+
+    @cached_property
+    def csharp_full_name(self) -> str:
+        if self.csharp_namespace is None or self.csharp_namespace == "":
+            return f"global::{self.csharp_name}"
+        return f"global::{self.csharp_namespace}.{self.csharp_name}"
+
+    @cached_property
+    def python_name(self) -> str:
+        # name inside the module protoc --python_out generates for the file, nested classes keep proto names
+        if self.parent is None:
+            return self.descriptor.name
+        return f"{self.parent.python_name}.{self.descriptor.name}"
+
+    @cached_property
+    def id_name(self) -> str:
+        # top level messages keep the name hashed by utils.get_message_full_name
+        if self.parent is None:
+            return ".".join([self.file.package or "EMPTY",to_camel_case(self.descriptor.name)])
+        return ".".join([self.parent.id_name,to_camel_case(self.descriptor.name)])
+
+    def get_id(self, id_scheme:str) -> int:
+        if self.kind != SYMBOL_MESSAGE:
+            raise Exception(f"{self.kind} {self.full_name} has no message ID")
+        if id_scheme not in self.ids:
+            self.ids[id_scheme] = get_id_from_string(self.id_name,id_scheme)
+        return self.ids[id_scheme]
+
+    def get_method_ids(self, id_scheme:str) -> List[Tuple[int,str]]:
+        # (id, full name) of every method of a service, in declaration order
+        if self.kind != SYMBOL_SERVICE:
+            raise Exception(f"{self.kind} {self.full_name} has no methods")
+        if id_scheme not in self.ids:
+            names = [get_method_full_name(self.descriptor,method,self.file) for method in self.descriptor.method]
+            self.ids[id_scheme] = [(get_id_from_string(name,id_scheme),name) for name in names]
+        return self.ids[id_scheme]
 
 class DescriptorContext:
-    def __init__(self, file_descriptor_array:List[FileDescriptorProto]) -> None:
+    def __init__(self, file_descriptor_array:List[FileDescriptorProto], files_to_generate:List[str] = None) -> None:
         self.descriptor_map = dict(map(lambda d: (d.name,d),file_descriptor_array))
+        if files_to_generate is None:
+            files_to_generate = list(self.descriptor_map.keys())
+        self.files_to_generate = [name for name in files_to_generate if name in self.descriptor_map]
 
-        messages_map_keys = []
-        for file in file_descriptor_array:
-            for message in file.message_type:
-                if file.package is None or file.package == "":
-                    full_message_name = f".{message.name}"
-                else:
-                    full_message_name = f".{file.package}.{message.name}"
-                messages_map_keys.append((full_message_name,(message,file)))
-        self.messages_map = dict(messages_map_keys)
-
-    @property 
+        # symbols are indexed lazily: files are visited breadth first starting from the files to generate
+        # and following their imports, only until the requested symbol is found
+        self.symbols = {}
+        self.file_symbols = {}
+        self.pending_files = deque(self.files_to_generate)
+        # content digests of files and their imports, see generation_cache.get_file_digest
+        self.file_digests = {}
+
+    @property
     def descriptors(self) -> List[FileDescriptorProto]:
-        return self.descriptor_map.values()
-    
+        return [self.descriptor_map[name] for name in self.files_to_generate]
+
+    def get_symbol(self,full_qualified_name:str) -> Symbol:
+        while full_qualified_name not in self.symbols:
+            if not self.index_next_file():
+                return None
+        return self.symbols[full_qualified_name]
+
     def get_message_descriptor(self,full_quialified_message_name:str) -> Tuple[DescriptorProto,FileDescriptorProto]:
-       if full_quialified_message_name in self.messages_map:
-           return self.messages_map[full_quialified_message_name]
-       return (None,None)
-    
+        symbol = self.get_symbol(full_quialified_message_name)
+        if symbol is None or symbol.kind != SYMBOL_MESSAGE:
+            return (None,None)
+        return (symbol.descriptor,symbol.file)
+
+    def get_file_symbols(self,file_name:str) -> List[Symbol]:
+        # every symbol declared in the file, parents before their nested types
+        if file_name not in self.file_symbols:
+            self.index_file(file_name)
+        return self.file_symbols.get(file_name,[])
+
+    def index_next_file(self) -> bool:
+        while len(self.pending_files) > 0:
+            name = self.pending_files.popleft()
+            if name in self.file_symbols:
+                continue
+            if self.index_file(name):
+                return True
+        return False
+
+    def index_file(self,name:str) -> bool:
+        file = self.descriptor_map.get(name)
+        self.file_symbols[name] = []
+        if file is None:
+            return False
+        namespace = get_namespace(file)
+        for message in file.message_type:
+            self.index_message(message,file.package,file,namespace,None)
+        for enum in file.enum_type:
+            self.add_symbol(Symbol(SYMBOL_ENUM,get_full_name(file.package,enum.name),enum,file,namespace))
+        for service in file.service:
+            self.add_symbol(Symbol(SYMBOL_SERVICE,get_full_name(file.package,service.name),service,file,namespace))
+        self.pending_files.extend(file.dependency)
+        return True
+
+    def index_message(self,message:DescriptorProto,scope:str,file:FileDescriptorProto,namespace:str,parent:Symbol) -> Symbol:
+        symbol = self.add_symbol(Symbol(SYMBOL_MESSAGE,get_full_name(scope,message.name),message,file,namespace,parent))
+        nested_scope = symbol.full_name[1:]
+        for nested in message.nested_type:
+            nested_symbol = self.index_message(nested,nested_scope,file,namespace,symbol)
+            # map fields are backed by synthetic entry messages which have no generated class
+            if not nested.options.map_entry:
+                symbol.nested_messages.append(nested_symbol)
+        for enum in message.enum_type:
+            self.add_symbol(Symbol(SYMBOL_ENUM,get_full_name(nested_scope,enum.name),enum,file,namespace,symbol))
+        return symbol
+
+    def add_symbol(self,symbol:Symbol) -> Symbol:
+        self.symbols[symbol.full_name] = symbol
+        self.file_symbols[symbol.file.name].append(symbol)
+        return symbol
+
     def __str__(self) -> str:
-        return self.descriptor_map.keys().__str__()
\ No newline at end of file
+        return self.descriptor_map.keys().__str__()
+
+def get_request_context(request:CodeGeneratorRequest) -> DescriptorContext:
+    # proto_file holds the whole import closure; source_file_descriptors (protoc >= 24) repeats the
+    # files to generate with source-retention options kept, so prefer those entries when present
+    descriptors = dict((d.name,d) for d in request.proto_file)
+    descriptors.update((d.name,d) for d in request.source_file_descriptors)
+    return DescriptorContext(list(descriptors.values()),request.file_to_generate)
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+from google.protobuf.descriptor_pb2 import (
+    FileDescriptorProto,
+)
+from google.protobuf.message import DecodeError
+from google.protobuf.compiler.plugin_pb2 import (
+    CodeGeneratorResponse,
+)
+from descriptor_context import DescriptorContext
+from utils import GENERATOR_VERSION
+
+def get_file_digest(name:str,context:DescriptorContext) -> bytes:
+    # sha256 of a file and of the digests of its imports, so it covers the whole import closure;
+    # every file is serialized once per request however many files import it
+    digests = context.file_digests
+    pending = [name]
+    visiting = set()
+    while len(pending) > 0:
+        current = pending[-1]
+        if current in digests:
+            pending.pop()
+            continue
+        descriptor = context.descriptor_map.get(current)
+        if descriptor is None:
+            # imports missing from the request only contribute their name
+            digests[current] = b""
+            pending.pop()
+            continue
+        missing = [dependency for dependency in descriptor.dependency if dependency not in digests]
+        if len(missing) > 0:
+            if current in visiting:
+                raise Exception(f"Import cycle through {current}")
+            visiting.add(current)
+            pending.extend(missing)
+            continue
+        hasher = hashlib.sha256(descriptor.SerializeToString(deterministic=True))
+        for dependency in sorted(set(descriptor.dependency)):
+            hasher.update(b"\0dependency\0")
+            hasher.update(dependency.encode())
+            hasher.update(b"\0")
+            hasher.update(digests[dependency])
+        digests[current] = hasher.digest()
+        pending.pop()
+    return digests[name]
+
+def get_cache_key(descriptors:List[FileDescriptorProto],context:DescriptorContext,options_fingerprint:str) -> str:
+    # generated code depends on the file itself, on every message it may reference from
+    # its imports, on the generator version and on the options it was generated with
+    hasher = hashlib.sha256()
+    hasher.update(GENERATOR_VERSION.encode())
+    hasher.update(b"\0")
+    hasher.update(options_fingerprint.encode())
+    for descriptor in descriptors:
+        hasher.update(b"\0file\0")
+        hasher.update(descriptor.name.encode())
+        hasher.update(b"\0")
+        hasher.update(get_file_digest(descriptor.name,context))
+    return hasher.hexdigest()
+
+class MemoryCache:
+    # least recently used generated files, shared by every request a daemon serves
+    def __init__(self, max_entries:int) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key:str) -> List[CodeGeneratorResponse.File]:
+        with self.lock:
+            files = self.entries.get(key)
+            if files is not None:
+                self.entries.move_to_end(key)
+            return files
+
+    def put(self, key:str, files:List[CodeGeneratorResponse.File]):
+        with self.lock:
+            self.entries[key] = files
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class GenerationCache:
+    def __init__(self, cache_dir:str = None, memory:MemoryCache = None) -> None:
+        self.cache_dir = cache_dir
+        self.memory = memory
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir,exist_ok=True)
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.cache_dir,f"{key}.bin")
+
+    def get(self, key:str) -> List[CodeGeneratorResponse.File]:
+        if self.memory is not None:
+            files = self.memory.get(key)
+            if files is not None:
+                self.hits += 1
+                return files
+        if self.cache_dir is None:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            with open(path,"rb") as f:
+                cached = CodeGeneratorResponse.FromString(f.read())
+        except (OSError, DecodeError):
+            # missing or unreadable (e.g. truncated) entries are regenerated
+            self.misses += 1
+            return None
+        self.hits += 1
+        files = list(cached.file)
+        if self.memory is not None:
+            self.memory.put(key,files)
+        return files
+
+    def put(self, key:str, files:List[CodeGeneratorResponse.File]):
+        if self.memory is not None:
+            self.memory.put(key,files)
+        if self.cache_dir is None:
+            return
+        entry = CodeGeneratorResponse(file=files)
+        path = self._path(key)
+        # write to a temporary file first so concurrent protoc runs never observe a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path,"wb") as f:
+            f.write(entry.SerializeToString())
+        os.replace(tmp_path,path)
+
+    def __str__(self) -> str:
+        return f"cache {self.cache_dir or 'memory'}: {self.hits} hits, {self.misses} misses"
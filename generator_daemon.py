@@ -0,0 +1,170 @@
+import hashlib
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from typing import Tuple
+
+# this module is imported by the plugin shim on every protoc invocation, so it must only use the
+# standard library; the generator itself is imported by the daemon process when it starts serving
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_STALE = 2
+FRAME_HEADER = struct.Struct(">I")
+
+def get_socket_path() -> str:
+    path = os.environ.get("OMGPP_DAEMON_SOCKET")
+    if path:
+        return path
+    return os.path.join(tempfile.gettempdir(),f"omgpp-gen-{os.getuid()}.sock")
+
+def get_code_fingerprint() -> str:
+    # a daemon started before the plugin sources changed must not serve stale output
+    hasher = hashlib.sha256()
+    for root, dirs, files in os.walk(PLUGIN_DIR):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__" and not d.startswith("."))
+        for name in sorted(files):
+            if not name.endswith(".py"):
+                continue
+            stat = os.stat(os.path.join(root,name))
+            hasher.update(f"{os.path.relpath(os.path.join(root,name),PLUGIN_DIR)}:{stat.st_size}:{stat.st_mtime_ns}\0".encode())
+    return hasher.hexdigest()
+
+def write_frame(connection:socket.socket,data:bytes):
+    connection.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+def read_exact(connection:socket.socket,size:int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(min(size,1 << 20))
+        if len(chunk) == 0:
+            raise ConnectionError("omgpp daemon connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def read_frame(connection:socket.socket) -> bytes:
+    (size,) = FRAME_HEADER.unpack(read_exact(connection,FRAME_HEADER.size))
+    return read_exact(connection,size)
+
+def request_daemon(socket_path:str,request_data:bytes,cwd:str) -> Tuple[int,bytes,str]:
+    # protocol: code fingerprint, working directory of the plugin and request as length prefixed frames,
+    # answered with a status byte, the serialized CodeGeneratorResponse and the stderr text.
+    # Raises OSError when no daemon answers.
+    with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as connection:
+        connection.settimeout(1)
+        connection.connect(socket_path)
+        # generating a large request may take a while, only connecting is bounded
+        connection.settimeout(None)
+        try:
+            write_frame(connection,get_code_fingerprint().encode())
+            write_frame(connection,cwd.encode())
+            write_frame(connection,request_data)
+        except BrokenPipeError:
+            # a stale daemon answers after the fingerprint and closes without reading the rest
+            pass
+        status = read_exact(connection,1)[0]
+        response_data = read_frame(connection)
+        log = read_frame(connection).decode("utf-8","replace")
+        return (status,response_data,log)
+
+class DaemonRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        server.touch()
+        # the fingerprint is checked before reading on, as the rest of the protocol may have changed
+        fingerprint = read_frame(self.request).decode()
+        if fingerprint != server.code_fingerprint:
+            self.request.sendall(bytes([STATUS_STALE]))
+            write_frame(self.request,b"")
+            write_frame(self.request,b"omgpp: daemon runs outdated plugin sources and is shutting down\n")
+            server.stop()
+            return
+        # relative paths in the options, such as cache_dir, are relative to where protoc was run
+        cwd = read_frame(self.request).decode()
+        request_data = read_frame(self.request)
+        try:
+            (response_data,log) = server.run_generator(request_data,server.memory,cwd)
+            status = STATUS_OK
+        except Exception:
+            (response_data,log) = (b"",traceback.format_exc())
+            status = STATUS_ERROR
+        self.request.sendall(bytes([status]))
+        write_frame(self.request,response_data)
+        write_frame(self.request,log.encode())
+        server.touch()
+
+class GeneratorDaemon(socketserver.ThreadingMixIn,socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path:str, cache_entries:int, idle_timeout:float) -> None:
+        # imported here so templates, option parsing and protobuf stay loaded for every request
+        from generation_cache import MemoryCache
+        from generator_runner import run_generator
+        self.run_generator = run_generator
+        self.memory = MemoryCache(cache_entries)
+        self.code_fingerprint = get_code_fingerprint()
+        self.idle_timeout = idle_timeout
+        self.last_activity = time.monotonic()
+        self.socket_path = socket_path
+        remove_stale_socket(socket_path)
+        # only the owner may connect
+        umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path,DaemonRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def stop(self):
+        # shutdown() waits for serve_forever, so it must not run on a request thread
+        threading.Thread(target=self.shutdown,daemon=True).start()
+
+    def watch_idle(self):
+        while True:
+            time.sleep(min(self.idle_timeout,1))
+            if time.monotonic() - self.last_activity > self.idle_timeout:
+                self.stop()
+                return
+
+    def serve(self):
+        if self.idle_timeout > 0:
+            threading.Thread(target=self.watch_idle,daemon=True).start()
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+def remove_stale_socket(socket_path:str):
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except OSError:
+            # left behind by a daemon that was killed
+            os.unlink(socket_path)
+            return
+    raise Exception(f"An omgpp daemon is already listening on {socket_path}")
+
+def run_daemon(socket_path:str,cache_entries:int = 4096,idle_timeout:float = 0):
+    server = GeneratorDaemon(socket_path,cache_entries,idle_timeout)
+    # SIGTERM unwinds like Ctrl+C so the socket file is removed
+    signal.signal(signal.SIGTERM,lambda signum, frame: sys.exit(0))
+    sys.stderr.write(f"omgpp: daemon listening on {socket_path}\n")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
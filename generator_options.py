@@ -0,0 +1,109 @@
+import os
+from typing import Dict, List
+
+from utils import ID_SCHEMES
+
+# options which only change how the plugin runs, not what it emits
+RUNTIME_ONLY_OPTIONS = ["cache_dir","jobs"]
+BUNDLE_MODES = ["none","namespace","package"]
+LANGUAGES = ["csharp","python"]
+
+class GeneratorOptions:
+    def __init__(self, parameter:str = "") -> None:
+        self.parameter = parameter
+        self.values = parse_parameter(parameter)
+
+        # python emits asyncio clients and the load generator instead of the C# code
+        self.lang = get_choice_option(self.values,"lang",LANGUAGES,"csharp")
+        self.cache_dir = self.values.get("cache_dir")
+        # jobs=0 uses every available CPU
+        self.jobs = get_int_option(self.values,"jobs",1)
+        if self.jobs == 0:
+            self.jobs = os.cpu_count() or 1
+        self.id_scheme = get_choice_option(self.values,"id_scheme",ID_SCHEMES,"legacy")
+        # id_manifest=true emits OmgppIds.json/.bin, any other value is used as the manifest name
+        self.id_manifest = self.values.get("id_manifest")
+        if self.id_manifest == "true":
+            self.id_manifest = "OmgppIds"
+        elif self.id_manifest == "false":
+            self.id_manifest = None
+        self.zero_copy = get_bool_option(self.values,"zero_copy",False)
+        self.pooling = get_bool_option(self.values,"pooling",False)
+        self.pool_size = get_int_option(self.values,"pool_size",16)
+        self.client_requests = get_choice_option(self.values,"client_requests",["dictionary","slots"],"dictionary")
+        # must be a power of two, it bounds the number of requests in flight per client handler
+        self.pending_slots = get_int_option(self.values,"pending_slots",1024)
+        if self.pending_slots == 0 or self.pending_slots & (self.pending_slots - 1) != 0:
+            raise Exception(f"Option 'pending_slots' expects a power of two, got '{self.pending_slots}'")
+        # resolution of the shared timer wheel expiring client requests
+        self.timer_tick_ms = get_int_option(self.values,"timer_tick_ms",10)
+        if self.timer_tick_ms == 0:
+            raise Exception("Option 'timer_tick_ms' must be greater than 0")
+        # default for methods without the (omgpp.timeout_ms) option
+        self.request_timeout_ms = get_int_option(self.values,"request_timeout_ms",1000)
+        # messages up to this many bytes are serialized into stackalloc'ed spans, 0 always uses ArrayPool
+        self.stackalloc_threshold = get_int_option(self.values,"stackalloc_threshold",512)
+        # server interfaces return ValueTask and calls run on bounded per-method work queues
+        self.async_server = get_bool_option(self.values,"async_server",False)
+        # defaults for methods without the (omgpp.max_concurrency) and (omgpp.queue_depth) options
+        self.max_concurrency = get_int_option(self.values,"max_concurrency",0)
+        self.queue_depth = get_int_option(self.values,"queue_depth",1024)
+        # default for streaming methods without the (omgpp.stream_window) option
+        self.stream_window = get_int_option(self.values,"stream_window",64)
+        if self.stream_window == 0:
+            raise Exception("Option 'stream_window' must be greater than 0")
+        # client handlers get Batch<Method> calls which are collected and sent as one frame per flush
+        self.batching = get_bool_option(self.values,"batching",False)
+        # server handlers dispatch slices of the batch frame, without zero_copy every entry would be copied
+        if self.batching and not self.zero_copy:
+            raise Exception("Option 'batching' requires 'zero_copy=true'")
+        self.batch_max_bytes = get_int_option(self.values,"batch_max_bytes",1200)
+        if self.batch_max_bytes == 0:
+            raise Exception("Option 'batch_max_bytes' must be greater than 0")
+        # 0 flushes only explicitly or when batch_max_bytes is reached
+        self.batch_flush_ms = get_int_option(self.values,"batch_flush_ms",0)
+        # defaults for (omgpp.cacheable) methods without the (omgpp.cache_size) and (omgpp.cache_ttl_ms) options
+        self.response_cache_size = get_int_option(self.values,"response_cache_size",256)
+        if self.response_cache_size == 0:
+            raise Exception("Option 'response_cache_size' must be greater than 0")
+        self.response_cache_ttl_ms = get_int_option(self.values,"response_cache_ttl_ms",0)
+        # generated handlers record calls, latency, payload sizes and errors per method with System.Diagnostics.Metrics
+        self.metrics = get_bool_option(self.values,"metrics",False)
+        # one output file per C# namespace or proto package instead of up to three per proto file
+        self.bundle = get_choice_option(self.values,"bundle",BUNDLE_MODES,"none")
+        # several protoc invocations feeding one assembly must emit the shared runtime only once
+        self.emit_runtime = get_bool_option(self.values,"emit_runtime",True)
+
+    def fingerprint(self) -> str:
+        # canonical form of every option that may affect generated output
+        return ",".join(f"{key}={self.values[key]}" for key in sorted(self.values) if key not in RUNTIME_ONLY_OPTIONS)
+
+def parse_parameter(parameter:str) -> Dict[str,str]:
+    # protoc joins all --omgpp_opt values with ',' into CodeGeneratorRequest.parameter
+    values = {}
+    for part in (parameter or "").split(","):
+        part = part.strip()
+        if len(part) == 0:
+            continue
+        if "=" in part:
+            key, value = part.split("=",1)
+        else:
+            key, value = part, "true"
+        values[key.strip()] = value.strip()
+    return values
+
+def get_int_option(values:Dict[str,str],key:str,default:int) -> int:
+    if key not in values:
+        return default
+    if not values[key].isdigit():
+        raise Exception(f"Option '{key}' expects a non-negative integer, got '{values[key]}'")
+    return int(values[key])
+
+def get_choice_option(values:Dict[str,str],key:str,choices:List[str],default:str) -> str:
+    value = values.get(key,default)
+    if value not in choices:
+        raise Exception(f"Option '{key}' expects one of {', '.join(choices)}, got '{value}'")
+    return value
+
+def get_bool_option(values:Dict[str,str],key:str,default:bool) -> bool:
+    return get_choice_option(values,key,["true","false"],"true" if default else "false") == "true"
@@ -0,0 +1,53 @@
+import os
+from typing import Tuple
+from google.protobuf.compiler.plugin_pb2 import (
+    CodeGeneratorRequest,
+)
+from languages.csharp.csharp_gen import csharp_gen_omgpp
+from languages.python.python_gen import python_gen_omgpp
+from descriptor_context import get_request_context
+from generation_cache import GenerationCache, MemoryCache
+from generator_options import GeneratorOptions
+"""
+https://buf.build/docs/reference/descriptors/#options-messages
+─ FileDescriptorProto
+   │
+   ├─ DescriptorProto           // Messages
+   │   ├─ FieldDescriptorProto  //   - normal fields and nested extensions
+   │   ├─ OneofDescriptorProto
+   │   ├─ DescriptorProto       //   - nested messages
+   │   │   └─ (...more...)
+   │   └─ EnumDescriptorProto   //   - nested enums
+   │       └─ EnumValueDescriptorProto
+   │
+   ├─ EnumDescriptorProto       // Enums
+   │   └─ EnumValueDescriptorProto
+   │
+   ├─ FieldDescriptorProto      // Extensions
+   │
+   └─ ServiceDescriptorProto    // Services
+       └─ MethodDescriptorProto
+"""
+
+def run_generator(request_data:bytes,memory:MemoryCache = None,cwd:str = None) -> Tuple[bytes,str]:
+    # returns the serialized CodeGeneratorResponse and the text protoc should show on stderr;
+    # cwd is the directory protoc ran in when it differs from ours (requests served by the daemon)
+    request = CodeGeneratorRequest.FromString(request_data)
+    context = get_request_context(request)
+    options = GeneratorOptions(request.parameter)
+    cache = None
+    if options.cache_dir or memory is not None:
+        cache_dir = options.cache_dir
+        if cache_dir and cwd is not None:
+            cache_dir = os.path.join(cwd,cache_dir)
+        cache = GenerationCache(cache_dir,memory)
+
+    if options.lang == "python":
+        response = python_gen_omgpp(context,options,cache)
+    else:
+        response = csharp_gen_omgpp(context,options,cache)
+    log = f"omgpp: {cache}\n" if options.cache_dir else ""
+    if options.bundle != "none" and options.lang == "csharp":
+        size = sum(len(f.content.encode("utf-8")) for f in response.file)
+        log += f"omgpp: bundle={options.bundle}: {len(response.file)} files, {size} bytes\n"
+    return (response.SerializeToString(),log)
@@ -0,0 +1,73 @@
+import json
+from typing import List
+
+from google.protobuf.descriptor_pb2 import (
+    FileDescriptorProto,
+)
+from google.protobuf.compiler.plugin_pb2 import (
+    CodeGeneratorResponse,
+)
+from descriptor_context import DescriptorContext, SYMBOL_MESSAGE, SYMBOL_SERVICE
+
+MANIFEST_VERSION = 1
+MANIFEST_MAGIC = b"OMID"
+ID_KIND_MESSAGE = 0
+ID_KIND_METHOD = 1
+ID_KIND_NAMES = {ID_KIND_MESSAGE: "message", ID_KIND_METHOD: "method"}
+
+class IdRegistry:
+    def __init__(self, id_scheme:str) -> None:
+        self.id_scheme = id_scheme
+        self.entries = {}
+
+    def register(self, id:int, kind:int, full_name:str):
+        if id in self.entries:
+            (registered_kind,registered_name) = self.entries[id]
+            if registered_kind == kind and registered_name == full_name:
+                return
+            raise Exception(f"ID collision: {ID_KIND_NAMES[kind]} {full_name} and {ID_KIND_NAMES[registered_kind]} {registered_name} both map to {id} with id_scheme={self.id_scheme}; rename one of them or choose another id_scheme")
+        self.entries[id] = (kind,full_name)
+
+    def register_file(self, descriptor:FileDescriptorProto, context:DescriptorContext):
+        for symbol in context.get_file_symbols(descriptor.name):
+            # map entry messages have no generated class and no ID
+            if symbol.kind == SYMBOL_MESSAGE and not symbol.descriptor.options.map_entry:
+                self.register(symbol.get_id(self.id_scheme),ID_KIND_MESSAGE,symbol.id_name)
+            elif symbol.kind == SYMBOL_SERVICE:
+                for (id,full_name) in symbol.get_method_ids(self.id_scheme):
+                    self.register(id,ID_KIND_METHOD,full_name)
+
+    def to_json(self) -> str:
+        ids = sorted(self.entries)
+        return json.dumps({
+            "version": MANIFEST_VERSION,
+            "id_scheme": self.id_scheme,
+            "messages": dict((str(id),self.entries[id][1]) for id in ids if self.entries[id][0] == ID_KIND_MESSAGE),
+            "methods": dict((str(id),self.entries[id][1]) for id in ids if self.entries[id][0] == ID_KIND_METHOD),
+        },indent=1)
+
+    def to_binary(self) -> bytes:
+        # CodeGeneratorResponse.File.content is a string, so the manifest is kept 7-bit clean: integers are
+        # written as fixed-width little endian groups of 7 bits (see encode_septets).
+        # layout: magic, version (2), entry count (5), then per entry sorted by id:
+        # id as 64 bit two's complement (10), kind (1), utf-8 name length (3), utf-8 name
+        data = bytearray(MANIFEST_MAGIC)
+        data += encode_septets(MANIFEST_VERSION,2)
+        data += encode_septets(len(self.entries),5)
+        for id in sorted(self.entries):
+            (kind,full_name) = self.entries[id]
+            name = full_name.encode("utf-8")
+            data += encode_septets(id & 0xffffffffffffffff,10)
+            data += encode_septets(kind,1)
+            data += encode_septets(len(name),3)
+            data += name
+        return bytes(data)
+
+    def manifest_files(self, manifest_name:str) -> List[CodeGeneratorResponse.File]:
+        return [
+            CodeGeneratorResponse.File(name=f"{manifest_name}.json",content=self.to_json()),
+            CodeGeneratorResponse.File(name=f"{manifest_name}.bin",content=self.to_binary().decode("utf-8")),
+        ]
+
+def encode_septets(value:int,width:int) -> bytes:
+    return bytes((value >> (7 * i)) & 0x7f for i in range(width))
@@ -1,8 +1,13 @@
 import io
+import multiprocessing
 import sys
-from typing import List
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
  
 from google.protobuf.descriptor_pb2 import (
+    FeatureSet,
+    FieldDescriptorProto,
     FileDescriptorProto,
     ServiceDescriptorProto,
     DescriptorProto,
@@ -10,10 +15,16 @@ from google.protobuf.descriptor_pb2 import (
 from google.protobuf.compiler.plugin_pb2 import (
     CodeGeneratorResponse,
 )
-from descriptor_context import DescriptorContext
+from descriptor_context import DescriptorContext, SYMBOL_MESSAGE, Symbol, get_full_name
+from generation_cache import GenerationCache, get_cache_key
+from generator_options import GeneratorOptions
+from id_registry import IdRegistry
+from omgpp_options import FIELD_COALESCE_KEY, MESSAGE_DELTA, METHOD_CACHE_SIZE, METHOD_CACHE_TTL_MS, METHOD_CACHEABLE, METHOD_COALESCE, METHOD_MAX_CONCURRENCY, METHOD_QUEUE_DEPTH, METHOD_STREAM_WINDOW, METHOD_TIMEOUT_MS, get_extension_varint
 from languages.csharp.csharp_method import CSharpMethod
-from languages.csharp.csharp_rpc_templates import get_rpc_client_handler, get_rpc_server_handler
-from utils import get_message_id, get_method_id, get_output_filename, to_camel_case, to_upper
+from languages.csharp.csharp_rpc_templates import get_client_method_name, get_client_return_type, get_rpc_client_handler, get_rpc_server_handler, get_server_return_type
+from languages.csharp.csharp_stream_templates import get_stream_client_signature, get_stream_server_signature
+from languages.csharp.csharp_runtime_templates import RUNTIME_NAMESPACE, get_runtime, needs_runtime
+from utils import GENERATOR_VERSION, get_namespace, get_output_filename, to_camel_case, to_upper
 
 
 def save_protoc_input(filename):
@@ -22,14 +33,6 @@ def save_protoc_input(filename):
     f.write(data)
     f.close()
 
-def get_namespace(d:FileDescriptorProto) -> str:
-    csharp_namespace = None
-    if len(d.package) > 0:
-        csharp_namespace = ".".join([to_upper(part) for part in d.package.split(".")])
-    if len(d.options.csharp_namespace) > 0:
-        csharp_namespace = d.options.csharp_namespace
-    return csharp_namespace
-
 
 
 
@@ -43,136 +46,500 @@ def with_csharp_namespace_surrounding(buffer: io.StringIO,namespace,callback):
     callback(buffer)
     buffer.write("}\n")
 
-def process_message(buffer:io.StringIO,message:DescriptorProto,descriptor:FileDescriptorProto):
+def process_message(buffer:io.StringIO,symbol:Symbol,options:GeneratorOptions):
+    message = symbol.descriptor
     csharp_name = to_camel_case(message.name)
-    message_id = get_message_id(message,descriptor)
+    message_id = symbol.get_id(options.id_scheme)
     buffer.write(f"public sealed partial class {csharp_name} : IOmgppMessage, IOmgppMessage<{csharp_name}> \n")
     buffer.write("{\n")
     buffer.write(f"\tpublic static long MessageId {{get;}} = {message_id};\n")
     buffer.write(f"\tpublic static MessageParser<{csharp_name}> MessageParser => Parser;\n")
+    if options.pooling:
+        process_message_pool(buffer,csharp_name,message,symbol.file,options)
+    if get_extension_varint(message.options,MESSAGE_DELTA,0) != 0:
+        process_message_delta(buffer,csharp_name,message,symbol.file,options)
+    if len(symbol.nested_messages) > 0:
+        # protobuf C# declares nested messages inside a static Types class of the containing message
+        nested_buffer = io.StringIO()
+        for nested in symbol.nested_messages:
+            process_message(nested_buffer,nested,options)
+        buffer.write("\tpublic static partial class Types\n")
+        buffer.write("\t{\n")
+        for line in nested_buffer.getvalue().splitlines():
+            buffer.write(f"\t\t{line}\n")
+        buffer.write("\t}\n")
     buffer.write("}\n")
+
+def get_csharp_property_name(field_name:str,csharp_class_name:str) -> str:
+    # mirrors the protobuf C# generator: drop underscores, capitalize the letter following one and any letter following a digit
+    name = ""
+    capitalize_next = True
+    for char in field_name:
+        if char.isalpha():
+            name += char.upper() if capitalize_next else char
+            capitalize_next = False
+        elif char.isdigit():
+            name += char
+            capitalize_next = True
+        else:
+            capitalize_next = True
+    if name == csharp_class_name:
+        name += "_"
+    return name
+
+def has_explicit_presence(field:FieldDescriptorProto,descriptor:FileDescriptorProto) -> bool:
+    if field.proto3_optional:
+        return True
+    if descriptor.syntax == "proto3":
+        return False
+    if descriptor.syntax == "editions":
+        if field.options.features.HasField("field_presence"):
+            return field.options.features.field_presence != FeatureSet.IMPLICIT
+        return descriptor.options.features.field_presence != FeatureSet.IMPLICIT
+    return True
+
+def get_field_reset(field:FieldDescriptorProto,property_name:str,descriptor:FileDescriptorProto) -> str:
+    if field.label == FieldDescriptorProto.LABEL_REPEATED:
+        # repeated fields and maps keep their capacity for the next use
+        return f"{property_name}.Clear();"
+    if field.type in (FieldDescriptorProto.TYPE_MESSAGE,FieldDescriptorProto.TYPE_GROUP):
+        return f"{property_name} = null;"
+    if has_explicit_presence(field,descriptor):
+        return f"Clear{property_name}();"
+    if field.type == FieldDescriptorProto.TYPE_STRING:
+        return f"{property_name} = \"\";"
+    if field.type == FieldDescriptorProto.TYPE_BYTES:
+        return f"{property_name} = global::Google.Protobuf.ByteString.Empty;"
+    return f"{property_name} = default;"
+
+def process_message_pool(buffer:io.StringIO,csharp_name:str,message:DescriptorProto,descriptor:FileDescriptorProto,options:GeneratorOptions):
+    pool_type = f"global::{RUNTIME_NAMESPACE}.ObjectPool<{csharp_name}>"
+    buffer.write(f"\tstatic readonly {pool_type} pool = new {pool_type}({options.pool_size});\n")
+    buffer.write(f"\tpublic static {csharp_name} RentFromPool() => pool.Rent();\n")
+    buffer.write(f"\tpublic static void ReturnToPool({csharp_name} message)\n")
+    buffer.write("\t{\n")
+    buffer.write("\t\tmessage.ResetForPool();\n")
+    buffer.write("\t\tpool.Return(message);\n")
+    buffer.write("\t}\n")
+    # Google.Protobuf messages have no Clear(), so every field is reset explicitly before the instance is reused
+    buffer.write("\tvoid ResetForPool()\n")
+    buffer.write("\t{\n")
+    cleared_oneofs = set()
+    for field in message.field:
+        if field.HasField("oneof_index") and not field.proto3_optional:
+            if field.oneof_index not in cleared_oneofs:
+                cleared_oneofs.add(field.oneof_index)
+                oneof_name = get_csharp_property_name(message.oneof_decl[field.oneof_index].name,csharp_name)
+                buffer.write(f"\t\tClear{oneof_name}();\n")
+            continue
+        buffer.write(f"\t\t{get_field_reset(field,get_csharp_property_name(field.name,csharp_name),descriptor)}\n")
+    if len(message.extension_range) > 0:
+        buffer.write("\t\t_extensions = null;\n")
+    buffer.write("\t\t_unknownFields = null;\n")
+    buffer.write("\t}\n")
     
-def process_service(buffer:io.StringIO,service:ServiceDescriptorProto,descriptor:FileDescriptorProto,context:DescriptorContext,is_server:bool):
+def get_delta_units(message:DescriptorProto) -> List[Tuple[int,List[FieldDescriptorProto]]]:
+    # one mask bit per field, and one per oneof since its members replace each other
+    units = []
+    oneofs = {}
+    for field in message.field:
+        if field.HasField("oneof_index") and not field.proto3_optional:
+            if field.oneof_index not in oneofs:
+                oneofs[field.oneof_index] = []
+                units.append((field.oneof_index,oneofs[field.oneof_index]))
+            oneofs[field.oneof_index].append(field)
+        else:
+            units.append((None,[field]))
+    return units
+
+def get_field_change(field:FieldDescriptorProto,property_name:str,descriptor:FileDescriptorProto,in_oneof:bool = False) -> str:
+    if field.label == FieldDescriptorProto.LABEL_REPEATED:
+        return f"!{property_name}.Equals(baseline.{property_name})"
+    if field.type in (FieldDescriptorProto.TYPE_MESSAGE,FieldDescriptorProto.TYPE_GROUP):
+        return f"!object.Equals({property_name}, baseline.{property_name})"
+    # members of a oneof are only compared once both sides have the same case set
+    if not in_oneof and has_explicit_presence(field,descriptor):
+        return f"Has{property_name} != baseline.Has{property_name} || {property_name} != baseline.{property_name}"
+    return f"{property_name} != baseline.{property_name}"
+
+def get_field_delta_copy(field:FieldDescriptorProto,property_name:str,descriptor:FileDescriptorProto) -> str:
+    if field.label == FieldDescriptorProto.LABEL_REPEATED:
+        return f"delta.{property_name}.Add({property_name});"
+    if field.type not in (FieldDescriptorProto.TYPE_MESSAGE,FieldDescriptorProto.TYPE_GROUP) and has_explicit_presence(field,descriptor):
+        return f"if (Has{property_name}) delta.{property_name} = {property_name};"
+    return f"delta.{property_name} = {property_name};"
+
+def get_field_delta_apply(field:FieldDescriptorProto,property_name:str,descriptor:FileDescriptorProto) -> str:
+    # a changed field absent from the delta message was cleared or reset to its default
+    if field.label == FieldDescriptorProto.LABEL_REPEATED:
+        return f"{property_name}.Clear(); {property_name}.Add(delta.{property_name});"
+    if field.type not in (FieldDescriptorProto.TYPE_MESSAGE,FieldDescriptorProto.TYPE_GROUP) and has_explicit_presence(field,descriptor):
+        return f"if (delta.Has{property_name}) {property_name} = delta.{property_name}; else Clear{property_name}();"
+    return f"{property_name} = delta.{property_name};"
+
+def process_message_delta(buffer:io.StringIO,csharp_name:str,message:DescriptorProto,descriptor:FileDescriptorProto,options:GeneratorOptions):
+    # a delta is a bitmask of the fields differing from a baseline followed by a message holding only
+    # those fields, so both sides must be generated from the same version of the message
+    units = get_delta_units(message)
+    mask_size = max(1,(len(units) + 7) // 8)
+    changes = ""
+    copies = ""
+    applies = ""
+    for bit, (oneof_index,fields) in enumerate(units):
+        test = f"(mask[{bit >> 3}] & {1 << (bit & 7)}) != 0"
+        if oneof_index is None:
+            field = fields[0]
+            property_name = get_csharp_property_name(field.name,csharp_name)
+            changes += f"\t\tif ({get_field_change(field,property_name,descriptor)})\n"
+            changes += f"\t\t{{\n\t\t\tmask[{bit >> 3}] |= {1 << (bit & 7)};\n\t\t\t{get_field_delta_copy(field,property_name,descriptor)}\n\t\t}}\n"
+            applies += f"\t\tif ({test})\n\t\t{{\n\t\t\t{get_field_delta_apply(field,property_name,descriptor)}\n\t\t}}\n"
+            continue
+        oneof_name = get_csharp_property_name(message.oneof_decl[oneof_index].name,csharp_name)
+        case_type = f"{oneof_name}OneofCase"
+        compare = ""
+        copy = ""
+        apply = ""
+        for field in fields:
+            property_name = get_csharp_property_name(field.name,csharp_name)
+            compare += f"\t\t\t{case_type}.{property_name} => {get_field_change(field,property_name,descriptor,True)},\n"
+            copy += f"\t\t\t\tcase {case_type}.{property_name}: delta.{property_name} = {property_name}; break;\n"
+            apply += f"\t\t\t\tcase {case_type}.{property_name}: {property_name} = delta.{property_name}; break;\n"
+        changes += f"\t\tif ({oneof_name}Case != baseline.{oneof_name}Case || {oneof_name}Case switch\n\t\t{{\n{compare}\t\t\t_ => false,\n\t\t}})\n"
+        changes += f"\t\t{{\n\t\t\tmask[{bit >> 3}] |= {1 << (bit & 7)};\n\t\t\tswitch ({oneof_name}Case)\n\t\t\t{{\n{copy}\t\t\t}}\n\t\t}}\n"
+        applies += f"\t\tif ({test})\n\t\t{{\n\t\t\tswitch (delta.{oneof_name}Case)\n\t\t\t{{\n{apply}\t\t\t\tdefault: Clear{oneof_name}(); break;\n\t\t\t}}\n\t\t}}\n"
+
+    if options.pooling:
+        (rent,release) = (f"{csharp_name}.RentFromPool()",f"\t\t{csharp_name}.ReturnToPool(delta);\n")
+    else:
+        (rent,release) = (f"new {csharp_name}()","")
+
+    buffer.write(f"\tpublic const int DeltaMaskSize = {mask_size};\n")
+    buffer.write(f"\t// sets the mask bit of every field differing from baseline and copies those fields into delta\n")
+    buffer.write(f"\tpublic void GetDelta({csharp_name} baseline, Span<byte> mask, {csharp_name} delta)\n")
+    buffer.write("\t{\n")
+    buffer.write("\t\tmask.Slice(0, DeltaMaskSize).Clear();\n")
+    buffer.write(changes)
+    buffer.write("\t}\n")
+    buffer.write(f"\tpublic byte[] ToDeltaByteArray({csharp_name} baseline)\n")
+    buffer.write("\t{\n")
+    buffer.write("\t\tSpan<byte> mask = stackalloc byte[DeltaMaskSize];\n")
+    buffer.write(f"\t\tvar delta = {rent};\n")
+    buffer.write("\t\tGetDelta(baseline, mask, delta);\n")
+    buffer.write("\t\tvar bytes = new byte[DeltaMaskSize + delta.CalculateSize()];\n")
+    buffer.write("\t\tmask.CopyTo(bytes);\n")
+    buffer.write("\t\tdelta.WriteTo(bytes.AsSpan(DeltaMaskSize));\n")
+    buffer.write(release)
+    buffer.write("\t\treturn bytes;\n")
+    buffer.write("\t}\n")
+    buffer.write(f"\tpublic void WriteDeltaTo({csharp_name} baseline, System.Buffers.IBufferWriter<byte> output)\n")
+    buffer.write("\t{\n")
+    buffer.write("\t\tvar mask = output.GetSpan(DeltaMaskSize);\n")
+    buffer.write(f"\t\tvar delta = {rent};\n")
+    buffer.write("\t\tGetDelta(baseline, mask, delta);\n")
+    buffer.write("\t\toutput.Advance(DeltaMaskSize);\n")
+    buffer.write("\t\tdelta.WriteTo(output);\n")
+    buffer.write(release)
+    buffer.write("\t}\n")
+    buffer.write(f"\t// updates this instance, which must equal the baseline the delta was made from\n")
+    buffer.write("\tpublic void ApplyDelta(ReadOnlySpan<byte> data)\n")
+    buffer.write("\t{\n")
+    buffer.write("\t\tif (data.Length < DeltaMaskSize)\n")
+    buffer.write(f"\t\t\tthrow new ArgumentException(\"Delta of {csharp_name} is shorter than its field mask\", nameof(data));\n")
+    buffer.write("\t\tvar mask = data.Slice(0, DeltaMaskSize);\n")
+    if options.pooling:
+        buffer.write(f"\t\tvar delta = {rent};\n")
+        buffer.write("\t\tdelta.MergeFrom(data.Slice(DeltaMaskSize));\n")
+    else:
+        buffer.write("\t\tvar delta = Parser.ParseFrom(data.Slice(DeltaMaskSize));\n")
+    buffer.write(applies)
+    buffer.write(release)
+    buffer.write("\t}\n")
+
+def get_method_argument_type(type_name:str,context:DescriptorContext) -> str:
+    if type_name == ".google.protobuf.Empty":
+        return "void"
+    symbol = context.get_symbol(type_name)
+    if symbol is None or symbol.kind != SYMBOL_MESSAGE:
+        raise Exception(f"Cannot find {type_name} message; Make sure you provided all .proto files to process")
+    return symbol.csharp_full_name
+
+# C# types of the fields usable as (omgpp.coalesce_key), besides enums
+CSHARP_KEY_TYPES = {
+    FieldDescriptorProto.TYPE_INT32: "int",
+    FieldDescriptorProto.TYPE_SINT32: "int",
+    FieldDescriptorProto.TYPE_SFIXED32: "int",
+    FieldDescriptorProto.TYPE_INT64: "long",
+    FieldDescriptorProto.TYPE_SINT64: "long",
+    FieldDescriptorProto.TYPE_SFIXED64: "long",
+    FieldDescriptorProto.TYPE_UINT32: "uint",
+    FieldDescriptorProto.TYPE_FIXED32: "uint",
+    FieldDescriptorProto.TYPE_UINT64: "ulong",
+    FieldDescriptorProto.TYPE_FIXED64: "ulong",
+    FieldDescriptorProto.TYPE_BOOL: "bool",
+    FieldDescriptorProto.TYPE_STRING: "string",
+}
+
+def get_coalesce_key(input_type:str,method_name:str,context:DescriptorContext) -> Tuple[str,str]:
+    message = context.get_symbol(input_type).descriptor
+    keys = [field for field in message.field if get_extension_varint(field.options,FIELD_COALESCE_KEY,0)]
+    if len(keys) == 0:
+        # without a key field every request replaces the previous one
+        return ("int","0")
+    if len(keys) > 1:
+        raise Exception(f"{method_name}: {input_type} marks more than one field with (omgpp.coalesce_key)")
+    field = keys[0]
+    if field.label == FieldDescriptorProto.LABEL_REPEATED:
+        raise Exception(f"{method_name}: (omgpp.coalesce_key) field {field.name} must not be repeated")
+    if field.type == FieldDescriptorProto.TYPE_ENUM:
+        key_type = context.get_symbol(field.type_name).csharp_full_name
+    elif field.type in CSHARP_KEY_TYPES:
+        key_type = CSHARP_KEY_TYPES[field.type]
+    else:
+        raise Exception(f"{method_name}: (omgpp.coalesce_key) field {field.name} must be a scalar, string or enum field")
+    return (key_type,f"message.{get_csharp_property_name(field.name,to_camel_case(message.name))}")
+
+def process_service(buffer:io.StringIO,service_symbol:Symbol,context:DescriptorContext,is_server:bool,options:GeneratorOptions):
+    service = service_symbol.descriptor
     csharp_methods = []
-    for method in service.method:
-        id = get_method_id(service,method,descriptor)
+    for method, (id,_) in zip(service.method,service_symbol.get_method_ids(options.id_scheme)):
         is_input_empty = method.input_type == ".google.protobuf.Empty"
         is_out_empty = method.output_type == ".google.protobuf.Empty"
-        (input_arg_message,input_arg_file_descriptor)  = context.get_message_descriptor(method.input_type)
-        (out_arg_message,out_arg_file_descriptor)  = context.get_message_descriptor(method.output_type)
-        if input_arg_message is None and not is_input_empty:
-            raise Exception(f"Cannot find {method.input_type} message; Make sure you provided all .proto files to process")
-        if out_arg_message is None and not is_out_empty:
-            raise Exception(f"Cannot find {method.output_type} message; Make sure you provided all .proto files to process")
-
-        if is_input_empty:
-            full_qualified_csharp_input = "void"
-        else:        
-            full_qualified_csharp_input = f"global::{get_namespace(input_arg_file_descriptor)}.{to_camel_case(input_arg_message.name)}"
-        
-        if is_out_empty:
-            full_qualified_csharp_output = "void"
-        else:
-            full_qualified_csharp_output = f"global::{get_namespace(out_arg_file_descriptor)}.{to_camel_case(out_arg_message.name)}"
+        full_qualified_csharp_input = get_method_argument_type(method.input_type,context)
+        full_qualified_csharp_output = get_method_argument_type(method.output_type,context)
 
-        if is_input_empty:
-            csharp_methods.append(CSharpMethod(id,method.name,full_qualified_csharp_output,[],not is_out_empty,False))
-        else:
-            csharp_methods.append(CSharpMethod(id,method.name,full_qualified_csharp_output,[(full_qualified_csharp_input,"message")],not is_out_empty,True))
+        timeout_ms = get_extension_varint(method.options,METHOD_TIMEOUT_MS,options.request_timeout_ms)
+        max_concurrency = get_extension_varint(method.options,METHOD_MAX_CONCURRENCY,options.max_concurrency)
+        queue_depth = get_extension_varint(method.options,METHOD_QUEUE_DEPTH,options.queue_depth)
+        stream_window = get_extension_varint(method.options,METHOD_STREAM_WINDOW,options.stream_window)
+        if stream_window == 0:
+            raise Exception(f"{service.name}.{method.name}: (omgpp.stream_window) must be greater than 0")
+        coalesce = get_extension_varint(method.options,METHOD_COALESCE,0) != 0
+        (coalesce_key_type,coalesce_key) = ("int","0")
+        if coalesce:
+            # a superseded request is dropped, so nobody may wait for its response
+            if is_input_empty or not is_out_empty or method.client_streaming or method.server_streaming:
+                raise Exception(f"{service.name}.{method.name}: (omgpp.coalesce) needs a unary method with a request message returning google.protobuf.Empty")
+            (coalesce_key_type,coalesce_key) = get_coalesce_key(method.input_type,f"{service.name}.{method.name}",context)
+        cacheable = get_extension_varint(method.options,METHOD_CACHEABLE,0) != 0
+        cache_size = get_extension_varint(method.options,METHOD_CACHE_SIZE,options.response_cache_size)
+        cache_ttl_ms = get_extension_varint(method.options,METHOD_CACHE_TTL_MS,options.response_cache_ttl_ms)
+        if cacheable:
+            if is_out_empty or method.client_streaming or method.server_streaming:
+                raise Exception(f"{service.name}.{method.name}: (omgpp.cacheable) needs a unary method returning a message")
+            if cache_size == 0:
+                raise Exception(f"{service.name}.{method.name}: (omgpp.cache_size) must be greater than 0")
+        input_args = [] if is_input_empty else [(full_qualified_csharp_input,"message")]
+        csharp_methods.append(CSharpMethod(id,method.name,full_qualified_csharp_output,input_args,not is_out_empty,not is_input_empty,timeout_ms,max_concurrency,queue_depth,
+                                           method.client_streaming,method.server_streaming,stream_window,coalesce,coalesce_key_type,coalesce_key,
+                                           cacheable,cache_size,cache_ttl_ms))
     
 
     if is_server:
-        gen_rpc_server_interface(buffer, service.name, csharp_methods)
-        gen_rpc_server_handler(buffer,service.name,csharp_methods)
+        gen_rpc_server_interface(buffer, service.name, csharp_methods, options)
+        gen_rpc_server_handler(buffer,service.name,csharp_methods,options)
     else:
-        gen_rpc_client_interface(buffer, service.name, csharp_methods)
-        gen_rpc_client_handler(buffer,service.name,csharp_methods)
+        gen_rpc_client_interface(buffer, service.name, csharp_methods, options)
+        gen_rpc_client_handler(buffer,service.name,csharp_methods,options)
 
-def gen_rpc_server_handler(buffer, service_name, methods: List[CSharpMethod]):
-    buffer.write(get_rpc_server_handler(service_name,methods))
-def gen_rpc_client_handler(buffer,service_name,methods: List[CSharpMethod]):
-    buffer.write(get_rpc_client_handler(service_name,methods))
+def gen_rpc_server_handler(buffer, service_name, methods: List[CSharpMethod],options:GeneratorOptions):
+    buffer.write(get_rpc_server_handler(service_name,methods,options))
+def gen_rpc_client_handler(buffer,service_name,methods: List[CSharpMethod],options:GeneratorOptions):
+    buffer.write(get_rpc_client_handler(service_name,methods,options))
 
-def gen_rpc_server_interface(buffer, service_name, methods: List[CSharpMethod]):
+def gen_rpc_server_interface(buffer, service_name, methods: List[CSharpMethod],options:GeneratorOptions):
     default_args = [("System.Guid","clientGuid"), ("System.Net.IPAddress","ip"), ("ushort","port")]
     interface_name = "I"+service_name+"Server"
     buffer.write(f"public interface {interface_name}\n")
     buffer.write("{\n")
     for m in methods:
+        if m.is_streaming:
+            buffer.write(f"\t{get_stream_server_signature(m)};\n")
+            continue
         all_input_args = default_args + m.input_args
         input_args = ",".join(map(lambda arg: f"{arg[0]} {arg[1]}",all_input_args))
-        buffer.write(f"\t{m.return_type} {m.name}({input_args});\n")
+        buffer.write(f"\t{get_server_return_type(m,options)} {m.name}({input_args});\n")
         pass
     buffer.write("}\n")
 
-def gen_rpc_client_interface(buffer, service_name, methods: List[CSharpMethod]):
+def gen_rpc_client_interface(buffer, service_name, methods: List[CSharpMethod],options:GeneratorOptions):
     interface_name = "I"+service_name+"Client"
     buffer.write(f"public interface {interface_name}\n")
     buffer.write("{\n")
     for m in methods:
+        if m.is_streaming:
+            buffer.write(f"\t{get_stream_client_signature(m)};\n")
+            continue
         all_input_args = m.input_args + [("bool","isReliable")]
         input_args = ",".join(map(lambda arg: f"{arg[0]} {arg[1]}",all_input_args))
-        if m.has_output:
-            buffer.write(f"\tTask<{m.return_type}> {m.name}({input_args});\n")
-        else:
-            buffer.write(f"\t{m.return_type} {m.name}({input_args});\n")
+        buffer.write(f"\t{get_client_return_type(m,options)} {m.name}({input_args});\n")
+        if options.batching and not m.coalesce:
+            buffer.write(f"\t{get_client_return_type(m,options)} {get_client_method_name(m,True)}({input_args});\n")
         pass
     buffer.write("}\n")
     
-def process_messages_in_file_descriptor(buffer: io.StringIO,descriptor:FileDescriptorProto,context:DescriptorContext):
+def process_messages_in_file_descriptor(buffer: io.StringIO,descriptor:FileDescriptorProto,context:DescriptorContext,options:GeneratorOptions):
     for message in descriptor.message_type:
-        process_message(buffer,message,descriptor)
+        process_message(buffer,context.get_symbol(get_full_name(descriptor.package,message.name)),options)
 
-def process_services_in_file_descriptor(buffer: io.StringIO,descriptor:FileDescriptorProto,context:DescriptorContext,is_server:bool):
+def process_services_in_file_descriptor(buffer: io.StringIO,descriptor:FileDescriptorProto,context:DescriptorContext,is_server:bool,options:GeneratorOptions):
     for service in descriptor.service:
-        process_service(buffer,service,descriptor,context,is_server)
+        process_service(buffer,context.get_symbol(get_full_name(descriptor.package,service.name)),context,is_server,options)
+
+MESSAGES_USINGS = [
+    "using global::OmgppSharpCore.Interfaces;",
+    "using Google.Protobuf;",
+]
+SERVER_USINGS = [
+    "using System.Net;",
+    "using global::OmgppSharpCore.Interfaces;",
+    "using Google.Protobuf;",
+    "using OmgppSharpClientServer;",
+    "using System.Buffers;",
+    "using static OmgppSharpClientServer.IServerRpcHandler;",
+]
+CLIENT_USINGS = [
+    "using global::OmgppSharpCore.Interfaces;",
+    "using Google.Protobuf;",
+    "using System.Buffers;",
+    "using OmgppSharpClientServer;",
+]
+
+def process_usings(buffer: io.StringIO,usings:List[str]):
+    for using in usings:
+        buffer.write(f"{using}\n")
 
 def process_messages_usings(buffer: io.StringIO):
-    buffer.write("using global::OmgppSharpCore.Interfaces;\n")
-    buffer.write("using Google.Protobuf;\n")
+    process_usings(buffer,MESSAGES_USINGS)
 
 def process_service_server_usings(buffer: io.StringIO):
-    buffer.write("using System.Net;\n")
-    buffer.write("using global::OmgppSharpCore.Interfaces;\n")
-    buffer.write("using Google.Protobuf;\n")
-    buffer.write("using OmgppSharpClientServer;\n")
-    buffer.write("using System.Buffers;\n")
-    buffer.write("using static OmgppSharpClientServer.IServerRpcHandler;\n")
-
+    process_usings(buffer,SERVER_USINGS)
 
 def process_service_client_using(buffer: io.StringIO):
-    buffer.write("using global::OmgppSharpCore.Interfaces;\n")
-    buffer.write("using Google.Protobuf;\n") 
-    buffer.write("using System.Buffers;\n")
-    buffer.write("using OmgppSharpClientServer;\n")
+    process_usings(buffer,CLIENT_USINGS)
 
 def process_header(buffer: io.StringIO):
     buffer.write("/** <auto-generated>\n")
     buffer.write("* Do not edit this file manually  \n")
-    buffer.write("* This file was generated by proto-omgpp-gen.py 0.1.0 \n")
+    buffer.write(f"* This file was generated by proto-omgpp-gen.py {GENERATOR_VERSION} \n")
     buffer.write("* Any changes will be discarded after regeneration\n")
     buffer.write("* </auto-generated>\n")
     buffer.write("*/ \n")
 
-def csharp_gen_proto_messages(buffer:io.StringIO,namespace:str,descriptors:FileDescriptorProto, context:DescriptorContext):
+def csharp_gen_proto_messages(buffer:io.StringIO,namespace:str,descriptors:FileDescriptorProto, context:DescriptorContext, options:GeneratorOptions):
     process_header(buffer)
     process_messages_usings(buffer)
-    with_csharp_namespace_surrounding(buffer,namespace,lambda buf: process_messages_in_file_descriptor(buf,descriptors,context))
+    with_csharp_namespace_surrounding(buffer,namespace,lambda buf: process_messages_in_file_descriptor(buf,descriptors,context,options))
 
-def csharp_gen_proto_services_server(buffer:io.StringIO,namespace:str,descriptors:FileDescriptorProto, context:DescriptorContext):
+def csharp_gen_proto_services_server(buffer:io.StringIO,namespace:str,descriptors:FileDescriptorProto, context:DescriptorContext, options:GeneratorOptions):
     process_header(buffer)
     process_service_server_usings(buffer)
-    with_csharp_namespace_surrounding(buffer,namespace,lambda buf: process_services_in_file_descriptor(buf,descriptors,context,True))
+    with_csharp_namespace_surrounding(buffer,namespace,lambda buf: process_services_in_file_descriptor(buf,descriptors,context,True,options))
 
-def csharp_gen_proto_services_client(buffer:io.StringIO,namespace:str,descriptors:FileDescriptorProto, context:DescriptorContext):
+def csharp_gen_proto_services_client(buffer:io.StringIO,namespace:str,descriptors:FileDescriptorProto, context:DescriptorContext, options:GeneratorOptions):
     process_header(buffer)
     process_service_client_using(buffer)
-    with_csharp_namespace_surrounding(buffer,namespace,lambda buf: process_services_in_file_descriptor(buf,descriptors,context,False))
+    with_csharp_namespace_surrounding(buffer,namespace,lambda buf: process_services_in_file_descriptor(buf,descriptors,context,False,options))
+
+# bundle fragments: the contents of one namespace block, without header and usings
+FRAGMENT_USINGS = {"messages": MESSAGES_USINGS, "server": SERVER_USINGS, "client": CLIENT_USINGS}
+
+def csharp_gen_fragments(descriptor:FileDescriptorProto,descriptor_context:DescriptorContext,options:GeneratorOptions) -> List[CodeGeneratorResponse.File]:
+    buffer = io.StringIO()
+    process_messages_in_file_descriptor(buffer,descriptor,descriptor_context,options)
+    files = [CodeGeneratorResponse.File(name="messages",content=buffer.getvalue())]
+    if len(descriptor.service) > 0:
+        buffer = io.StringIO()
+        process_services_in_file_descriptor(buffer,descriptor,descriptor_context,True,options)
+        files.append(CodeGeneratorResponse.File(name="server",content=buffer.getvalue()))
+        buffer = io.StringIO()
+        process_services_in_file_descriptor(buffer,descriptor,descriptor_context,False,options)
+        files.append(CodeGeneratorResponse.File(name="client",content=buffer.getvalue()))
+    return files
+
+def get_bundle_filename(namespace:str,descriptor:FileDescriptorProto,options:GeneratorOptions) -> str:
+    if options.bundle == "package":
+        name = ".".join(to_upper(part) for part in descriptor.package.split(".")) if len(descriptor.package) > 0 else ""
+    else:
+        name = namespace or ""
+    return f"{name or 'Global'}.Omgpp.cs"
+
+def csharp_gen_bundles(units:List[Tuple[str,FileDescriptorProto]],generated:List[List[CodeGeneratorResponse.File]],options:GeneratorOptions) -> List[CodeGeneratorResponse.File]:
+    # bundle file name -> namespace -> fragment kind -> fragments, all in order of first appearance
+    bundles = {}
+    for (namespace,descriptor), fragments in zip(units,generated):
+        namespaces = bundles.setdefault(get_bundle_filename(namespace,descriptor,options),{})
+        kinds = namespaces.setdefault(namespace,dict((kind,[]) for kind in FRAGMENT_USINGS))
+        for fragment in fragments:
+            kinds[fragment.name].append(fragment.content)
+
+    files = []
+    for filename, namespaces in bundles.items():
+        usings = []
+        for kinds in namespaces.values():
+            for kind, contents in kinds.items():
+                if len(contents) > 0:
+                    usings.extend(using for using in FRAGMENT_USINGS[kind] if using not in usings)
+        buffer = io.StringIO()
+        process_header(buffer)
+        process_usings(buffer,usings)
+        for namespace, kinds in namespaces.items():
+            content = "".join("".join(contents) for contents in kinds.values())
+            with_csharp_namespace_surrounding(buffer,namespace,lambda buf: buf.write(content))
+        files.append(CodeGeneratorResponse.File(name=filename,content=buffer.getvalue()))
+    return files
+
+def csharp_gen_file(namespace:str,descriptor:FileDescriptorProto,descriptor_context:DescriptorContext,options:GeneratorOptions) -> List[CodeGeneratorResponse.File]:
+    if options.bundle != "none":
+        return csharp_gen_fragments(descriptor,descriptor_context,options)
+    files = []
+    filename = get_output_filename(descriptor.name)
+    extension = "Omgpp.cs"
+    buffer = io.StringIO()
+    csharp_gen_proto_messages(buffer,namespace,descriptor,descriptor_context,options)
+    files.append(CodeGeneratorResponse.File(name=f"{filename}.{extension}",content=buffer.getvalue()))
+    if descriptor.service is not None and len(descriptor.service) > 0:
+        buffer = io.StringIO()
+        csharp_gen_proto_services_server(buffer,namespace,descriptor,descriptor_context,options)
+        files.append(CodeGeneratorResponse.File(name=f"{filename}.Service.Server.{extension}",content=buffer.getvalue()))
+        buffer = io.StringIO()
+        csharp_gen_proto_services_client(buffer,namespace,descriptor,descriptor_context,options)
+        files.append(CodeGeneratorResponse.File(name=f"{filename}.Service.Client.{extension}",content=buffer.getvalue()))
+    return files
 
-def csharp_gen_omgpp(descriptor_context:DescriptorContext) -> CodeGeneratorResponse:
+# per-process context of parallel generation workers
+worker_context:DescriptorContext = None
+worker_options:GeneratorOptions = None
+
+def init_generation_worker(serialized_descriptors:List[bytes],files_to_generate:List[str],parameter:str):
+    global worker_context, worker_options
+    descriptors = [FileDescriptorProto.FromString(data) for data in serialized_descriptors]
+    worker_context = DescriptorContext(descriptors,files_to_generate)
+    worker_options = GeneratorOptions(parameter)
+
+def csharp_gen_file_in_worker(unit:Tuple[str,str]) -> bytes:
+    (namespace,descriptor_name) = unit
+    files = csharp_gen_file(namespace,worker_context.descriptor_map[descriptor_name],worker_context,worker_options)
+    return CodeGeneratorResponse(file=files).SerializeToString()
+
+def csharp_gen_files(units:List[Tuple[str,FileDescriptorProto]],descriptor_context:DescriptorContext,options:GeneratorOptions) -> List[List[CodeGeneratorResponse.File]]:
+    if options.jobs <= 1 or len(units) <= 1:
+        return [csharp_gen_file(namespace,descriptor,descriptor_context,options) for (namespace,descriptor) in units]
+
+    serialized_descriptors = [d.SerializeToString() for d in descriptor_context.descriptor_map.values()]
+    work = [(namespace,descriptor.name) for (namespace,descriptor) in units]
+    workers = min(options.jobs,len(units))
+    # forking while other threads run (the daemon serves requests on threads) may copy locks they
+    # hold into the workers and deadlock them, so workers are spawned instead
+    mp_context = multiprocessing.get_context("spawn") if threading.active_count() > 1 else None
+    # executor.map yields results in submission order, so output is identical to a serial run
+    with ProcessPoolExecutor(max_workers=workers,mp_context=mp_context,initializer=init_generation_worker,initargs=(serialized_descriptors,descriptor_context.files_to_generate,options.parameter)) as executor:
+        results = executor.map(csharp_gen_file_in_worker,work,chunksize=max(1,len(work) // (workers * 4)))
+        return [list(CodeGeneratorResponse.FromString(data).file) for data in results]
+
+def csharp_gen_omgpp(descriptor_context:DescriptorContext,options:GeneratorOptions = None,cache:GenerationCache = None) -> CodeGeneratorResponse:
+    options = options or GeneratorOptions()
     namespace_dict = {}
     response = CodeGeneratorResponse()
-    buffer = io.StringIO() 
     for desc in descriptor_context.descriptors:
         namespace = get_namespace(desc)
         if namespace not in namespace_dict:
@@ -182,21 +549,45 @@ def csharp_gen_omgpp(descriptor_context:DescriptorContext) -> CodeGeneratorRespo
         values.append(desc)
         namespace_dict[namespace] = values
 
+    # ids are checked for collisions on every run, including files served from the cache
+    id_registry = IdRegistry(options.id_scheme)
+    for descriptor in descriptor_context.descriptors:
+        id_registry.register_file(descriptor,descriptor_context)
+
+    units = []
     for namespace in namespace_dict:
         namespace_descriptors = namespace_dict[namespace]
         for descriptor in namespace_descriptors:
-            filename = get_output_filename(descriptor.name)
-            extension = "Omgpp.cs"
-            csharp_gen_proto_messages(buffer,namespace,descriptor,descriptor_context)
-            response.file.append(CodeGeneratorResponse.File(name=f"{filename}.{extension}",content=buffer.getvalue()))
-            buffer = io.StringIO()
-            if descriptor.service is not None and len(descriptor.service) > 0:
-                csharp_gen_proto_services_server(buffer,namespace,descriptor,descriptor_context)
-                response.file.append(CodeGeneratorResponse.File(name=f"{filename}.Service.Server.{extension}",content=buffer.getvalue())) 
-                buffer = io.StringIO()
-                csharp_gen_proto_services_client(buffer,namespace,descriptor,descriptor_context)
-                response.file.append(CodeGeneratorResponse.File(name=f"{filename}.Service.Client.{extension}",content=buffer.getvalue())) 
-                buffer = io.StringIO()
-            pass
-            
+            units.append((namespace,descriptor))
+
+    generated = [None] * len(units)
+    keys = [None] * len(units)
+    if cache is not None:
+        for i, (namespace,descriptor) in enumerate(units):
+            keys[i] = get_cache_key([descriptor],descriptor_context,options.fingerprint())
+            generated[i] = cache.get(keys[i])
+
+    missing = [i for i in range(len(units)) if generated[i] is None]
+    for i, files in zip(missing,csharp_gen_files([units[i] for i in missing],descriptor_context,options)):
+        generated[i] = files
+        if cache is not None:
+            cache.put(keys[i],files)
+
+    if options.bundle != "none":
+        response.file.extend(csharp_gen_bundles(units,generated,options))
+    else:
+        for files in generated:
+            response.file.extend(files)
+    # stream, coalescing and response cache support is only emitted for schemas using them
+    methods = [method for descriptor in descriptor_context.descriptors for service in descriptor.service for method in service.method]
+    streaming = any(method.client_streaming or method.server_streaming for method in methods)
+    coalescing = any(get_extension_varint(method.options,METHOD_COALESCE,0) != 0 for method in methods)
+    caching = any(get_extension_varint(method.options,METHOD_CACHEABLE,0) != 0 for method in methods)
+    if options.emit_runtime and needs_runtime(options,streaming,coalescing,caching):
+        buffer = io.StringIO()
+        process_header(buffer)
+        buffer.write(get_runtime(options,streaming,coalescing,caching))
+        response.file.append(CodeGeneratorResponse.File(name="Omgpp.Runtime.cs",content=buffer.getvalue()))
+    if options.id_manifest is not None:
+        response.file.extend(id_registry.manifest_files(options.id_manifest))
     return response
\ No newline at end of file
@@ -2,10 +2,27 @@
 from typing import List, Tuple
 
 class CSharpMethod:
-    def __init__(self,id:int, name:str,return_type:str,input_args:List[Tuple[str,str]],has_output:bool,has_input_message:bool) -> None:
+    def __init__(self,id:int, name:str,return_type:str,input_args:List[Tuple[str,str]],has_output:bool,has_input_message:bool,timeout_ms:int,max_concurrency:int,queue_depth:int,client_streaming:bool = False,server_streaming:bool = False,stream_window:int = 0,coalesce:bool = False,coalesce_key_type:str = "int",coalesce_key:str = "0",cacheable:bool = False,cache_size:int = 0,cache_ttl_ms:int = 0) -> None:
         self.id = id
         self.name =name
         self.return_type = return_type
         self.input_args = input_args
         self.has_output = has_output
-        self.has_input_message = has_input_message
\ No newline at end of file
+        self.has_input_message = has_input_message
+        self.timeout_ms = timeout_ms
+        self.max_concurrency = max_concurrency
+        self.queue_depth = queue_depth
+        self.client_streaming = client_streaming
+        self.server_streaming = server_streaming
+        self.stream_window = stream_window
+        self.coalesce = coalesce
+        # C# type and expression of the key a coalescing request is stored under
+        self.coalesce_key_type = coalesce_key_type
+        self.coalesce_key = coalesce_key
+        self.cacheable = cacheable
+        self.cache_size = cache_size
+        self.cache_ttl_ms = cache_ttl_ms
+
+    @property
+    def is_streaming(self) -> bool:
+        return self.client_streaming or self.server_streaming
\ No newline at end of file
@@ -1,99 +1,365 @@
-
 from typing import List
+from generator_options import GeneratorOptions
 from languages.csharp.csharp_method import CSharpMethod
+from languages.csharp.csharp_runtime_templates import RUNTIME_NAMESPACE
+from languages.csharp.csharp_stream_templates import (
+    get_stream_client_dispatch,
+    get_stream_client_dispose,
+    get_stream_client_members,
+    get_stream_client_method,
+    get_stream_server_members,
+    get_stream_server_method,
+    has_streaming_methods,
+)
 
-def get_rpc_client_handler(service_name:str,service_methods:List[CSharpMethod]):
+def get_arg_data_type(options:GeneratorOptions) -> str:
+    # zero copy handlers parse straight from the span the transport received into
+    return "ReadOnlySpan<byte>" if options.zero_copy else "byte[]?"
 
-    methods = ""
+def indent_lines(text:str,indent:str) -> str:
+    return "".join(f"{indent}{line}\n" for line in text.splitlines())
+
+def get_serialized_send(message:str,send:str,options:GeneratorOptions,indent:str,nullable:bool = False) -> str:
+    # `send` transmits the exactly sized span `data`; the size is computed once and small messages
+    # are serialized on the stack, larger ones into a pooled buffer
+    size = f"{message}?.CalculateSize() ?? 0" if nullable else f"{message}.CalculateSize()"
+    write = f"{message}?.WriteTo(data);" if nullable else f"{message}.WriteTo(data);"
+    if options.stackalloc_threshold == 0:
+        code = f"""var size = {size};
+var rented = ArrayPool<byte>.Shared.Rent(size);
+var data = new Span<byte>(rented, 0, size);
+{write}
+{send}
+ArrayPool<byte>.Shared.Return(rented);"""
+    else:
+        code = f"""var size = {size};
+byte[]? rented = null;
+Span<byte> data = size <= {options.stackalloc_threshold} ? stackalloc byte[size] : (rented = ArrayPool<byte>.Shared.Rent(size)).AsSpan(0, size);
+{write}
+{send}
+if (rented != null)
+    ArrayPool<byte>.Shared.Return(rented);"""
+    return indent_lines(code,indent)
+
+def get_metrics_name(m:CSharpMethod) -> str:
+    return f"metrics{m.name}"
+
+def get_metrics_fields(service_name:str,service_methods:List[CSharpMethod],side:str) -> str:
+    fields = ""
     for m in service_methods:
-        input_arg_name = m.input_args[0][0] if m.has_input_message else ""
-        out_param = f"Task<{m.return_type}>" if m.has_output else m.return_type
-        all_input_args = m.input_args + [("bool","isReliable")]
-        input_args = ",".join(map(lambda arg: f"{arg[0]} {arg[1]}",all_input_args))
+        if m.is_streaming:
+            continue
+        fields += f"""
+        static readonly global::{RUNTIME_NAMESPACE}.RpcMethodMetrics {get_metrics_name(m)} = new global::{RUNTIME_NAMESPACE}.RpcMethodMetrics({m.id}, "{service_name}.{m.name}", "{side}");"""
+    return fields
 
-        method = f"public {out_param} {m.name}({input_args})\n"
-        method += "{\n"
-        if not m.has_output:
-            if m.has_input_message:
-                method += f""" 
-          var size = message.CalculateSize();
-          var bytes = ArrayPool<byte>.Shared.Rent(size);
-          message.WriteTo(bytes);
-          client.CallRpc({m.id}, 0, {input_arg_name}.MessageId, new Span<byte>(bytes,0,size), isReliable);
-          ArrayPool<byte>.Shared.Return(bytes);
-"""
-            else:
-                method += f"client.CallRpc({m.id}, 0, 0, null, isReliable);"
+def get_client_send(m:CSharpMethod,request_id:str,options:GeneratorOptions,batched:bool = False) -> str:
+    indent = "          "
+    if batched:
+        # the batch serializes the message straight into its frame buffer
+        if not m.has_input_message:
+            send = f"{indent}batch.Append({m.id}, {request_id}, 0, null, isReliable);\n"
         else:
-            if  m.has_input_message:
-                method += f""" 
-          var size = message.CalculateSize();
-          var bytes = ArrayPool<byte>.Shared.Rent(size);
-          message.WriteTo(bytes);
+            send = f"{indent}batch.Append({m.id}, {request_id}, {m.input_args[0][0]}.MessageId, message, isReliable);\n"
+        if options.metrics:
+            send += f"{indent}{get_metrics_name(m)}.Call();\n"
+        return send
+    if not m.has_input_message:
+        send = f"{indent}client.CallRpc({m.id}, {request_id}, 0, Span<byte>.Empty, isReliable);\n"
+        if options.metrics:
+            send += f"{indent}{get_metrics_name(m)}.Call(0);\n"
+        return send
+    send = get_serialized_send("message",f"client.CallRpc({m.id}, {request_id}, {m.input_args[0][0]}.MessageId, data, isReliable);",options,indent)
+    if options.metrics:
+        send += f"{indent}{get_metrics_name(m)}.Call(size);\n"
+    return send
+
+def get_client_return_type(m:CSharpMethod,options:GeneratorOptions) -> str:
+    if not m.has_output:
+        return m.return_type
+    if options.client_requests == "slots":
+        return f"ValueTask<{m.return_type}>"
+    return f"Task<{m.return_type}>"
+
+def get_server_return_type(m:CSharpMethod,options:GeneratorOptions) -> str:
+    if not options.async_server:
+        return m.return_type
+    if not m.has_output:
+        return "ValueTask"
+    return f"ValueTask<{m.return_type}>"
+
+def get_client_response_factory(m:CSharpMethod,options:GeneratorOptions) -> str:
+    if options.pooling:
+        return f"static () => {m.return_type}.RentFromPool()"
+    return f"static () => new {m.return_type}()"
+
+def get_client_method_name(m:CSharpMethod,batched:bool) -> str:
+    return f"Batch{m.name}" if batched else m.name
+
+def get_client_slot_request(m:CSharpMethod,options:GeneratorOptions,batched:bool):
+    # the request object records latency, timeouts and mismatches itself
+    metrics = f", {get_metrics_name(m)}" if options.metrics else ""
+    # the request object is pooled and completes a ValueTask, so a call allocates nothing once pools are warm
+    return f"""
+          var request = global::{RUNTIME_NAMESPACE}.PendingRequest<{m.return_type}>.Rent({m.return_type}.MessageId, {get_client_response_factory(m,options)}{metrics});
+          var task = request.Task;
+          var reqId = pendingRequests.Register(request, {m.id}, {m.timeout_ms});
+{get_client_send(m,"reqId",options,batched)}          return task;
 """
-            else:
-               method += f"byte[] bytes= Array.Empty<byte>();"
 
-            method += f"""
+def get_client_response_dispatch(options:GeneratorOptions,streaming:bool):
+    stream_dispatch = get_stream_client_dispatch() if streaming else ""
+    if options.client_requests == "slots":
+        response_handlers = f"""
+      readonly global::{RUNTIME_NAMESPACE}.PendingRequestTable pendingRequests = new global::{RUNTIME_NAMESPACE}.PendingRequestTable({options.pending_slots});"""
+        complete_response = "pendingRequests.Complete(methodId, requestId, argType, argData);"
+    elif options.zero_copy:
+        response_handlers = f"""
+      delegate void RpcResponseHandler(long argType, ReadOnlySpan<byte> argData);
+      Dictionary<ulong, RpcResponseHandler> rpcResponseHandlers = new Dictionary<ulong, RpcResponseHandler>();"""
+        complete_response = """if(rpcResponseHandlers.TryGetValue(requestId, out var handler))
+              handler.Invoke(argType, argData);"""
+    else:
+        response_handlers = f"""
+      Dictionary<ulong, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate> rpcResponseHandlers = new Dictionary<ulong, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate>();"""
+        on_rpc_call = f"""
+      private void Client_OnRpcCall(global::OmgppSharpClientServer.Client client, System.Net.IPAddress remoteIp, ushort remotePort, bool isReliable, long methodId, ulong requestId, long argType, byte[]? argData)
+      {{
+          {stream_dispatch}if(rpcResponseHandlers.TryGetValue(requestId, out var handler))
+              handler.Invoke(client,remoteIp,remotePort, isReliable, methodId, requestId, argType, argData);
+      }}"""
+        return (response_handlers,on_rpc_call)
+
+    if not options.zero_copy:
+        on_rpc_call = f"""
+      private void Client_OnRpcCall(global::OmgppSharpClientServer.Client client, System.Net.IPAddress remoteIp, ushort remotePort, bool isReliable, long methodId, ulong requestId, long argType, byte[]? argData)
+      {{
+          {stream_dispatch}{complete_response}
+      }}"""
+        return (response_handlers,on_rpc_call)
+
+    on_rpc_call = f"""
+      private void Client_OnRpcCall(global::OmgppSharpClientServer.Client client, System.Net.IPAddress remoteIp, ushort remotePort, bool isReliable, long methodId, ulong requestId, long argType, byte[]? argData)
+      {{
+          HandleRpcResponse(methodId, requestId, argType, argData);
+      }}
+
+      public void HandleRpcResponse(long methodId, ulong requestId, long argType, ReadOnlySpan<byte> argData)
+      {{
+          {stream_dispatch}{complete_response}
+      }}
+
+      public void HandleRpcResponse(long methodId, ulong requestId, long argType, in ReadOnlySequence<byte> argData)
+      {{
+          if (argData.IsSingleSegment)
+          {{
+              HandleRpcResponse(methodId, requestId, argType, argData.FirstSpan);
+              return;
+          }}
+          var length = (int)argData.Length;
+          var bytes = ArrayPool<byte>.Shared.Rent(length);
+          argData.CopyTo(bytes);
+          HandleRpcResponse(methodId, requestId, argType, new ReadOnlySpan<byte>(bytes, 0, length));
+          ArrayPool<byte>.Shared.Return(bytes);
+      }}"""
+    return (response_handlers,on_rpc_call)
+
+def get_client_method(m:CSharpMethod,options:GeneratorOptions,batched:bool) -> str:
+    if options.zero_copy:
+        response_handler_args = "argType, argData"
+        # an empty span is a valid (all default) message, so only the type check decides
+        no_response_check = ""
+    else:
+        response_handler_args = "client, ip, port, isReliable, methodId, requestId, argType, argData"
+        no_response_check = "argData == null || "
+
+    out_param = get_client_return_type(m,options)
+    all_input_args = m.input_args + [("bool","isReliable")]
+    input_args = ",".join(map(lambda arg: f"{arg[0]} {arg[1]}",all_input_args))
+
+    if options.pooling:
+        # pooled responses are owned by the caller, which may hand them back with ReturnToPool
+        # a malformed response hands the rented instance back before the exception leaves the handler
+        parse_response = f"""var msg = {m.return_type}.RentFromPool();
+                  try
+                  {{
+                      msg.MergeFrom(argData);
+                  }}
+                  catch
+                  {{
+                      {m.return_type}.ReturnToPool(msg);
+                      throw;
+                  }}"""
+    else:
+        parse_response = f"var msg = {m.return_type}.Parser.ParseFrom(argData);"
+
+    (metrics_start,metrics_timeout,metrics_mismatch) = ("","","")
+    if options.metrics:
+        metrics = get_metrics_name(m)
+        metrics_start = f"\n          var started = global::{RUNTIME_NAMESPACE}.RpcMethodMetrics.Now();"
+        metrics_timeout = f"\n              {metrics}.Failed(global::{RUNTIME_NAMESPACE}.RpcMetrics.Timeout);"
+        metrics_mismatch = f"""
+                  if (!cancellationToken.Token.IsCancellationRequested)
+                      {metrics}.Failed(global::{RUNTIME_NAMESPACE}.RpcMetrics.ArgTypeMismatch);"""
+        parse_response = f"""{m.return_type} msg;
+                  try
+                  {{
+                      {parse_response.replace("var msg = ","msg = ").replace(chr(10),chr(10) + "    ")}
+                  }}
+                  catch (Exception e)
+                  {{
+                      {metrics}.Failed(global::{RUNTIME_NAMESPACE}.RpcMetrics.GetErrorType(e));
+                      throw;
+                  }}
+                  {metrics}.Completed(started, argData.Length);"""
+
+    method = f"public {out_param} {get_client_method_name(m,batched)}({input_args})\n"
+    method += "{\n"
+    if not m.has_output:
+        method += get_client_send(m,"0",options,batched)
+    elif options.client_requests == "slots":
+        method += get_client_slot_request(m,options,batched)
+    else:
+        method += f"""
           var taskCompletionSource = new TaskCompletionSource<{m.return_type}>();
-          var reqId = Interlocked.Increment(ref this.reqId);
+          var reqId = Interlocked.Increment(ref this.reqId);{metrics_start}
           var cancellationToken = new CancellationTokenSource();
-          cancellationToken.CancelAfter(1000);
+          cancellationToken.CancelAfter({m.timeout_ms});
 
           if(rpcResponseHandlers.ContainsKey(reqId))
           {{
-              ArrayPool<byte>.Shared.Return(bytes);
               throw new Exception("Internal error; Request Id already registered");
           }}
 
           var tokenRegisterHandler = cancellationToken.Token.Register(() =>
-          {{
+          {{{metrics_timeout}
               rpcResponseHandlers.Remove(reqId);
               taskCompletionSource.TrySetResult(default);
           }});
-          rpcResponseHandlers[reqId] = (client, ip, port, isReliable, methodId, requestId, argType, argData) =>
+          rpcResponseHandlers[reqId] = ({response_handler_args}) =>
           {{
               tokenRegisterHandler.Unregister();
-              if (argType != {m.return_type}.MessageId || argData == null || cancellationToken.Token.IsCancellationRequested)
-              {{
+              if (argType != {m.return_type}.MessageId || {no_response_check}cancellationToken.Token.IsCancellationRequested)
+              {{{metrics_mismatch}
                   taskCompletionSource.TrySetResult(default);
               }}
               else
               {{
-                  var msg = {m.return_type}.Parser.ParseFrom(argData);
+                  {parse_response}
                   taskCompletionSource.TrySetResult(msg);
               }}
               rpcResponseHandlers.Remove(reqId);
           }};
-          client.CallRpc({m.id}, reqId, {input_arg_name}.MessageId,new Span<byte>(bytes,0,size),isReliable);
-          ArrayPool<byte>.Shared.Return(bytes);
-          return taskCompletionSource.Task;
+{get_client_send(m,"reqId",options,batched)}          return taskCompletionSource.Task;
 """
+    method += "}\n"
+    return method
+
+def get_client_batch_members(options:GeneratorOptions) -> str:
+    return f"""
+      readonly global::{RUNTIME_NAMESPACE}.RpcBatchWriter batch;
+
+      // sends the calls collected by the Batch* methods
+      public void FlushBatch() => batch.Flush();
+      public int PendingBatchCalls => batch.Count;"""
+
+def get_client_batch_init(options:GeneratorOptions) -> str:
+    return f"""
+          batch = new global::{RUNTIME_NAMESPACE}.RpcBatchWriter((data, isReliable) => this.client.CallRpc(global::{RUNTIME_NAMESPACE}.RpcBatch.MethodId, 0, 0, data, isReliable), {options.batch_max_bytes}, {options.batch_flush_ms});"""
+
+def get_coalescing_client_methods(m:CSharpMethod,options:GeneratorOptions) -> str:
+    input_type = m.input_args[0][0]
+    method = f"public void {m.name}({input_type} message,bool isReliable)\n"
+    method += "{\n"
+    method += f"          coalesced{m.name}.Set({m.coalesce_key}, message, isReliable);\n"
+    method += "}\n"
+    if not options.batching:
+        method += f"private void SendCoalesced{m.name}({input_type} message,bool isReliable)\n"
+        method += "{\n"
+        method += get_client_send(m,"0",options)
         method += "}\n"
+    return method
+
+def get_coalescing_client_members(service_methods:List[CSharpMethod],options:GeneratorOptions) -> str:
+    coalescing = [m for m in service_methods if m.coalesce]
+    members = ""
+    flush = ""
+    for m in coalescing:
+        input_type = m.input_args[0][0]
+        slots_type = f"global::{RUNTIME_NAMESPACE}.LatestValueSlots<{m.coalesce_key_type}, {input_type}>"
+        members += f"""
+      readonly {slots_type} coalesced{m.name} = new {slots_type}();"""
+        if options.batching and options.metrics:
+            send = f"""{{
+                  batch.Append({m.id}, 0, {input_type}.MessageId, pending.Message, pending.IsReliable);
+                  {get_metrics_name(m)}.Call();
+              }}"""
+        elif options.batching:
+            send = f"batch.Append({m.id}, 0, {input_type}.MessageId, pending.Message, pending.IsReliable);"
+        else:
+            send = f"SendCoalesced{m.name}(pending.Message, pending.IsReliable);"
+        flush += f"""
+          var pending{m.name} = coalesced{m.name}.Take();
+          foreach (var pending in pending{m.name}.Values)
+              {send}
+          coalesced{m.name}.Recycle(pending{m.name});"""
+    if options.batching:
+        flush += """
+          batch.Flush();"""
+    superseded = " + ".join(f"coalesced{m.name}.Superseded" for m in coalescing)
+    return f"""{members}
+
+      // sends the newest request of every coalescing method and key since the last flush, e.g. once per tick;
+      // the messages passed to those methods must not be changed until then
+      public void FlushCoalesced()
+      {{{flush}
+      }}
+
+      // coalescing requests dropped because a newer one with the same key replaced them
+      public long SupersededCalls => {superseded};"""
+
+def get_rpc_client_handler(service_name:str,service_methods:List[CSharpMethod],options:GeneratorOptions):
+    methods = ""
+    for m in service_methods:
+        if m.is_streaming:
+            methods += get_stream_client_method(m)
+            continue
+        if m.coalesce:
+            methods += get_coalescing_client_methods(m,options)
+            continue
+        methods += get_client_method(m,options,False)
+        if options.batching:
+            methods += get_client_method(m,options,True)
 
-        methods += method
+    streaming = has_streaming_methods(service_methods)
+    (response_handlers,on_rpc_call) = get_client_response_dispatch(options,streaming)
+    if streaming:
+        response_handlers += get_stream_client_members()
+    if any(m.coalesce for m in service_methods):
+        response_handlers += get_coalescing_client_members(service_methods,options)
+    if options.metrics:
+        response_handlers += get_metrics_fields(service_name,service_methods,"client").replace("\n        ","\n      ")
+    batch_dispose = ""
+    if options.batching:
+        response_handlers += get_client_batch_members(options)
+        batch_dispose = """
+          batch.Dispose();"""
 
     return f"""
     public class {service_name}ClientHandler : I{service_name}Client, IDisposable
     {{
       global::OmgppSharpClientServer.Client client;
-      Dictionary<long, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate> rpcHandlers = new Dictionary<long, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate>();
-      Dictionary<ulong, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate> rpcResponseHandlers = new Dictionary<ulong, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate>();
+      Dictionary<long, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate> rpcHandlers = new Dictionary<long, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate>();{response_handlers}
       ulong reqId = 0;
       public {service_name}ClientHandler(global::OmgppSharpClientServer.Client client)
       {{
           this.client = client;
-          this.client.OnRpcCall += Client_OnRpcCall;
-      }}
-
-      private void Client_OnRpcCall(global::OmgppSharpClientServer.Client client, System.Net.IPAddress remoteIp, ushort remotePort, bool isReliable, long methodId, ulong requestId, long argType, byte[]? argData)
-      {{
-          if(rpcResponseHandlers.TryGetValue(requestId, out var handler))
-              handler.Invoke(client,remoteIp,remotePort, isReliable, methodId, requestId, argType, argData);
+          this.client.OnRpcCall += Client_OnRpcCall;{get_client_batch_init(options) if options.batching else ""}
       }}
+{on_rpc_call}
       public void Dispose()
       {{
-          this.client.OnRpcCall -= Client_OnRpcCall;
+          this.client.OnRpcCall -= Client_OnRpcCall;{get_stream_client_dispose(service_name) if streaming else ""}{batch_dispose}
       }}
 
       void RegisterRpc(long id, OmgppSharpClientServer.IClientRpcHandler.ClientRpcHandlerDelegate handlerAction)
@@ -107,63 +373,353 @@ def get_rpc_client_handler(service_name:str,service_methods:List[CSharpMethod]):
     pass
 
 
-def get_rpc_server_handler(service_name,service_methods:List[CSharpMethod]):
+def get_server_service_call(m:CSharpMethod,options:GeneratorOptions):
+    input_type = m.input_args[0][0]
+    if not options.pooling:
+        result_assignment = "var result = " if m.has_output else ""
+        return f"{result_assignment}service.{m.name}(clientGuid, ip, port, {input_type}.Parser.ParseFrom(argData));\n"
+
+    # the pooled message is only valid for the duration of the service call
+    call = ""
+    result_assignment = ""
+    if m.has_output:
+        call += f"{m.return_type} result;\n"
+        result_assignment = "result = "
+    call += f"""var message = {input_type}.RentFromPool();
+try
+{{
+    message.MergeFrom(argData);
+    {result_assignment}service.{m.name}(clientGuid, ip, port, message);
+}}
+finally
+{{
+    {input_type}.ReturnToPool(message);
+}}
+"""
+    return call
+
+def get_arg_type_check(m:CSharpMethod,options:GeneratorOptions) -> str:
+    if not options.metrics:
+        return f"if (argType != {m.input_args[0][0]}.MessageId) return;\n"
+    return f"""if (argType != {m.input_args[0][0]}.MessageId)
+{{
+    {get_metrics_name(m)}.Failed(global::{RUNTIME_NAMESPACE}.RpcMetrics.ArgTypeMismatch);
+    return;
+}}
+"""
+
+def get_server_metrics_body(m:CSharpMethod,check:str,body:str,completed:str,options:GeneratorOptions) -> str:
+    # the call is counted before the argType check, failures are recorded and rethrown unchanged
+    if not options.metrics:
+        return check + body
+    metrics = get_metrics_name(m)
+    arg_data_length = "argData.Length" if options.zero_copy else "argData?.Length ?? 0"
+    completed = f"    {metrics}.{completed};\n" if completed is not None else ""
+    return f"""var started = global::{RUNTIME_NAMESPACE}.RpcMethodMetrics.Now();
+{metrics}.Call({arg_data_length});
+{check}try
+{{
+{indent_lines(body,"    ")}{completed}}}
+catch (Exception e)
+{{
+    {metrics}.Failed(global::{RUNTIME_NAMESPACE}.RpcMetrics.GetErrorType(e));
+    throw;
+}}
+"""
+
+def get_cache_name(m:CSharpMethod) -> str:
+    return f"{m.name}Cache"
+
+def get_server_cache_lookup(m:CSharpMethod,key:str,options:GeneratorOptions) -> str:
+    # a hit sends the stored bytes as they are, without calling the service or serializing
+    if not m.cacheable:
+        return ""
+    completed = f"\n    {get_metrics_name(m)}.Completed(started, cached.Length);" if options.metrics else ""
+    return f"""if ({get_cache_name(m)}.TryGet({key}, out var cached))
+{{
+    server.CallRpc(clientGuid, methodId, requestId, {m.return_type}.MessageId, cached, isReliable);{completed}
+    return;
+}}
+var cacheVersion = {get_cache_name(m)}.Version;
+"""
+
+def get_server_result_send(m:CSharpMethod,cache_key:str) -> str:
+    send = f"server.CallRpc(clientGuid, methodId, requestId, {m.return_type}.MessageId, data, isReliable);"
+    if m.cacheable:
+        send += f"\n{get_cache_name(m)}.Add({cache_key}, data, cacheVersion);"
+    return send
+
+def get_response_cache_members(service_methods:List[CSharpMethod]) -> str:
+    members = ""
+    for m in service_methods:
+        if not m.cacheable:
+            continue
+        members += f"""
+        public global::{RUNTIME_NAMESPACE}.ResponseCache {get_cache_name(m)} {{ get; }} = new global::{RUNTIME_NAMESPACE}.ResponseCache({m.cache_size}, {m.cache_ttl_ms});"""
+        if m.has_input_message:
+            # entries are keyed by the request bytes; this matches them as long as clients serialize with Google.Protobuf too
+            members += f"""
+        public bool Invalidate{m.name}({m.input_args[0][0]} message) => {get_cache_name(m)}.Invalidate(message.ToByteArray());"""
+        else:
+            members += f"""
+        public void Invalidate{m.name}() => {get_cache_name(m)}.Clear();"""
+    clears = "".join(f"""
+            {get_cache_name(m)}.Clear();""" for m in service_methods if m.cacheable)
+    members += f"""
+        // call when the data the cached responses were computed from changes
+        public void ClearResponseCaches()
+        {{{clears}
+        }}
+"""
+    return members
+
+def get_async_server_methods(m:CSharpMethod,options:GeneratorOptions) -> str:
+    # the request is parsed on the calling (network) thread, where argData is valid; the service call
+    # and the response run on the thread pool once the method's work queue has a free slot
+    arg_data_type = get_arg_data_type(options)
+    context_params = "global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId"
+    context_args = "server, clientGuid, ip, port, isReliable, methodId, requestId"
+    if options.metrics:
+        # latency includes the time spent waiting in the work queue
+        context_params += ", long started"
+        context_args += ", started"
+    if m.cacheable:
+        # argData is only valid on the calling thread, so the cache key is copied for the response
+        context_params += ", byte[] cacheKey, long cacheVersion"
+        context_args += ", cacheKey, cacheVersion"
+    queue = f"{m.name}Queue"
+    method = f"private void Handle{m.name}(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, {arg_data_type} argData)"
+    method += "{\n"
+    run_params = context_params
+    run_args = context_args
+    call_args = "clientGuid, ip, port"
+    check = ""
+    body = ""
+    if m.has_input_message:
+        input_type = m.input_args[0][0]
+        check = get_arg_type_check(m,options)
+        if not options.zero_copy:
+            body += f"argData = argData?? Array.Empty<byte>();\n"
+        body += get_server_cache_lookup(m,"argData",options)
+        if m.cacheable:
+            body += "var cacheKey = ((ReadOnlySpan<byte>)argData).ToArray();\n"
+        if options.pooling:
+            # Run<Method> returns the message to the pool, unless it is malformed and never gets there
+            body += f"""var message = {input_type}.RentFromPool();
+try
+{{
+    message.MergeFrom(argData);
+}}
+catch
+{{
+    {input_type}.ReturnToPool(message);
+    throw;
+}}
+"""
+        else:
+            body += f"var message = {input_type}.Parser.ParseFrom(argData);\n"
+        run_params += f", {input_type} message"
+        run_args += ", message"
+        call_args += ", message"
+    elif m.cacheable:
+        body += get_server_cache_lookup(m,"ReadOnlySpan<byte>.Empty",options)
+        body += "var cacheKey = Array.Empty<byte>();\n"
+    rejected = f"{get_metrics_name(m)}.Failed(global::{RUNTIME_NAMESPACE}.RpcMetrics.Rejected);" if options.metrics else None
+    if options.pooling and m.has_input_message:
+        body += f"if (!{queue}.TryEnqueue(() => Run{m.name}({run_args})))\n"
+        if rejected is not None:
+            body += f"{{\n    {m.input_args[0][0]}.ReturnToPool(message);\n    {rejected}\n}}\n"
+        else:
+            body += f"    {m.input_args[0][0]}.ReturnToPool(message);\n"
+    elif rejected is not None:
+        body += f"if (!{queue}.TryEnqueue(() => Run{m.name}({run_args})))\n"
+        body += f"    {rejected}\n"
+    else:
+        body += f"{queue}.TryEnqueue(() => Run{m.name}({run_args}));\n"
+    method += get_server_metrics_body(m,check,body,None,options)
+    method += "}\n"
+
+    method += f"private async ValueTask Run{m.name}({run_params})\n"
+    method += "{\n"
+    body = ""
+    if options.pooling and m.has_input_message:
+        result_assignment = ""
+        if m.has_output:
+            body += f"{m.return_type} result;\n"
+            result_assignment = "result = "
+        # the pooled message is only valid until the service call completes
+        body += f"""try
+{{
+    {result_assignment}await service.{m.name}({call_args});
+}}
+finally
+{{
+    {m.input_args[0][0]}.ReturnToPool(message);
+}}
+"""
+    else:
+        result_assignment = "var result = " if m.has_output else ""
+        body += f"{result_assignment}await service.{m.name}({call_args});\n"
+    started = ", started" if options.metrics else ""
+    if m.cacheable:
+        started += ", cacheKey, cacheVersion"
+    if m.has_output:
+        # spans cannot live in async methods, so the response is serialized in a synchronous helper
+        body += f"Send{m.name}Result(server, clientGuid, isReliable, methodId, requestId, result{started});\n"
+    if options.metrics:
+        body = f"""try
+{{
+{indent_lines(body,"    ")}}}
+catch (Exception e)
+{{
+    {get_metrics_name(m)}.Failed(global::{RUNTIME_NAMESPACE}.RpcMetrics.GetErrorType(e));
+    throw;
+}}
+"""
+        if not m.has_output:
+            body += f"{get_metrics_name(m)}.Completed(started);\n"
+    method += body
+    method += "}\n"
+
+    if m.has_output:
+        started_param = ", long started" if options.metrics else ""
+        if m.cacheable:
+            started_param += ", byte[] cacheKey, long cacheVersion"
+        method += f"private void Send{m.name}Result(global::OmgppSharpClientServer.Server server, Guid clientGuid, bool isReliable, long methodId, ulong requestId, {m.return_type} result{started_param})"
+        method += "{\n"
+        method += get_serialized_send("result",get_server_result_send(m,"cacheKey"),options,"",nullable=True)
+        if options.metrics:
+            method += f"{get_metrics_name(m)}.Completed(started, size);\n"
+        method += "}\n"
+    return method
+
+def get_server_work_queues(service_methods:List[CSharpMethod]) -> str:
+    # streaming calls run for the lifetime of the stream and are not queued
+    service_methods = [m for m in service_methods if not m.is_streaming]
+    queues = ""
+    for m in service_methods:
+        max_concurrency = m.max_concurrency if m.max_concurrency > 0 else "Environment.ProcessorCount"
+        queues += f"""
+        public global::Omgpp.Runtime.BoundedWorkQueue {m.name}Queue {{ get; }} = new global::Omgpp.Runtime.BoundedWorkQueue({max_concurrency}, {m.queue_depth});"""
+    rejected = " + ".join(f"{m.name}Queue.Rejected" for m in service_methods) or "0"
+    queues += f"""
+        // calls dropped because the method's work queue was full
+        public long Rejected => {rejected};
+"""
+    return queues
+
+def get_rpc_server_handler(service_name,service_methods:List[CSharpMethod],options:GeneratorOptions):
+    arg_data_type = get_arg_data_type(options)
     handle_methods = ""
     for m in service_methods:
-        method = f"private void Handle{m.name}(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, byte[]? argData)"
+        if m.is_streaming:
+            handle_methods += get_stream_server_method(m,arg_data_type)
+            continue
+        if options.async_server:
+            handle_methods += get_async_server_methods(m,options)
+            continue
+        method = f"private void Handle{m.name}(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, {arg_data_type} argData)"
         method += "{\n"
-        if not m.has_output:
-            if m.has_input_message:
-                method += f"if (argType != {m.input_args[0][0]}.MessageId) return;\n"
-                method += f"argData = argData?? Array.Empty<byte>();\n"
-                method += f"service.{m.name}(clientGuid, ip, port, {m.input_args[0][0]}.Parser.ParseFrom(argData));\n"
-            else:
-                method += f"service.{m.name}(clientGuid, ip, port);\n"
+        check = ""
+        body = ""
+        if m.has_input_message:
+            check = get_arg_type_check(m,options)
+            if not options.zero_copy:
+                body += f"argData = argData?? Array.Empty<byte>();\n"
+            body += get_server_cache_lookup(m,"argData",options)
+            body += get_server_service_call(m,options)
+        elif m.has_output:
+            body += get_server_cache_lookup(m,"ReadOnlySpan<byte>.Empty",options)
+            body += f"var result = service.{m.name}(clientGuid, ip, port);\n"
         else:
-            if  m.has_input_message:
-                method += f"if (argType != {m.input_args[0][0]}.MessageId) return;\n"
-                method += f"argData = argData?? Array.Empty<byte>();\n"
-                method += f"var result = service.{m.name}(clientGuid, ip, port, {m.input_args[0][0]}.Parser.ParseFrom(argData));\n"
-            else:
-                method += f"var result = service.{m.name}(clientGuid, ip, port);\n"
-            
-            method += f"""var size = result?.CalculateSize() ?? 0;
-                var data = ArrayPool<byte>.Shared.Rent(size);
-                result?.WriteTo(data);
-                server.CallRpc(clientGuid, methodId, requestId, {m.input_args[0][0]}.MessageId, new Span<byte>(data,0,size), isReliable);
-                ArrayPool<byte>.Shared.Return(data);\n
-"""
+            body += f"service.{m.name}(clientGuid, ip, port);\n"
+
+        if m.has_output:
+            cache_key = "argData" if m.has_input_message else "ReadOnlySpan<byte>.Empty"
+            body += get_serialized_send("result",get_server_result_send(m,cache_key),options,"",nullable=True)
 
+        method += get_server_metrics_body(m,check,body,"Completed(started, size)" if m.has_output else "Completed(started)",options)
         method += "}\n"
 
         handle_methods += method
 
 
-    register_handle_methods = ""
+    # a switch over constant method ids lets the C# compiler emit a jump table for dense ids
+    # and a binary search for sparse ones, without a dictionary probe or delegate invocation
+    dispatch_cases = ""
     for m in service_methods:
-        register_handle_methods += f"RegisterRpc({m.id}, Handle{m.name});\n"
+        dispatch_cases += f"""
+                case {m.id}:
+                    Handle{m.name}(server, clientGuid, ip, port, isReliable, methodId, requestId, argType, argData);
+                    return;"""
+    if options.batching:
+        dispatch_cases += f"""
+                case global::{RUNTIME_NAMESPACE}.RpcBatch.MethodId:
+                    HandleBatch(server, clientGuid, ip, port, isReliable, argData);
+                    return;"""
+        handle_methods += get_server_batch_method()
 
     return f"""
     public class {service_name}ServerHandler : global::OmgppSharpClientServer.IServerRpcHandler
     {{
         I{service_name}Server service;
-        Dictionary<long,ServerRpcHandlerDelegate> rpcHandlers = new Dictionary<long, ServerRpcHandlerDelegate>();
 
         public {service_name}ServerHandler(I{service_name}Server service)
         {{
             this.service = service;
-            {register_handle_methods}
-        }}
+        }}{get_metrics_fields(service_name,service_methods,"server") if options.metrics else ""}{get_server_work_queues(service_methods) if options.async_server else ""}{get_stream_server_members() if has_streaming_methods(service_methods) else ""}{get_response_cache_members(service_methods) if any(m.cacheable for m in service_methods) else ""}
         {handle_methods}
- 
+ {get_server_dispatch(dispatch_cases,options)}
+    }}
+"""
+
+def get_server_batch_method() -> str:
+    # batching requires zero_copy, so every call gets a slice of the frame
+    return f"""private void HandleBatch(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, ReadOnlySpan<byte> frame)
+{{
+    while (global::{RUNTIME_NAMESPACE}.RpcBatch.TryReadEntry(ref frame, out var methodId, out var requestId, out var argType, out var payload))
+    {{
+        // batches do not nest
+        if (methodId != global::{RUNTIME_NAMESPACE}.RpcBatch.MethodId)
+            HandleRpc(server, clientGuid, ip, port, isReliable, methodId, requestId, argType, payload);
+    }}
+}}
+"""
+
+def get_server_dispatch(dispatch_cases:str,options:GeneratorOptions):
+    if not options.zero_copy:
+        return f"""
         public void HandleRpc(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, byte[]? argData)
         {{
-            if (rpcHandlers.TryGetValue(methodId, out var handler))
-                handler.Invoke(server, clientGuid, ip, port,isReliable,methodId,requestId, argType, argData);
+            switch (methodId)
+            {{{dispatch_cases}
+            }}
+        }}"""
+
+    return f"""
+        public void HandleRpc(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, byte[]? argData)
+        {{
+            HandleRpc(server, clientGuid, ip, port, isReliable, methodId, requestId, argType, new ReadOnlySpan<byte>(argData));
         }}
-        void RegisterRpc(long id,ServerRpcHandlerDelegate handlerAction)
+
+        public void HandleRpc(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, ReadOnlySpan<byte> argData)
         {{
-            rpcHandlers[id] = handlerAction;
+            switch (methodId)
+            {{{dispatch_cases}
+            }}
         }}
-    }}
-"""
\ No newline at end of file
+
+        public void HandleRpc(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, in ReadOnlySequence<byte> argData)
+        {{
+            if (argData.IsSingleSegment)
+            {{
+                HandleRpc(server, clientGuid, ip, port, isReliable, methodId, requestId, argType, argData.FirstSpan);
+                return;
+            }}
+            // protobuf parses a span in place, so only fragmented payloads are gathered into a pooled buffer
+            var length = (int)argData.Length;
+            var bytes = ArrayPool<byte>.Shared.Rent(length);
+            argData.CopyTo(bytes);
+            HandleRpc(server, clientGuid, ip, port, isReliable, methodId, requestId, argType, new ReadOnlySpan<byte>(bytes, 0, length));
+            ArrayPool<byte>.Shared.Return(bytes);
+        }}"""
\ No newline at end of file
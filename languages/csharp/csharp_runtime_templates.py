@@ -0,0 +1,1251 @@
+
+from generator_options import GeneratorOptions
+
+RUNTIME_NAMESPACE = "Omgpp.Runtime"
+
+def get_object_pool():
+    return """
+    // bounded lock-free pool; Rent never blocks and Return drops items when the pool is full
+    public sealed class ObjectPool<T> where T : class, new()
+    {
+        readonly T?[] items;
+        T? firstItem;
+
+        public ObjectPool(int size)
+        {
+            items = new T?[Math.Max(0, size - 1)];
+        }
+
+        public T Rent()
+        {
+            var item = firstItem;
+            if (item != null && Interlocked.CompareExchange(ref firstItem, null, item) == item)
+                return item;
+            var items = this.items;
+            for (var i = 0; i < items.Length; i++)
+            {
+                item = items[i];
+                if (item != null && Interlocked.CompareExchange(ref items[i], null, item) == item)
+                    return item;
+            }
+            return new T();
+        }
+
+        public void Return(T item)
+        {
+            if (firstItem == null && Interlocked.CompareExchange(ref firstItem, item, null) == null)
+                return;
+            var items = this.items;
+            for (var i = 0; i < items.Length; i++)
+            {
+                if (Interlocked.CompareExchange(ref items[i], item, null) == null)
+                    return;
+            }
+        }
+    }
+"""
+
+def get_pending_requests(options:GeneratorOptions):
+    (metrics_fields,metrics_param,metrics_rent,metrics_mismatch,metrics_completed,metrics_failed,metrics_timeout,metrics_reset) = [""] * 8
+    if options.metrics:
+        metrics_fields = """
+        RpcMethodMetrics? metrics;
+        long started;"""
+        metrics_param = ", RpcMethodMetrics? metrics = null"
+        metrics_rent = """
+            request.metrics = metrics;
+            request.started = metrics != null ? RpcMethodMetrics.Now() : 0;"""
+        metrics_mismatch = """
+                metrics?.Failed(RpcMetrics.ArgTypeMismatch);"""
+        metrics_completed = """
+                metrics?.Completed(started, argData.Length);"""
+        metrics_failed = """
+                metrics?.Failed(RpcMetrics.GetErrorType(e));"""
+        metrics_timeout = """
+            metrics?.Failed(RpcMetrics.Timeout);"""
+        metrics_reset = """
+                metrics = null;"""
+    return f"""
+    public interface IPendingRequest
+    {{
+        ulong RequestId {{ get; set; }}
+        long MethodId {{ get; set; }}
+        void Complete(long argType, ReadOnlySpan<byte> argData);
+        void Expire();
+    }}
+
+    // requests in flight indexed by reqId modulo the table size; a request remembers the reqId it was
+    // registered with, so a late response for an expired request never completes a newer one. Every client
+    // handler of a Client sees every response and counts reqIds on its own, so the methodId must match too
+    public sealed class PendingRequestTable
+    {{
+        readonly IPendingRequest?[] slots;
+        readonly ulong mask;
+        long nextRequestId;
+
+        public PendingRequestTable(int size)
+        {{
+            slots = new IPendingRequest?[size];
+            mask = (ulong)size - 1;
+        }}
+
+        public ulong Register(IPendingRequest request, long methodId, int timeoutMs)
+        {{
+            request.MethodId = methodId;
+            for (var attempt = 0; attempt < slots.Length; attempt++)
+            {{
+                var requestId = (ulong)Interlocked.Increment(ref nextRequestId);
+                request.RequestId = requestId;
+                if (Interlocked.CompareExchange(ref slots[requestId & mask], request, null) == null)
+                {{
+                    TimerWheel.Shared.Schedule(this, requestId, timeoutMs);
+                    return requestId;
+                }}
+            }}
+            throw new InvalidOperationException($"More than {{slots.Length}} requests in flight");
+        }}
+
+        public void Complete(long methodId, ulong requestId, long argType, ReadOnlySpan<byte> argData)
+        {{
+            TryTake(requestId, methodId)?.Complete(argType, argData);
+        }}
+
+        internal void Expire(ulong requestId)
+        {{
+            TryTake(requestId, null)?.Expire();
+        }}
+
+        IPendingRequest? TryTake(ulong requestId, long? methodId)
+        {{
+            ref var slot = ref slots[requestId & mask];
+            var request = Volatile.Read(ref slot);
+            if (request == null || request.RequestId != requestId || (methodId.HasValue && request.MethodId != methodId.Value))
+                return null;
+            if (Interlocked.CompareExchange(ref slot, null, request) != request)
+                return null;
+            if (request.RequestId != requestId)
+            {{
+                // the request completed and was reused for a newer reqId between the check and the exchange
+                Interlocked.CompareExchange(ref slot, request, null);
+                return null;
+            }}
+            return request;
+        }}
+    }}
+
+    // one process wide hashed timer wheel for request timeouts; scheduling takes a short bucket lock
+    // and does not allocate once the bucket arrays have grown to the steady state
+    public sealed class TimerWheel
+    {{
+        public static TimerWheel Shared {{ get; }} = new TimerWheel({options.timer_tick_ms}, 1024);
+
+        struct Entry
+        {{
+            public PendingRequestTable Table;
+            public ulong RequestId;
+            public long DueTick;
+        }}
+
+        sealed class Bucket
+        {{
+            public Entry[] Entries = new Entry[8];
+            public int Count;
+        }}
+
+        readonly Bucket[] buckets;
+        readonly long mask;
+        readonly int tickMs;
+        readonly long startTime = Environment.TickCount64;
+        readonly object tickLock = new object();
+        readonly Timer timer;
+        long processedTick;
+
+        public TimerWheel(int tickMs, int size)
+        {{
+            this.tickMs = tickMs;
+            buckets = new Bucket[size];
+            for (var i = 0; i < size; i++)
+                buckets[i] = new Bucket();
+            mask = size - 1;
+            timer = new Timer(_ => Advance(), null, tickMs, tickMs);
+        }}
+
+        public void Schedule(PendingRequestTable table, ulong requestId, int timeoutMs)
+        {{
+            // round up so a request never expires early
+            var dueTick = (Environment.TickCount64 - startTime + timeoutMs + tickMs - 1) / tickMs;
+            while (true)
+            {{
+                dueTick = Math.Max(dueTick, Volatile.Read(ref processedTick) + 1);
+                var bucket = buckets[dueTick & mask];
+                lock (bucket)
+                {{
+                    // processedTick advances under the lock of the swept bucket, so this check cannot race a sweep;
+                    // a tick processed since the read above moves the entry to the next tick
+                    if (dueTick > Volatile.Read(ref processedTick))
+                    {{
+                        if (bucket.Count == bucket.Entries.Length)
+                            Array.Resize(ref bucket.Entries, bucket.Count * 2);
+                        bucket.Entries[bucket.Count++] = new Entry {{ Table = table, RequestId = requestId, DueTick = dueTick }};
+                        return;
+                    }}
+                }}
+            }}
+        }}
+
+        void Advance()
+        {{
+            // timer callbacks overlap when one runs late; the one holding the lock catches up on every elapsed tick
+            if (!Monitor.TryEnter(tickLock))
+                return;
+            try
+            {{
+                var now = (Environment.TickCount64 - startTime) / tickMs;
+                while (processedTick < now)
+                {{
+                    var tick = processedTick + 1;
+                    Expire(buckets[tick & mask], tick);
+                }}
+            }}
+            finally
+            {{
+                Monitor.Exit(tickLock);
+            }}
+        }}
+
+        void Expire(Bucket bucket, long tick)
+        {{
+            lock (bucket)
+            {{
+                var kept = 0;
+                for (var i = 0; i < bucket.Count; i++)
+                {{
+                    var entry = bucket.Entries[i];
+                    // requests answered in time are no longer in their table, so expiring them is a no-op
+                    if (entry.DueTick <= tick)
+                        entry.Table.Expire(entry.RequestId);
+                    else
+                        bucket.Entries[kept++] = entry;
+                }}
+                Array.Clear(bucket.Entries, kept, bucket.Count - kept);
+                bucket.Count = kept;
+                Volatile.Write(ref processedTick, tick);
+            }}
+        }}
+    }}
+
+    // pooled IValueTaskSource completed by a response or by the timer wheel; continuations never run inline
+    // on the network or timer thread. The ValueTask must be awaited exactly once.
+    public sealed class PendingRequest<T> : IPendingRequest, System.Threading.Tasks.Sources.IValueTaskSource<T?> where T : class, global::Google.Protobuf.IMessage<T>
+    {{
+        static readonly ObjectPool<PendingRequest<T>> pool = new ObjectPool<PendingRequest<T>>({options.pool_size});
+
+        System.Threading.Tasks.Sources.ManualResetValueTaskSourceCore<T?> core = new System.Threading.Tasks.Sources.ManualResetValueTaskSourceCore<T?> {{ RunContinuationsAsynchronously = true }};
+        long responseType;
+        Func<T>? factory;{metrics_fields}
+
+        public ulong RequestId {{ get; set; }}
+        public long MethodId {{ get; set; }}
+        public ValueTask<T?> Task => new ValueTask<T?>(this, core.Version);
+
+        public static PendingRequest<T> Rent(long responseType, Func<T> factory{metrics_param})
+        {{
+            var request = pool.Rent();
+            request.responseType = responseType;
+            request.factory = factory;{metrics_rent}
+            return request;
+        }}
+
+        public void Complete(long argType, ReadOnlySpan<byte> argData)
+        {{
+            if (argType != responseType)
+            {{{metrics_mismatch}
+                core.SetResult(default);
+                return;
+            }}
+            try
+            {{
+                var message = factory!();
+                global::Google.Protobuf.MessageExtensions.MergeFrom(message, argData);{metrics_completed}
+                core.SetResult(message);
+            }}
+            catch (Exception e)
+            {{{metrics_failed}
+                core.SetException(e);
+            }}
+        }}
+
+        public void Expire()
+        {{{metrics_timeout}
+            core.SetResult(default);
+        }}
+
+        public T? GetResult(short token)
+        {{
+            try
+            {{
+                return core.GetResult(token);
+            }}
+            finally
+            {{
+                core.Reset();
+                factory = null;{metrics_reset}
+                pool.Return(this);
+            }}
+        }}
+
+        public System.Threading.Tasks.Sources.ValueTaskSourceStatus GetStatus(short token) => core.GetStatus(token);
+
+        public void OnCompleted(Action<object?> continuation, object? state, short token, System.Threading.Tasks.Sources.ValueTaskSourceOnCompletedFlags flags)
+        {{
+            core.OnCompleted(continuation, state, token, flags);
+        }}
+    }}
+"""
+
+def get_bounded_work_queue():
+    return """
+    // runs at most maxConcurrency work items at once on the thread pool and holds up to queueDepth more;
+    // items beyond that are rejected. A finishing item starts the next queued one on the same worker.
+    public sealed class BoundedWorkQueue
+    {
+        readonly Queue<Func<ValueTask>> queue = new Queue<Func<ValueTask>>();
+        readonly Action<Func<ValueTask>> start;
+        readonly int maxConcurrency;
+        readonly int queueDepth;
+        int running;
+        long rejected;
+        long faulted;
+
+        public BoundedWorkQueue(int maxConcurrency, int queueDepth)
+        {
+            this.maxConcurrency = Math.Max(1, maxConcurrency);
+            this.queueDepth = queueDepth;
+            start = work => _ = RunAsync(work);
+        }
+
+        public long Rejected => Interlocked.Read(ref rejected);
+        public long Faulted => Interlocked.Read(ref faulted);
+        public int Running => Volatile.Read(ref running);
+        public int Queued
+        {
+            get
+            {
+                lock (queue)
+                    return queue.Count;
+            }
+        }
+
+        // called with exceptions thrown by work items, which would otherwise be lost
+        public Action<Exception>? OnError { get; set; }
+
+        public bool TryEnqueue(Func<ValueTask> work)
+        {
+            lock (queue)
+            {
+                if (running >= maxConcurrency)
+                {
+                    if (queue.Count >= queueDepth)
+                    {
+                        rejected++;
+                        return false;
+                    }
+                    queue.Enqueue(work);
+                    return true;
+                }
+                running++;
+            }
+            ThreadPool.UnsafeQueueUserWorkItem(start, work, preferLocal: false);
+            return true;
+        }
+
+        async Task RunAsync(Func<ValueTask> work)
+        {
+            while (true)
+            {
+                try
+                {
+                    await work();
+                }
+                catch (Exception e)
+                {
+                    Interlocked.Increment(ref faulted);
+                    OnError?.Invoke(e);
+                }
+                lock (queue)
+                {
+                    if (queue.Count == 0)
+                    {
+                        running--;
+                        return;
+                    }
+                    work = queue.Dequeue();
+                }
+            }
+        }
+    }
+"""
+
+def get_streams(options:GeneratorOptions):
+    return f"""
+    public delegate void StreamFrameSender(long argType, Span<byte> data);
+
+    public static class StreamFrames
+    {{
+        // stream ids carry the top bit, so a client tells stream frames from unary responses by requestId alone
+        public const ulong StreamIdFlag = 1UL << 63;
+        // argType of control frames; data frames carry the MessageId of the streamed message (0 for google.protobuf.Empty)
+        public const long Open = long.MinValue;
+        public const long End = long.MinValue + 1;
+        public const long Credit = long.MinValue + 2;
+        public const long Cancel = long.MinValue + 3;
+        public const long Error = long.MinValue + 4;
+
+        static long nextStreamId;
+
+        public static ulong NextStreamId() => (ulong)Interlocked.Increment(ref nextStreamId) | StreamIdFlag;
+        public static bool IsStreamId(ulong requestId) => (requestId & StreamIdFlag) != 0;
+
+        public static void SendMessage(StreamFrameSender send, long messageId, global::Google.Protobuf.IMessage message)
+        {{
+{get_stream_serialized_send(options)}
+        }}
+
+        public static void SendInt(StreamFrameSender send, long frame, int value)
+        {{
+            Span<byte> data = stackalloc byte[4];
+            System.Buffers.Binary.BinaryPrimitives.WriteInt32LittleEndian(data, value);
+            send(frame, data);
+        }}
+
+        public static void SendText(StreamFrameSender send, long frame, string text)
+        {{
+            var data = System.Text.Encoding.UTF8.GetBytes(text);
+            send(frame, data);
+        }}
+    }}
+
+    public sealed class RpcStreamException : Exception
+    {{
+        public RpcStreamException(string message, Exception? innerException = null) : base(message, innerException) {{ }}
+    }}
+
+    public interface IStreamEndpoint
+    {{
+        void OnFrame(long argType, ReadOnlySpan<byte> data);
+        // the peer is gone; nothing is sent to it any more
+        void Abort(Exception error);
+    }}
+
+    public sealed class StreamTable<TKey> where TKey : notnull
+    {{
+        readonly System.Collections.Concurrent.ConcurrentDictionary<TKey, IStreamEndpoint> streams = new System.Collections.Concurrent.ConcurrentDictionary<TKey, IStreamEndpoint>();
+
+        public int Count => streams.Count;
+
+        public bool TryAdd(TKey key, IStreamEndpoint stream) => streams.TryAdd(key, stream);
+
+        public void Remove(TKey key) => streams.TryRemove(key, out _);
+
+        // frames of unknown streams (e.g. closed ones still in flight) are dropped
+        public bool Dispatch(TKey key, long argType, ReadOnlySpan<byte> data)
+        {{
+            if (!streams.TryGetValue(key, out var stream))
+                return false;
+            stream.OnFrame(argType, data);
+            return true;
+        }}
+
+        public void AbortWhere(Func<TKey, bool> predicate, Exception error)
+        {{
+            foreach (var pair in streams)
+            {{
+                if (predicate(pair.Key) && streams.TryRemove(pair.Key, out var stream))
+                    stream.Abort(error);
+            }}
+        }}
+    }}
+
+    // one end of a stream: received messages wait in a buffer of `window` messages and the sender may only have
+    // as many messages outstanding as it holds credit for; credit is returned in batches as the reader consumes
+    public sealed class RpcStream<TIn> : IStreamEndpoint, IDisposable where TIn : class, global::Google.Protobuf.IMessage<TIn>
+    {{
+        // wakes writers waiting for credit once the stream closed
+        const int ClosedCredit = 1 << 30;
+
+        readonly StreamFrameSender send;
+        readonly long messageId;
+        readonly global::Google.Protobuf.MessageParser<TIn> parser;
+        readonly Action onClosed;
+        readonly System.Threading.Channels.Channel<TIn> incoming;
+        readonly SemaphoreSlim credit;
+        readonly CancellationTokenSource cancellation = new CancellationTokenSource();
+        readonly int creditBatch;
+        int consumed;
+        int writesCompleted;
+        int disposed;
+        Exception? error;
+
+        public RpcStream(StreamFrameSender send, int window, long messageId, global::Google.Protobuf.MessageParser<TIn> parser, Action onClosed)
+        {{
+            this.send = send;
+            this.messageId = messageId;
+            this.parser = parser;
+            this.onClosed = onClosed;
+            incoming = System.Threading.Channels.Channel.CreateBounded<TIn>(new System.Threading.Channels.BoundedChannelOptions(window) {{ SingleReader = true, SingleWriter = true }});
+            credit = new SemaphoreSlim(window, int.MaxValue);
+            creditBatch = Math.Max(1, window / 2);
+        }}
+
+        // cancelled when the stream fails, is cancelled by the peer or is disposed
+        public CancellationToken Cancellation => cancellation.Token;
+
+        public void OnFrame(long argType, ReadOnlySpan<byte> data)
+        {{
+            if (argType == messageId)
+            {{
+                TIn message;
+                try
+                {{
+                    message = parser.ParseFrom(data);
+                }}
+                catch (Exception e)
+                {{
+                    Fail(e);
+                    return;
+                }}
+                // a peer sending without credit is failed instead of being buffered without bound
+                if (!incoming.Writer.TryWrite(message) && Volatile.Read(ref error) == null)
+                    Fail(new RpcStreamException("Peer exceeded the stream window"));
+                return;
+            }}
+            switch (argType)
+            {{
+                case StreamFrames.Credit:
+                    if (data.Length >= 4 && Volatile.Read(ref error) == null)
+                        credit.Release(System.Buffers.Binary.BinaryPrimitives.ReadInt32LittleEndian(data));
+                    return;
+                case StreamFrames.End:
+                    incoming.Writer.TryComplete();
+                    return;
+                case StreamFrames.Cancel:
+                    Abort(new OperationCanceledException("The peer cancelled the stream"));
+                    return;
+                case StreamFrames.Error:
+                    Abort(new RpcStreamException(System.Text.Encoding.UTF8.GetString(data)));
+                    return;
+            }}
+            Fail(new RpcStreamException($"Unexpected message type {{argType}} on stream"));
+        }}
+
+        public void Abort(Exception error)
+        {{
+            if (Interlocked.CompareExchange(ref this.error, error, null) != null)
+                return;
+            Close(error);
+        }}
+
+        // fails the stream locally and tells the peer
+        public void Fail(Exception error)
+        {{
+            if (Interlocked.CompareExchange(ref this.error, error, null) != null)
+                return;
+            StreamFrames.SendText(send, StreamFrames.Error, error.Message);
+            Close(error);
+        }}
+
+        void Close(Exception error)
+        {{
+            incoming.Writer.TryComplete(error);
+            credit.Release(ClosedCredit);
+            cancellation.Cancel();
+        }}
+
+        void ThrowIfClosed()
+        {{
+            var error = Volatile.Read(ref this.error);
+            if (error != null)
+                throw new RpcStreamException($"Stream closed: {{error.Message}}", error);
+        }}
+
+        public void Open()
+        {{
+            send(StreamFrames.Open, Span<byte>.Empty);
+        }}
+
+        public async ValueTask WriteAsync(long messageId, global::Google.Protobuf.IMessage message, CancellationToken cancellationToken = default)
+        {{
+            await credit.WaitAsync(cancellationToken).ConfigureAwait(false);
+            ThrowIfClosed();
+            StreamFrames.SendMessage(send, messageId, message);
+        }}
+
+        public async Task WriteAllAsync<TOut>(long messageId, IAsyncEnumerable<TOut> messages, CancellationToken cancellationToken = default) where TOut : global::Google.Protobuf.IMessage
+        {{
+            await foreach (var message in messages.WithCancellation(cancellationToken).ConfigureAwait(false))
+                await WriteAsync(messageId, message, cancellationToken).ConfigureAwait(false);
+            CompleteWrites();
+        }}
+
+        public void CompleteWrites()
+        {{
+            if (Interlocked.Exchange(ref writesCompleted, 1) == 0 && Volatile.Read(ref error) == null)
+                send(StreamFrames.End, Span<byte>.Empty);
+        }}
+
+        public async IAsyncEnumerable<TIn> ReadAllAsync([System.Runtime.CompilerServices.EnumeratorCancellation] CancellationToken cancellationToken = default)
+        {{
+            var reader = incoming.Reader;
+            // completes with the peer's error, if any
+            while (await reader.WaitToReadAsync(cancellationToken).ConfigureAwait(false))
+            {{
+                while (reader.TryRead(out var message))
+                {{
+                    GrantCredit();
+                    yield return message;
+                }}
+            }}
+        }}
+
+        public async ValueTask<TIn> ReadSingleAsync(CancellationToken cancellationToken = default)
+        {{
+            var reader = incoming.Reader;
+            if (await reader.WaitToReadAsync(cancellationToken).ConfigureAwait(false) && reader.TryRead(out var message))
+            {{
+                GrantCredit();
+                return message;
+            }}
+            throw new RpcStreamException("Stream ended without a message");
+        }}
+
+        void GrantCredit()
+        {{
+            if (++consumed < creditBatch)
+                return;
+            if (Volatile.Read(ref error) == null)
+                StreamFrames.SendInt(send, StreamFrames.Credit, consumed);
+            consumed = 0;
+        }}
+
+        public async IAsyncEnumerable<TIn> CallServerStreaming(long requestMessageId, global::Google.Protobuf.IMessage request, [System.Runtime.CompilerServices.EnumeratorCancellation] CancellationToken cancellationToken = default)
+        {{
+            Open();
+            await WriteAsync(requestMessageId, request, cancellationToken).ConfigureAwait(false);
+            CompleteWrites();
+            await foreach (var message in ReadAllAsync(cancellationToken).ConfigureAwait(false))
+                yield return message;
+        }}
+
+        public async Task<TIn> CallClientStreaming<TOut>(long requestMessageId, IAsyncEnumerable<TOut> requests, CancellationToken cancellationToken = default) where TOut : global::Google.Protobuf.IMessage
+        {{
+            Open();
+            await WriteAllAsync(requestMessageId, requests, cancellationToken).ConfigureAwait(false);
+            return await ReadSingleAsync(cancellationToken).ConfigureAwait(false);
+        }}
+
+        public async IAsyncEnumerable<TIn> CallDuplexStreaming<TOut>(long requestMessageId, IAsyncEnumerable<TOut> requests, [System.Runtime.CompilerServices.EnumeratorCancellation] CancellationToken cancellationToken = default) where TOut : global::Google.Protobuf.IMessage
+        {{
+            Open();
+            var writing = WriteConcurrently(requestMessageId, requests, cancellationToken);
+            await foreach (var message in ReadAllAsync(cancellationToken).ConfigureAwait(false))
+                yield return message;
+            await writing.ConfigureAwait(false);
+        }}
+
+        async Task WriteConcurrently<TOut>(long messageId, IAsyncEnumerable<TOut> messages, CancellationToken cancellationToken) where TOut : global::Google.Protobuf.IMessage
+        {{
+            await Task.Yield();
+            try
+            {{
+                await WriteAllAsync(messageId, messages, cancellationToken).ConfigureAwait(false);
+            }}
+            catch (Exception e)
+            {{
+                // surfaces through the reading side
+                Fail(e);
+            }}
+        }}
+
+        // the service runs on the thread pool, not on the thread delivering the Open frame
+        public async Task ServeServerStreaming<TOut>(Func<TIn, CancellationToken, IAsyncEnumerable<TOut>> call, long responseMessageId) where TOut : global::Google.Protobuf.IMessage
+        {{
+            await Task.Yield();
+            try
+            {{
+                var request = await ReadSingleAsync(Cancellation).ConfigureAwait(false);
+                await WriteAllAsync(responseMessageId, call(request, Cancellation), Cancellation).ConfigureAwait(false);
+            }}
+            catch (Exception e)
+            {{
+                Fail(e);
+            }}
+            finally
+            {{
+                Dispose();
+            }}
+        }}
+
+        public async Task ServeClientStreaming<TOut>(Func<IAsyncEnumerable<TIn>, CancellationToken, ValueTask<TOut>> call, long responseMessageId) where TOut : global::Google.Protobuf.IMessage
+        {{
+            await Task.Yield();
+            try
+            {{
+                var response = await call(ReadAllAsync(Cancellation), Cancellation).ConfigureAwait(false);
+                await WriteAsync(responseMessageId, response, Cancellation).ConfigureAwait(false);
+                CompleteWrites();
+            }}
+            catch (Exception e)
+            {{
+                Fail(e);
+            }}
+            finally
+            {{
+                Dispose();
+            }}
+        }}
+
+        public async Task ServeDuplexStreaming<TOut>(Func<IAsyncEnumerable<TIn>, CancellationToken, IAsyncEnumerable<TOut>> call, long responseMessageId) where TOut : global::Google.Protobuf.IMessage
+        {{
+            await Task.Yield();
+            try
+            {{
+                await WriteAllAsync(responseMessageId, call(ReadAllAsync(Cancellation), Cancellation), Cancellation).ConfigureAwait(false);
+            }}
+            catch (Exception e)
+            {{
+                Fail(e);
+            }}
+            finally
+            {{
+                Dispose();
+            }}
+        }}
+
+        // a stream closed before both directions ended tells the peer to stop
+        public void Dispose()
+        {{
+            if (Interlocked.Exchange(ref disposed, 1) != 0)
+                return;
+            var finished = Volatile.Read(ref writesCompleted) == 1 && incoming.Reader.Completion.IsCompleted;
+            if (!finished && Volatile.Read(ref error) == null)
+                send(StreamFrames.Cancel, Span<byte>.Empty);
+            Abort(new ObjectDisposedException(nameof(RpcStream<TIn>)));
+            onClosed();
+        }}
+    }}
+"""
+
+def get_batches():
+    return """
+    public delegate void RpcBatchSender(Span<byte> data, bool isReliable);
+
+    // a batch is sent as one call with MethodId; each entry is a fixed size header followed by the payload
+    public static class RpcBatch
+    {
+        public const long MethodId = long.MinValue;
+        // methodId, requestId and argType as 64 bit, the payload length as 32 bit little endian integers
+        public const int EntryHeaderSize = 28;
+
+        public static void WriteEntryHeader(Span<byte> entry, long methodId, ulong requestId, long argType, int length)
+        {
+            System.Buffers.Binary.BinaryPrimitives.WriteInt64LittleEndian(entry, methodId);
+            System.Buffers.Binary.BinaryPrimitives.WriteUInt64LittleEndian(entry.Slice(8), requestId);
+            System.Buffers.Binary.BinaryPrimitives.WriteInt64LittleEndian(entry.Slice(16), argType);
+            System.Buffers.Binary.BinaryPrimitives.WriteInt32LittleEndian(entry.Slice(24), length);
+        }
+
+        public static bool TryReadEntry(ref ReadOnlySpan<byte> frame, out long methodId, out ulong requestId, out long argType, out ReadOnlySpan<byte> payload)
+        {
+            methodId = 0;
+            requestId = 0;
+            argType = 0;
+            payload = default;
+            if (frame.Length < EntryHeaderSize)
+                return false;
+            var length = System.Buffers.Binary.BinaryPrimitives.ReadInt32LittleEndian(frame.Slice(24));
+            // a truncated entry ends the batch
+            if (length < 0 || length > frame.Length - EntryHeaderSize)
+                return false;
+            methodId = System.Buffers.Binary.BinaryPrimitives.ReadInt64LittleEndian(frame);
+            requestId = System.Buffers.Binary.BinaryPrimitives.ReadUInt64LittleEndian(frame.Slice(8));
+            argType = System.Buffers.Binary.BinaryPrimitives.ReadInt64LittleEndian(frame.Slice(16));
+            payload = frame.Slice(EntryHeaderSize, length);
+            frame = frame.Slice(EntryHeaderSize + length);
+            return true;
+        }
+    }
+
+    // collects calls into one buffer and sends them with a single call on Flush, when the next call
+    // would exceed maxBytes, or every flushIntervalMs. A batch is reliable if any of its calls is.
+    public sealed class RpcBatchWriter : IDisposable
+    {
+        readonly object sync = new object();
+        readonly RpcBatchSender send;
+        readonly int maxBytes;
+        readonly Timer? timer;
+        byte[] buffer;
+        int length;
+        int count;
+        bool isReliable;
+
+        public RpcBatchWriter(RpcBatchSender send, int maxBytes, int flushIntervalMs)
+        {
+            this.send = send;
+            this.maxBytes = maxBytes;
+            buffer = new byte[maxBytes];
+            if (flushIntervalMs > 0)
+                timer = new Timer(static state => ((RpcBatchWriter)state!).Flush(), this, flushIntervalMs, flushIntervalMs);
+        }
+
+        public int Count
+        {
+            get
+            {
+                lock (sync)
+                    return count;
+            }
+        }
+
+        public int Length
+        {
+            get
+            {
+                lock (sync)
+                    return length;
+            }
+        }
+
+        public void Append(long methodId, ulong requestId, long argType, global::Google.Protobuf.IMessage? message, bool isReliable)
+        {
+            var size = message?.CalculateSize() ?? 0;
+            var entrySize = RpcBatch.EntryHeaderSize + size;
+            lock (sync)
+            {
+                // a call larger than maxBytes is sent as a batch of its own
+                if (count > 0 && length + entrySize > maxBytes)
+                    FlushLocked();
+                if (length + entrySize > buffer.Length)
+                    Array.Resize(ref buffer, length + entrySize);
+                var entry = buffer.AsSpan(length, entrySize);
+                RpcBatch.WriteEntryHeader(entry, methodId, requestId, argType, size);
+                if (message != null)
+                    global::Google.Protobuf.MessageExtensions.WriteTo(message, entry.Slice(RpcBatch.EntryHeaderSize));
+                length += entrySize;
+                count++;
+                this.isReliable |= isReliable;
+                if (length >= maxBytes)
+                    FlushLocked();
+            }
+        }
+
+        public void Flush()
+        {
+            lock (sync)
+                FlushLocked();
+        }
+
+        void FlushLocked()
+        {
+            if (count == 0)
+                return;
+            // sending under the lock keeps batches in call order
+            try
+            {
+                send(buffer.AsSpan(0, length), isReliable);
+            }
+            finally
+            {
+                length = 0;
+                count = 0;
+                isReliable = false;
+            }
+        }
+
+        // stops the flush timer and sends what is left
+        public void Dispose()
+        {
+            timer?.Dispose();
+            Flush();
+        }
+    }
+"""
+
+def get_metrics():
+    return """
+    // instruments of the "Omgpp.Rpc" meter; collect them with a MeterListener, dotnet-counters or OpenTelemetry.
+    // While nothing listens, recording returns after a single flag check.
+    public static class RpcMetrics
+    {
+        public static readonly System.Diagnostics.Metrics.Meter Meter = new System.Diagnostics.Metrics.Meter("Omgpp.Rpc");
+        internal static readonly System.Diagnostics.Metrics.Counter<long> Calls = Meter.CreateCounter<long>("omgpp.rpc.calls", description: "RPC calls sent by clients or received by servers");
+        internal static readonly System.Diagnostics.Metrics.Counter<long> Errors = Meter.CreateCounter<long>("omgpp.rpc.errors", description: "Failed RPC calls by error.type");
+        internal static readonly System.Diagnostics.Metrics.Histogram<double> Duration = Meter.CreateHistogram<double>("omgpp.rpc.duration", "ms", "Time from receiving a request to sending its response, or from sending a request to receiving its response");
+        internal static readonly System.Diagnostics.Metrics.Histogram<int> RequestSize = Meter.CreateHistogram<int>("omgpp.rpc.request.size", "By", "Serialized request size");
+        internal static readonly System.Diagnostics.Metrics.Histogram<int> ResponseSize = Meter.CreateHistogram<int>("omgpp.rpc.response.size", "By", "Serialized response size");
+
+        // values of the error.type tag
+        public const string ArgTypeMismatch = "arg_type_mismatch";
+        public const string Parse = "parse";
+        public const string Exception = "exception";
+        public const string Timeout = "timeout";
+        public const string Rejected = "rejected";
+
+        public static string GetErrorType(System.Exception e) => e is global::Google.Protobuf.InvalidProtocolBufferException ? Parse : Exception;
+    }
+
+    // the instruments of RpcMetrics tagged with one method of one side
+    public sealed class RpcMethodMetrics
+    {
+        readonly KeyValuePair<string, object?> method;
+        readonly KeyValuePair<string, object?> methodId;
+        readonly KeyValuePair<string, object?> side;
+
+        public RpcMethodMetrics(long methodId, string method, string side)
+        {
+            this.method = new KeyValuePair<string, object?>("rpc.method", method);
+            this.methodId = new KeyValuePair<string, object?>("rpc.method_id", methodId);
+            this.side = new KeyValuePair<string, object?>("rpc.side", side);
+        }
+
+        public static long Now() => System.Diagnostics.Stopwatch.GetTimestamp();
+
+        public void Call()
+        {
+            if (RpcMetrics.Calls.Enabled)
+                RpcMetrics.Calls.Add(1, method, methodId, side);
+        }
+
+        public void Call(int requestBytes)
+        {
+            Call();
+            if (RpcMetrics.RequestSize.Enabled)
+                RpcMetrics.RequestSize.Record(requestBytes, method, methodId, side);
+        }
+
+        public void Completed(long startTimestamp)
+        {
+            if (RpcMetrics.Duration.Enabled)
+                RpcMetrics.Duration.Record((System.Diagnostics.Stopwatch.GetTimestamp() - startTimestamp) * 1000.0 / System.Diagnostics.Stopwatch.Frequency, method, methodId, side);
+        }
+
+        public void Completed(long startTimestamp, int responseBytes)
+        {
+            Completed(startTimestamp);
+            if (RpcMetrics.ResponseSize.Enabled)
+                RpcMetrics.ResponseSize.Record(responseBytes, method, methodId, side);
+        }
+
+        public void Failed(string errorType)
+        {
+            if (RpcMetrics.Errors.Enabled)
+                RpcMetrics.Errors.Add(1, new System.Diagnostics.TagList { method, methodId, side, new KeyValuePair<string, object?>("error.type", errorType) });
+        }
+    }
+"""
+
+def get_latest_value_slots():
+    return """
+    public readonly struct LatestValue<T>
+    {
+        public readonly T Message;
+        public readonly bool IsReliable;
+
+        public LatestValue(T message, bool isReliable)
+        {
+            Message = message;
+            IsReliable = isReliable;
+        }
+    }
+
+    // keeps the newest message per key until the owner takes them all at once; a message set again
+    // before it was taken is superseded and never sent
+    public sealed class LatestValueSlots<TKey, T> where TKey : notnull
+    {
+        readonly object sync = new object();
+        Dictionary<TKey, LatestValue<T>> pending = new Dictionary<TKey, LatestValue<T>>();
+        Dictionary<TKey, LatestValue<T>>? spare = new Dictionary<TKey, LatestValue<T>>();
+        long superseded;
+
+        public long Superseded => Interlocked.Read(ref superseded);
+
+        public int Count
+        {
+            get
+            {
+                lock (sync)
+                    return pending.Count;
+            }
+        }
+
+        public void Set(TKey key, T message, bool isReliable)
+        {
+            lock (sync)
+            {
+                var count = pending.Count;
+                pending[key] = new LatestValue<T>(message, isReliable);
+                if (pending.Count == count)
+                    superseded++;
+            }
+        }
+
+        // swaps in an empty table so the taken values are sent without holding the lock;
+        // hand the table back with Recycle once done
+        public Dictionary<TKey, LatestValue<T>> Take()
+        {
+            lock (sync)
+            {
+                var taken = pending;
+                pending = spare ?? new Dictionary<TKey, LatestValue<T>>();
+                spare = null;
+                return taken;
+            }
+        }
+
+        public void Recycle(Dictionary<TKey, LatestValue<T>> taken)
+        {
+            taken.Clear();
+            lock (sync)
+                spare = taken;
+        }
+    }
+"""
+
+def get_response_cache():
+    return """
+    // bounded LRU of serialized responses keyed by the serialized request; lookups hash the request
+    // span in place, only inserts copy it
+    public sealed class ResponseCache
+    {
+        sealed class Entry
+        {
+            public byte[] Request = Array.Empty<byte>();
+            public byte[] Response = Array.Empty<byte>();
+            public int Hash;
+            public long Expires;
+            public Entry? NextInBucket;
+            public Entry? Newer;
+            public Entry? Older;
+        }
+
+        readonly object sync = new object();
+        readonly Dictionary<int, Entry> buckets = new Dictionary<int, Entry>();
+        readonly int capacity;
+        readonly long ttlMs;
+        Entry? newest;
+        Entry? oldest;
+        int count;
+        long version;
+        long hits;
+        long misses;
+
+        // ttlMs 0 keeps entries until they are evicted or invalidated
+        public ResponseCache(int capacity, long ttlMs)
+        {
+            this.capacity = Math.Max(1, capacity);
+            this.ttlMs = ttlMs;
+        }
+
+        public long Hits => Interlocked.Read(ref hits);
+        public long Misses => Interlocked.Read(ref misses);
+
+        public int Count
+        {
+            get
+            {
+                lock (sync)
+                    return count;
+            }
+        }
+
+        // read before calling the service and pass to Add, so a response computed while the cache was
+        // invalidated is not stored
+        public long Version
+        {
+            get
+            {
+                lock (sync)
+                    return version;
+            }
+        }
+
+        static int GetHash(ReadOnlySpan<byte> request)
+        {
+            var hash = new HashCode();
+            hash.AddBytes(request);
+            return hash.ToHashCode();
+        }
+
+        Entry? Find(ReadOnlySpan<byte> request, int hash)
+        {
+            buckets.TryGetValue(hash, out var entry);
+            while (entry != null && !request.SequenceEqual(entry.Request))
+                entry = entry.NextInBucket;
+            return entry;
+        }
+
+        public bool TryGet(ReadOnlySpan<byte> request, out byte[] response)
+        {
+            var hash = GetHash(request);
+            lock (sync)
+            {
+                var entry = Find(request, hash);
+                if (entry != null && ttlMs > 0 && Environment.TickCount64 >= entry.Expires)
+                {
+                    Remove(entry);
+                    entry = null;
+                }
+                if (entry == null)
+                {
+                    misses++;
+                    response = Array.Empty<byte>();
+                    return false;
+                }
+                hits++;
+                Unlink(entry);
+                LinkNewest(entry);
+                response = entry.Response;
+                return true;
+            }
+        }
+
+        public void Add(ReadOnlySpan<byte> request, ReadOnlySpan<byte> response, long version)
+        {
+            var hash = GetHash(request);
+            lock (sync)
+            {
+                if (version != this.version)
+                    return;
+                var entry = Find(request, hash);
+                if (entry != null)
+                {
+                    Unlink(entry);
+                }
+                else
+                {
+                    if (count == capacity)
+                        Remove(oldest!);
+                    entry = new Entry { Request = request.ToArray(), Hash = hash };
+                    buckets.TryGetValue(hash, out entry.NextInBucket);
+                    buckets[hash] = entry;
+                    count++;
+                }
+                entry.Response = response.ToArray();
+                entry.Expires = Environment.TickCount64 + ttlMs;
+                LinkNewest(entry);
+            }
+        }
+
+        public bool Invalidate(ReadOnlySpan<byte> request)
+        {
+            var hash = GetHash(request);
+            lock (sync)
+            {
+                version++;
+                var entry = Find(request, hash);
+                if (entry == null)
+                    return false;
+                Remove(entry);
+                return true;
+            }
+        }
+
+        public void Clear()
+        {
+            lock (sync)
+            {
+                version++;
+                buckets.Clear();
+                newest = null;
+                oldest = null;
+                count = 0;
+            }
+        }
+
+        void Remove(Entry entry)
+        {
+            Unlink(entry);
+            if (buckets[entry.Hash] == entry)
+            {
+                if (entry.NextInBucket != null)
+                    buckets[entry.Hash] = entry.NextInBucket;
+                else
+                    buckets.Remove(entry.Hash);
+            }
+            else
+            {
+                var previous = buckets[entry.Hash];
+                while (previous.NextInBucket != entry)
+                    previous = previous.NextInBucket!;
+                previous.NextInBucket = entry.NextInBucket;
+            }
+            count--;
+        }
+
+        void Unlink(Entry entry)
+        {
+            if (entry.Newer != null)
+                entry.Newer.Older = entry.Older;
+            else
+                newest = entry.Older;
+            if (entry.Older != null)
+                entry.Older.Newer = entry.Newer;
+            else
+                oldest = entry.Newer;
+            entry.Newer = null;
+            entry.Older = null;
+        }
+
+        void LinkNewest(Entry entry)
+        {
+            entry.Older = newest;
+            if (newest != null)
+                newest.Newer = entry;
+            newest = entry;
+            oldest ??= entry;
+        }
+    }
+"""
+
+def get_stream_serialized_send(options:GeneratorOptions) -> str:
+    # same buffer strategy as get_serialized_send in csharp_rpc_templates
+    if options.stackalloc_threshold == 0:
+        return """            var size = message.CalculateSize();
+            var rented = System.Buffers.ArrayPool<byte>.Shared.Rent(size);
+            var data = new Span<byte>(rented, 0, size);
+            global::Google.Protobuf.MessageExtensions.WriteTo(message, data);
+            send(messageId, data);
+            System.Buffers.ArrayPool<byte>.Shared.Return(rented);"""
+    return f"""            var size = message.CalculateSize();
+            byte[]? rented = null;
+            Span<byte> data = size <= {options.stackalloc_threshold} ? stackalloc byte[size] : (rented = System.Buffers.ArrayPool<byte>.Shared.Rent(size)).AsSpan(0, size);
+            global::Google.Protobuf.MessageExtensions.WriteTo(message, data);
+            send(messageId, data);
+            if (rented != null)
+                System.Buffers.ArrayPool<byte>.Shared.Return(rented);"""
+
+def needs_runtime(options:GeneratorOptions,streaming:bool = False,coalescing:bool = False,caching:bool = False) -> bool:
+    return options.pooling or options.client_requests == "slots" or options.async_server or options.batching or options.metrics or streaming or coalescing or caching
+
+def get_runtime(options:GeneratorOptions,streaming:bool = False,coalescing:bool = False,caching:bool = False) -> str:
+    classes = ""
+    if options.pooling or options.client_requests == "slots":
+        classes += get_object_pool()
+    if options.client_requests == "slots":
+        classes += get_pending_requests(options)
+    if options.async_server:
+        classes += get_bounded_work_queue()
+    if options.batching:
+        classes += get_batches()
+    if options.metrics:
+        classes += get_metrics()
+    if streaming:
+        classes += get_streams(options)
+    if coalescing:
+        classes += get_latest_value_slots()
+    if caching:
+        classes += get_response_cache()
+    # generated files are treated as nullable-oblivious unless they opt in
+    return f"""#nullable enable
+namespace {RUNTIME_NAMESPACE}
+{{{classes}}}
+"""
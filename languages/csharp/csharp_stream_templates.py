@@ -0,0 +1,151 @@
+from typing import List, Tuple
+from languages.csharp.csharp_method import CSharpMethod
+from languages.csharp.csharp_runtime_templates import RUNTIME_NAMESPACE
+
+# streams carry google.protobuf.Empty where a side has no message, with the MessageId 0 unary calls use
+EMPTY_TYPE = "global::Google.Protobuf.WellKnownTypes.Empty"
+
+def get_stream_types(m:CSharpMethod) -> Tuple[str,str,str,str]:
+    input_type = m.input_args[0][0] if m.has_input_message else EMPTY_TYPE
+    input_id = f"{input_type}.MessageId" if m.has_input_message else "0"
+    output_type = m.return_type if m.has_output else EMPTY_TYPE
+    output_id = f"{output_type}.MessageId" if m.has_output else "0"
+    return (input_type,input_id,output_type,output_id)
+
+def get_stream_server_signature(m:CSharpMethod) -> str:
+    (input_type,_,output_type,_) = get_stream_types(m)
+    args = "System.Guid clientGuid,System.Net.IPAddress ip,ushort port"
+    if m.client_streaming:
+        args += f",IAsyncEnumerable<{input_type}> messages"
+    elif m.has_input_message:
+        args += f",{input_type} message"
+    args += ",CancellationToken cancellationToken"
+    if m.server_streaming:
+        return f"IAsyncEnumerable<{output_type}> {m.name}({args})"
+    if m.has_output:
+        return f"ValueTask<{output_type}> {m.name}({args})"
+    return f"ValueTask {m.name}({args})"
+
+def get_stream_client_args(m:CSharpMethod,enumerator_cancellation:bool) -> str:
+    (input_type,_,_,_) = get_stream_types(m)
+    args = []
+    if m.client_streaming:
+        args.append(f"IAsyncEnumerable<{input_type}> messages")
+    elif m.has_input_message:
+        args.append(f"{input_type} message")
+    cancellation = "[System.Runtime.CompilerServices.EnumeratorCancellation] " if enumerator_cancellation else ""
+    args.append(f"{cancellation}CancellationToken cancellationToken = default")
+    return ",".join(args)
+
+def get_stream_client_return_type(m:CSharpMethod) -> str:
+    (_,_,output_type,_) = get_stream_types(m)
+    if m.server_streaming:
+        return f"IAsyncEnumerable<{output_type}>"
+    if m.has_output:
+        return f"Task<{output_type}>"
+    return "Task"
+
+def get_stream_client_signature(m:CSharpMethod) -> str:
+    return f"{get_stream_client_return_type(m)} {m.name}({get_stream_client_args(m,False)})"
+
+def get_stream_client_method(m:CSharpMethod) -> str:
+    (input_type,input_id,output_type,output_id) = get_stream_types(m)
+    open_stream = f"using var stream = OpenStream<{output_type}>({m.id}, {output_id}, {output_type}.Parser, {m.stream_window});"
+    if m.server_streaming:
+        if m.client_streaming:
+            call = f"stream.CallDuplexStreaming({input_id}, messages, cancellationToken)"
+        else:
+            request = "message" if m.has_input_message else f"new {EMPTY_TYPE}()"
+            call = f"stream.CallServerStreaming({input_id}, {request}, cancellationToken)"
+        return f"""public async {get_stream_client_return_type(m)} {m.name}({get_stream_client_args(m,True)})
+{{
+          {open_stream}
+          await foreach (var response in {call}.ConfigureAwait(false))
+              yield return response;
+}}
+"""
+    result = "return " if m.has_output else ""
+    return f"""public async {get_stream_client_return_type(m)} {m.name}({get_stream_client_args(m,False)})
+{{
+          {open_stream}
+          {result}await stream.CallClientStreaming({input_id}, messages, cancellationToken).ConfigureAwait(false);
+}}
+"""
+
+def get_stream_client_members() -> str:
+    return f"""
+      readonly global::{RUNTIME_NAMESPACE}.StreamTable<ulong> streams = new global::{RUNTIME_NAMESPACE}.StreamTable<ulong>();
+
+      global::{RUNTIME_NAMESPACE}.RpcStream<T> OpenStream<T>(long methodId, long messageId, MessageParser<T> parser, int window) where T : class, IMessage<T>, new()
+      {{
+          var streamId = global::{RUNTIME_NAMESPACE}.StreamFrames.NextStreamId();
+          var stream = new global::{RUNTIME_NAMESPACE}.RpcStream<T>((argType, data) => client.CallRpc(methodId, streamId, argType, data, true), window, messageId, parser, () => streams.Remove(streamId));
+          streams.TryAdd(streamId, stream);
+          return stream;
+      }}
+"""
+
+def get_stream_client_dispatch() -> str:
+    return f"""if (global::{RUNTIME_NAMESPACE}.StreamFrames.IsStreamId(requestId))
+          {{
+              streams.Dispatch(requestId, argType, argData);
+              return;
+          }}
+          """
+
+def get_stream_client_dispose(service_name:str) -> str:
+    return f"""
+          streams.AbortWhere(static _ => true, new ObjectDisposedException(nameof({service_name}ClientHandler)));"""
+
+def get_stream_server_call(m:CSharpMethod) -> Tuple[str,str]:
+    context = "clientGuid, ip, port"
+    if m.server_streaming and m.client_streaming:
+        return ("ServeDuplexStreaming",f"(messages, cancellationToken) => service.{m.name}({context}, messages, cancellationToken)")
+    if m.server_streaming:
+        message = "message, " if m.has_input_message else ""
+        return ("ServeServerStreaming",f"(message, cancellationToken) => service.{m.name}({context}, {message}cancellationToken)")
+    if m.has_output:
+        return ("ServeClientStreaming",f"(messages, cancellationToken) => service.{m.name}({context}, messages, cancellationToken)")
+    return ("ServeClientStreaming",f"""async (messages, cancellationToken) =>
+    {{
+        await service.{m.name}({context}, messages, cancellationToken);
+        return new {EMPTY_TYPE}();
+    }}""")
+
+def get_stream_server_method(m:CSharpMethod,arg_data_type:str) -> str:
+    (input_type,input_id,output_type,output_id) = get_stream_types(m)
+    (serve,call) = get_stream_server_call(m)
+    # every frame of a stream arrives with the method id and the stream id as requestId
+    return f"""private void Handle{m.name}(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, {arg_data_type} argData){{
+if (argType == global::{RUNTIME_NAMESPACE}.StreamFrames.Open)
+{{
+    var stream = OpenServerStream<{input_type}>(server, clientGuid, methodId, requestId, {input_id}, {input_type}.Parser, {m.stream_window});
+    if (stream != null)
+        _ = stream.{serve}({call}, {output_id});
+    return;
+}}
+streams.Dispatch((clientGuid, requestId), argType, argData);
+}}
+"""
+
+def get_stream_server_members() -> str:
+    return f"""
+        readonly global::{RUNTIME_NAMESPACE}.StreamTable<(Guid, ulong)> streams = new global::{RUNTIME_NAMESPACE}.StreamTable<(Guid, ulong)>();
+
+        global::{RUNTIME_NAMESPACE}.RpcStream<T> OpenServerStream<T>(global::OmgppSharpClientServer.Server server, Guid clientGuid, long methodId, ulong streamId, long messageId, MessageParser<T> parser, int window) where T : class, IMessage<T>, new()
+        {{
+            var key = (clientGuid, streamId);
+            var stream = new global::{RUNTIME_NAMESPACE}.RpcStream<T>((argType, data) => server.CallRpc(clientGuid, methodId, streamId, argType, data, true), window, messageId, parser, () => streams.Remove(key));
+            // a repeated Open frame does not restart the stream
+            return streams.TryAdd(key, stream) ? stream : null;
+        }}
+
+        // call when a client disconnects, so its streams stop waiting for frames and credit
+        public void CloseStreams(Guid clientGuid)
+        {{
+            streams.AbortWhere(key => key.Item1 == clientGuid, new global::{RUNTIME_NAMESPACE}.RpcStreamException("Client disconnected"));
+        }}
+"""
+
+def has_streaming_methods(methods:List[CSharpMethod]) -> bool:
+    return any(m.is_streaming for m in methods)
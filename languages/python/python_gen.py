@@ -0,0 +1,142 @@
+import io
+import keyword
+from typing import Dict, List, Tuple
+
+from google.protobuf.descriptor_pb2 import (
+    FileDescriptorProto,
+    MethodDescriptorProto,
+    ServiceDescriptorProto,
+)
+from google.protobuf.compiler.plugin_pb2 import (
+    CodeGeneratorResponse,
+)
+from descriptor_context import DescriptorContext, SYMBOL_MESSAGE, SYMBOL_SERVICE, Symbol
+from generation_cache import GenerationCache, get_cache_key
+from generator_options import GeneratorOptions
+from id_registry import IdRegistry
+from omgpp_options import METHOD_TIMEOUT_MS, get_extension_varint
+from languages.python.python_runtime_templates import CLIENT_MEMBERS, RUNTIME_MODULE, get_runtime
+from utils import GENERATOR_VERSION
+
+EMPTY_TYPE = ".google.protobuf.Empty"
+
+def get_pb2_module(proto_file_name:str) -> str:
+    # module name protoc --python_out uses for the file
+    return proto_file_name[:-len(".proto")].replace("-","_").replace("/",".") + "_pb2"
+
+def get_pb2_alias(proto_file_name:str) -> str:
+    # same aliasing as the imports of the _pb2 modules themselves
+    return get_pb2_module(proto_file_name).replace("_","__").replace(".","_dot_")
+
+def get_python_output_filename(proto_file_name:str) -> str:
+    return proto_file_name[:-len(".proto")].replace("-","_") + "_omgpp.py"
+
+def get_python_message_type(type_name:str,context:DescriptorContext,imports:Dict[str,str]) -> str:
+    if type_name == EMPTY_TYPE:
+        return "None"
+    symbol = context.get_symbol(type_name)
+    if symbol is None or symbol.kind != SYMBOL_MESSAGE:
+        raise Exception(f"Cannot find {type_name} message; Make sure you provided all .proto files to process")
+    imports[get_pb2_module(symbol.file.name)] = get_pb2_alias(symbol.file.name)
+    return f"{get_pb2_alias(symbol.file.name)}.{symbol.python_name}"
+
+def get_python_message_id(type_name:str,context:DescriptorContext,options:GeneratorOptions) -> int:
+    if type_name == EMPTY_TYPE:
+        return 0
+    return context.get_symbol(type_name).get_id(options.id_scheme)
+
+def get_python_method_name(method_name:str) -> str:
+    # rpcs named like a keyword or an RpcClient member get a trailing '_', as protoc does for keywords
+    if keyword.iskeyword(method_name) or method_name in CLIENT_MEMBERS:
+        return f"{method_name}_"
+    return method_name
+
+def process_python_method_table(buffer:io.StringIO,service:ServiceDescriptorProto,method_ids:List[Tuple[int,str]],context:DescriptorContext,options:GeneratorOptions,imports:Dict[str,str]):
+    # Method objects by proto method name, used by the generated methods and the load generator
+    buffer.write("    methods = {\n")
+    for method, (id,full_name) in zip(service.method,method_ids):
+        if method.client_streaming or method.server_streaming:
+            buffer.write(f"        # {method.name}: streaming methods are not supported by the Python client\n")
+            continue
+        input_type = get_python_message_type(method.input_type,context,imports)
+        output_type = get_python_message_type(method.output_type,context,imports)
+        input_id = get_python_message_id(method.input_type,context,options)
+        output_id = get_python_message_id(method.output_type,context,options)
+        timeout_ms = get_extension_varint(method.options,METHOD_TIMEOUT_MS,options.request_timeout_ms)
+        buffer.write(f"        \"{method.name}\": Method({id},\"{full_name}\",{input_type},{input_id},{output_type},{output_id},{timeout_ms}),\n")
+    buffer.write("    }\n\n")
+
+def process_python_method(buffer:io.StringIO,method:MethodDescriptorProto,context:DescriptorContext,imports:Dict[str,str]):
+    input_type = get_python_message_type(method.input_type,context,imports)
+    output_type = get_python_message_type(method.output_type,context,imports)
+    args = "self, reliable:bool = True" if input_type == "None" else f"self, message:{input_type}, reliable:bool = True"
+    message = "None" if input_type == "None" else "message"
+    buffer.write(f"    async def {get_python_method_name(method.name)}({args}) -> {output_type}:\n")
+    buffer.write(f"        return await self.call(self.methods[\"{method.name}\"],{message},reliable)\n\n")
+
+def process_python_service(buffer:io.StringIO,service_symbol:Symbol,context:DescriptorContext,options:GeneratorOptions,imports:Dict[str,str]):
+    service = service_symbol.descriptor
+    package = service_symbol.file.package
+    service_name = f"{package}.{service.name}" if package else service.name
+    methods = [method for method in service.method if not (method.client_streaming or method.server_streaming)]
+    names = [get_python_method_name(method.name) for method in methods]
+    for name in set(names):
+        if names.count(name) > 1:
+            raise Exception(f"{service.name}: more than one method maps to the Python client method {name}")
+    buffer.write("@register_service\n")
+    buffer.write(f"class {service.name}Client(RpcClient):\n")
+    buffer.write(f"    service_name = \"{service_name}\"\n")
+    process_python_method_table(buffer,service,service_symbol.get_method_ids(options.id_scheme),context,options,imports)
+    for method in methods:
+        process_python_method(buffer,method,context,imports)
+
+def process_python_header(buffer:io.StringIO):
+    buffer.write("# <auto-generated>\n")
+    buffer.write("# Do not edit this file manually\n")
+    buffer.write(f"# This file was generated by proto-omgpp-gen.py {GENERATOR_VERSION}\n")
+    buffer.write("# Any changes will be discarded after regeneration\n")
+    buffer.write("# </auto-generated>\n")
+
+def python_gen_file(descriptor:FileDescriptorProto,descriptor_context:DescriptorContext,options:GeneratorOptions) -> List[CodeGeneratorResponse.File]:
+    services = [symbol for symbol in descriptor_context.get_file_symbols(descriptor.name) if symbol.kind == SYMBOL_SERVICE]
+    if len(services) == 0:
+        return []
+    imports = {}
+    body = io.StringIO()
+    for service_symbol in services:
+        process_python_service(body,service_symbol,descriptor_context,options,imports)
+    buffer = io.StringIO()
+    process_python_header(buffer)
+    buffer.write(f"from {RUNTIME_MODULE} import Method, RpcClient, register_service\n")
+    for module in sorted(imports):
+        buffer.write(f"import {module} as {imports[module]}\n")
+    buffer.write("\n")
+    buffer.write(body.getvalue())
+    return [CodeGeneratorResponse.File(name=get_python_output_filename(descriptor.name),content=buffer.getvalue().rstrip("\n") + "\n")]
+
+def python_gen_omgpp(descriptor_context:DescriptorContext,options:GeneratorOptions = None,cache:GenerationCache = None) -> CodeGeneratorResponse:
+    options = options or GeneratorOptions()
+    response = CodeGeneratorResponse()
+    # the Python client must agree with the C# handlers, so IDs get the same collision check
+    id_registry = IdRegistry(options.id_scheme)
+    for descriptor in descriptor_context.descriptors:
+        id_registry.register_file(descriptor,descriptor_context)
+
+    for descriptor in descriptor_context.descriptors:
+        files = None
+        if cache is not None:
+            key = get_cache_key([descriptor],descriptor_context,options.fingerprint())
+            files = cache.get(key)
+        if files is None:
+            files = python_gen_file(descriptor,descriptor_context,options)
+            if cache is not None:
+                cache.put(key,files)
+        response.file.extend(files)
+    if options.emit_runtime:
+        buffer = io.StringIO()
+        process_python_header(buffer)
+        buffer.write(get_runtime())
+        response.file.append(CodeGeneratorResponse.File(name=f"{RUNTIME_MODULE}.py",content=buffer.getvalue()))
+    if options.id_manifest is not None:
+        response.file.extend(id_registry.manifest_files(options.id_manifest))
+    return response
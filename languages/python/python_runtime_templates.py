@@ -0,0 +1,260 @@
+RUNTIME_MODULE = "omgpp_runtime"
+# attributes of RpcClient that generated methods must not override
+CLIENT_MEMBERS = ["call","connection","methods","service_name"]
+
+def get_runtime() -> str:
+    return '''import argparse
+import asyncio
+import importlib
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# A call is the tuple the C# Server/Client CallRpc carries: method ID, request ID, argType (the
+# MessageId of the payload, 0 for none) and the serialized message. The omgpp wire framing belongs to
+# the native client, so no transport is included: a transport binding it is a class constructed with
+# (host, port) that provides async connect(), send(method_id, request_id, arg_type, data, reliable),
+# async drain() and async close(), and calls the on_rpc(method_id, request_id, arg_type, data) and
+# on_closed(error) attributes the client sets.
+# request IDs with the top bit set are stream IDs
+MAX_REQUEST_ID = (1 << 63) - 1
+
+class RpcError(Exception):
+    pass
+
+class RpcTimeoutError(RpcError):
+    pass
+
+class Method:
+    def __init__(self, id:int, name:str, request_type, request_id:int, response_type, response_id:int, timeout_ms:int) -> None:
+        self.id = id
+        self.name = name
+        # None for google.protobuf.Empty: no payload is sent, or no response is awaited
+        self.request_type = request_type
+        self.request_id = request_id
+        self.response_type = response_type
+        self.response_id = response_id
+        self.timeout_ms = timeout_ms
+
+class RpcConnection:
+    # request IDs, pending calls and close handlers of one transport, shared by all clients using it
+    def __init__(self, transport) -> None:
+        self.transport = transport
+        self.pending:Dict[int,Tuple[int,asyncio.Future]] = {}
+        self.next_request_id = 0
+        self.close_handlers:List[Callable[[Optional[Exception]],None]] = []
+        transport.on_rpc = self.on_rpc
+        transport.on_closed = self.on_closed
+
+    def on_rpc(self, method_id:int, request_id:int, arg_type:int, data:bytes):
+        entry = self.pending.get(request_id)
+        # responses to calls that already timed out, or that do not answer the method, are dropped
+        if entry is None or entry[0] != method_id:
+            return
+        del self.pending[request_id]
+        if not entry[1].done():
+            entry[1].set_result((arg_type,data))
+
+    def on_closed(self, error:Optional[Exception]):
+        pending = self.pending
+        self.pending = {}
+        for (_,future) in pending.values():
+            if not future.done():
+                future.set_exception(RpcError(f"Connection closed: {error}"))
+        for handler in list(self.close_handlers):
+            handler(error)
+
+    async def call(self, method:Method, message, reliable:bool = True):
+        data = message.SerializeToString() if method.request_type is not None else b""
+        if method.response_type is None:
+            # fire and forget, like the generated C# clients
+            self.transport.send(method.id,0,method.request_id,data,reliable)
+            await self.transport.drain()
+            return None
+        self.next_request_id = self.next_request_id % MAX_REQUEST_ID + 1
+        request_id = self.next_request_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (method.id,future)
+        try:
+            self.transport.send(method.id,request_id,method.request_id,data,reliable)
+            await self.transport.drain()
+            (arg_type,response) = await asyncio.wait_for(future,method.timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            raise RpcTimeoutError(f"{method.name} timed out after {method.timeout_ms} ms")
+        finally:
+            self.pending.pop(request_id,None)
+        if arg_type != method.response_id:
+            raise RpcError(f"{method.name} answered with argType {arg_type}, expected {method.response_id}")
+        return method.response_type.FromString(response)
+
+def get_connection(transport) -> RpcConnection:
+    connection = getattr(transport,"omgpp_connection",None)
+    if connection is None:
+        connection = RpcConnection(transport)
+        transport.omgpp_connection = connection
+    return connection
+
+class RpcClient:
+    # base of the generated <Service>Client classes; clients created on the same transport share
+    # its RpcConnection, so their request IDs never overlap
+    service_name = ""
+    methods:Dict[str,Method] = {}
+
+    def __init__(self, transport) -> None:
+        self.connection = get_connection(transport)
+
+    def call(self, method:Method, message, reliable:bool = True) -> Awaitable:
+        return self.connection.call(method,message,reliable)
+
+SERVICES:Dict[str,type] = {}
+
+def register_service(client_type:type):
+    SERVICES[client_type.service_name] = client_type
+    SERVICES[client_type.service_name.split(".")[-1]] = client_type
+    return client_type
+
+def find_method(name:str):
+    # "Service.Method" or "package.Service.Method"
+    (service_name,_,method_name) = name.rpartition(".")
+    client_type = SERVICES.get(service_name)
+    if client_type is None or method_name not in client_type.methods:
+        raise Exception(f"Unknown method {name}; known services: {', '.join(sorted(SERVICES))}")
+    return (client_type,client_type.methods[method_name])
+
+def get_percentile(sorted_values:List[float], fraction:float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1,int(fraction * len(sorted_values)))]
+
+class LoadStats:
+    def __init__(self) -> None:
+        self.latencies:List[float] = []
+        self.started = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.errors = 0
+        # calls skipped by a rate limited run because `concurrency` calls were still in flight
+        self.skipped = 0
+
+    def summary(self, elapsed:float) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "elapsed_seconds": elapsed,
+            "started": self.started,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "throughput": self.completed / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": dict((name,get_percentile(latencies,fraction) * 1000) for name, fraction in [("p50",0.5),("p90",0.9),("p99",0.99),("p999",0.999),("max",1.0)]),
+        }
+
+async def measure_call(call:Callable[[],Awaitable], stats:LoadStats):
+    start = time.perf_counter()
+    try:
+        await call()
+    except RpcTimeoutError:
+        stats.timeouts += 1
+        return
+    except Exception:
+        stats.errors += 1
+        return
+    stats.latencies.append(time.perf_counter() - start)
+    stats.completed += 1
+
+async def run_load(call:Callable[[],Awaitable], rate:float, concurrency:int, duration:float) -> dict:
+    # rate > 0 starts calls on a fixed schedule whatever the response times (open loop), so a slow
+    # server shows up as latency instead of a lower request rate; rate 0 keeps `concurrency` calls in flight
+    loop = asyncio.get_running_loop()
+    stats = LoadStats()
+    in_flight = set()
+    start = loop.time()
+    index = 0
+    while loop.time() - start < duration:
+        if rate > 0:
+            delay = start + index / rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            index += 1
+            if len(in_flight) >= concurrency:
+                stats.skipped += 1
+                continue
+        elif len(in_flight) >= concurrency:
+            await asyncio.wait(in_flight,return_when=asyncio.FIRST_COMPLETED)
+            continue
+        task = asyncio.ensure_future(measure_call(call,stats))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        stats.started += 1
+    if len(in_flight) > 0:
+        await asyncio.wait(in_flight)
+    return stats.summary(loop.time() - start)
+
+def print_summary(method:str, summary:dict):
+    latency = summary["latency_ms"]
+    print(f"{method}: {summary['completed']} completed in {summary['elapsed_seconds']:.2f}s, {summary['throughput']:.1f} calls/s")
+    print(f"  started {summary['started']}, timeouts {summary['timeouts']}, errors {summary['errors']}, skipped {summary['skipped']}")
+    print(f"  latency ms p50 {latency['p50']:.3f} p90 {latency['p90']:.3f} p99 {latency['p99']:.3f} p999 {latency['p999']:.3f} max {latency['max']:.3f}")
+
+def get_transport_type(name:str) -> type:
+    # "module:Class", see the transport protocol at the top of this module
+    (module,_,class_name) = name.partition(":")
+    if class_name == "":
+        raise Exception(f"Transport {name} must be given as module:Class")
+    return getattr(importlib.import_module(module),class_name)
+
+async def run_load_main(args):
+    from google.protobuf import json_format
+    for module in args.module:
+        importlib.import_module(module)
+    (client_type,method) = find_method(args.method)
+    request = None
+    if method.request_type is not None:
+        request = json_format.Parse(args.request,method.request_type()) if args.request else method.request_type()
+    transport_type = get_transport_type(args.transport)
+    transports = []
+    clients = []
+    for _ in range(args.connections):
+        transport = transport_type(args.host,args.port)
+        await transport.connect()
+        transports.append(transport)
+        clients.append(client_type(transport))
+    calls = [0]
+
+    def call():
+        # calls are spread over the connections round robin
+        client = clients[calls[0] % len(clients)]
+        calls[0] += 1
+        return client.call(method,request,not args.unreliable)
+
+    summary = await run_load(call,args.rate,args.concurrency,args.duration)
+    for transport in transports:
+        await transport.close()
+    return summary
+
+def main(argv:List[str] = None):
+    parser = argparse.ArgumentParser(description="Drive one method of an omgpp service at a fixed rate or concurrency")
+    parser.add_argument("--module",action="append",default=[],help="generated *_omgpp module to import, may be repeated")
+    parser.add_argument("--method",required=True,help="Service.Method to call")
+    parser.add_argument("--request",help="request message as protobuf JSON, defaults to an empty message")
+    parser.add_argument("--transport",required=True,help="module:Class of the transport binding the omgpp client")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,required=True)
+    parser.add_argument("--connections",type=int,default=1)
+    parser.add_argument("--rate",type=float,default=0,help="calls per second, 0 runs closed loop as fast as the concurrency allows")
+    parser.add_argument("--concurrency",type=int,default=64,help="calls in flight at most")
+    parser.add_argument("--duration",type=float,default=10,help="seconds")
+    parser.add_argument("--unreliable",action="store_true")
+    parser.add_argument("--json",action="store_true",help="print the summary as JSON")
+    args = parser.parse_args(argv)
+    summary = asyncio.run(run_load_main(args))
+    if args.json:
+        import json
+        print(json.dumps(summary,indent=1))
+    else:
+        print_summary(args.method,summary)
+
+if __name__ == "__main__":
+    # generated modules register their clients in omgpp_runtime, not in __main__
+    from omgpp_runtime import main
+    main()
+'''
@@ -0,0 +1,62 @@
+from google.protobuf.message import Message
+
+# field numbers of the extensions declared in proto/omgpp/options.proto
+METHOD_TIMEOUT_MS = 51001
+METHOD_MAX_CONCURRENCY = 51002
+METHOD_QUEUE_DEPTH = 51003
+METHOD_STREAM_WINDOW = 51004
+METHOD_COALESCE = 51005
+METHOD_CACHEABLE = 51006
+METHOD_CACHE_TTL_MS = 51007
+METHOD_CACHE_SIZE = 51008
+FIELD_COALESCE_KEY = 51101
+MESSAGE_DELTA = 51201
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+def read_varint(data:bytes,position:int):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value,position)
+        shift += 7
+
+def get_extension_values(options:Message,field_number:int) -> list:
+    # the plugin has no generated code for omgpp/options.proto, so its extensions survive as
+    # unknown fields of the options message and are decoded straight from the wire format
+    data = options.SerializeToString()
+    values = []
+    position = 0
+    while position < len(data):
+        (tag,position) = read_varint(data,position)
+        number = tag >> 3
+        wire_type = tag & 0x7
+        if wire_type == WIRE_VARINT:
+            (value,position) = read_varint(data,position)
+        elif wire_type == WIRE_FIXED64:
+            value = data[position:position+8]
+            position += 8
+        elif wire_type == WIRE_LENGTH_DELIMITED:
+            (length,position) = read_varint(data,position)
+            value = data[position:position+length]
+            position += length
+        elif wire_type == WIRE_FIXED32:
+            value = data[position:position+4]
+            position += 4
+        else:
+            raise Exception(f"Unsupported wire type {wire_type} in {options.DESCRIPTOR.full_name}")
+        if number == field_number:
+            values.append(value)
+    return values
+
+def get_extension_varint(options:Message,field_number:int,default:int = None) -> int:
+    values = get_extension_values(options,field_number)
+    # for scalars the last occurrence wins
+    return values[-1] if len(values) > 0 else default
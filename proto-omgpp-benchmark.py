@@ -0,0 +1,137 @@
+#!/usr/bin/python
+import argparse
+import json
+import resource
+import sys
+import time
+
+from google.protobuf.compiler.plugin_pb2 import (
+    CodeGeneratorRequest,
+)
+from descriptor_context import get_request_context
+from generator_options import GeneratorOptions
+from languages.csharp.csharp_gen import csharp_gen_omgpp
+from synthetic_schema import SyntheticSchema, build_request
+from utils import GENERATOR_VERSION
+
+"""
+Runs the plugin pipeline in process against synthetic CodeGeneratorRequests.
+
+    python proto-omgpp-benchmark.py --files 3000 --methods 20 --output new.json --baseline old.json
+
+Every phase is timed separately and the best of --repeat runs is reported. With --baseline the
+results are compared to an earlier JSON report and the process exits with 1 when a timing grows
+by more than --threshold.
+"""
+
+PHASES = ["parse_request","build_context","generate","serialize_response"]
+
+def get_peak_rss_kb(who:int) -> int:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss
+
+def run_once(request_bytes:bytes) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    request = CodeGeneratorRequest.FromString(request_bytes)
+    timings["parse_request"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    context = get_request_context(request)
+    options = GeneratorOptions(request.parameter)
+    timings["build_context"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = csharp_gen_omgpp(context,options)
+    timings["generate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response_bytes = response.SerializeToString()
+    timings["serialize_response"] = time.perf_counter() - start
+
+    timings["wall"] = sum(timings[phase] for phase in PHASES)
+    return {
+        "timings": timings,
+        "output_files": len(response.file),
+        "output_bytes": sum(len(f.content.encode("utf-8")) for f in response.file),
+        "response_bytes": len(response_bytes),
+    }
+
+def run_benchmark(schema:SyntheticSchema,parameter:str,repeat:int) -> dict:
+    start = time.perf_counter()
+    request_bytes = build_request(schema,parameter).SerializeToString()
+    build_time = time.perf_counter() - start
+
+    runs = [run_once(request_bytes) for _ in range(repeat)]
+    best = dict((key,min(run["timings"][key] for run in runs)) for key in runs[0]["timings"])
+    return {
+        "generator_version": GENERATOR_VERSION,
+        "python": sys.version.split()[0],
+        "schema": schema.to_dict(),
+        "parameter": parameter,
+        "repeat": repeat,
+        "request_bytes": len(request_bytes),
+        "build_request_seconds": build_time,
+        "seconds": best,
+        "output_files": runs[0]["output_files"],
+        "output_bytes": runs[0]["output_bytes"],
+        "response_bytes": runs[0]["response_bytes"],
+        "peak_rss_kb": get_peak_rss_kb(resource.RUSAGE_SELF),
+        "peak_rss_children_kb": get_peak_rss_kb(resource.RUSAGE_CHILDREN),
+    }
+
+def compare(result:dict,baseline:dict,threshold:float) -> list:
+    regressions = []
+    if result["schema"] != baseline["schema"] or result["parameter"] != baseline["parameter"]:
+        sys.stderr.write("warning: baseline was recorded with a different schema or parameter\n")
+    for key in ["wall"] + PHASES:
+        before = baseline["seconds"].get(key)
+        after = result["seconds"][key]
+        if before is not None and before > 0 and after > before * (1 + threshold):
+            regressions.append(f"{key}: {before:.4f}s -> {after:.4f}s (+{(after / before - 1) * 100:.1f}%)")
+    before = baseline.get("peak_rss_kb")
+    after = result["peak_rss_kb"]
+    if before and after > before * (1 + threshold):
+        regressions.append(f"peak_rss_kb: {before} -> {after} (+{(after / before - 1) * 100:.1f}%)")
+    return regressions
+
+def print_result(result:dict):
+    print(f"files {result['schema']['files']}, request {result['request_bytes']} bytes, parameter '{result['parameter']}'")
+    for key in PHASES + ["wall"]:
+        print(f"  {key:<20} {result['seconds'][key]:.4f}s")
+    print(f"  output               {result['output_files']} files, {result['output_bytes']} bytes")
+    print(f"  peak rss             {result['peak_rss_kb']} kB (children {result['peak_rss_children_kb']} kB)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark proto-omgpp-gen against a synthetic schema")
+    parser.add_argument("--files",type=int,default=100)
+    parser.add_argument("--messages",type=int,default=20,help="top level messages per file")
+    parser.add_argument("--fields",type=int,default=8,help="fields per message")
+    parser.add_argument("--depth",type=int,default=1,help="message nesting depth, 1 means no nested messages")
+    parser.add_argument("--services",type=int,default=1,help="services per file")
+    parser.add_argument("--methods",type=int,default=10,help="methods per service")
+    parser.add_argument("--packages",type=int,default=10,help="number of distinct packages the files are spread over")
+    # synthetic names are very regular, which the legacy ID scheme maps onto colliding IDs
+    parser.add_argument("--parameter",default="id_scheme=fnv1a64",help="plugin parameter, as passed with --omgpp_opt")
+    parser.add_argument("--repeat",type=int,default=3)
+    parser.add_argument("--output",help="write the JSON report to this file")
+    parser.add_argument("--baseline",help="JSON report to compare against")
+    parser.add_argument("--threshold",type=float,default=0.10,help="allowed relative slowdown before failing")
+    args = parser.parse_args()
+
+    schema = SyntheticSchema(args.files,args.messages,args.fields,args.depth,args.services,args.methods,args.packages)
+    result = run_benchmark(schema,args.parameter,max(1,args.repeat))
+    print_result(result)
+
+    if args.output:
+        with open(args.output,"w") as f:
+            json.dump(result,f,indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result,baseline,args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,18 @@
+#!/usr/bin/python
+import argparse
+from generator_daemon import get_socket_path, run_daemon
+
+"""
+Keeps the generator loaded between protoc invocations. proto-omgpp-gen.py forwards requests to it
+over a Unix socket and falls back to generating in process when no daemon is listening.
+
+    python proto-omgpp-daemon.py --idle-timeout 600 &
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve proto-omgpp-gen requests from a warm process")
+    parser.add_argument("--socket",default=get_socket_path(),help="Unix socket path, defaults to $OMGPP_DAEMON_SOCKET or a per-user path in the temp directory")
+    parser.add_argument("--cache-entries",type=int,default=4096,help="generated files kept in memory, keyed like the cache_dir cache")
+    parser.add_argument("--idle-timeout",type=float,default=0,help="exit after this many seconds without requests, 0 runs until stopped")
+    args = parser.parse_args()
+    run_daemon(args.socket,args.cache_entries,args.idle_timeout)
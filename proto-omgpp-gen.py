@@ -1,72 +1,29 @@
 #!/usr/bin/python
-import logging
+import os
 import sys
-import json
-from typing import List
-import string
-from google.protobuf.compiler.plugin_pb2 import (
-    CodeGeneratorResponse,
-    CodeGeneratorRequest,
-)
-from google.protobuf.descriptor_pb2 import (
-    FileDescriptorProto,
-)
-from languages.csharp.csharp_gen import *
-from utils import *
-"""
-https://buf.build/docs/reference/descriptors/#options-messages
-─ FileDescriptorProto
-   │
-   ├─ DescriptorProto           // Messages
-   │   ├─ FieldDescriptorProto  //   - normal fields and nested extensions
-   │   ├─ OneofDescriptorProto
-   │   ├─ DescriptorProto       //   - nested messages
-   │   │   └─ (...more...)
-   │   └─ EnumDescriptorProto   //   - nested enums
-   │       └─ EnumValueDescriptorProto
-   │
-   ├─ EnumDescriptorProto       // Enums
-   │   └─ EnumValueDescriptorProto
-   │
-   ├─ FieldDescriptorProto      // Extensions
-   │
-   └─ ServiceDescriptorProto    // Services
-       └─ MethodDescriptorProto
-"""
-protoc_dev_input_file="dev_protoc_input.txt"
+from generator_daemon import STATUS_ERROR, STATUS_OK, get_socket_path, request_daemon
 
+# plugin entry point. It only imports the standard library and forwards the request to a running
+# proto-omgpp-daemon.py; without a daemon (or with OMGPP_DAEMON=0) the request is generated in process
 
+def generate(request_data:bytes):
+    if os.environ.get("OMGPP_DAEMON","1") != "0":
+        try:
+            (status,response_data,log) = request_daemon(get_socket_path(),request_data,os.getcwd())
+        except OSError:
+            # no daemon running, or it went away mid-request
+            status = None
+        if status == STATUS_OK:
+            return (response_data,log)
+        if status == STATUS_ERROR:
+            sys.stderr.write(log)
+            sys.exit(1)
+    from generator_runner import run_generator
+    return run_generator(request_data)
 
-def debug_descriptors(descriptors:List[FileDescriptorProto]):
-    for d in descriptors:
-        print('=====================')           
-        print(d.name)
-        print('Package:' ,d.package)
-        print('Options:' ,d.options.csharp_namespace, d.options.java_package)
-        print('Dependencies: ',len(d.dependency),d.dependency)        # imported protos
-        print('Messages: ',len(d.message_type), [to_camel_case(m.name) for m in d.message_type])      # declared messages
-        print('Services: ',len(d.service), [s.name for s in d.service])           # declared services    
-        print("csharp_namespace = ",get_namespace(d))
-        # names = [to_csharp_name(m.name) for m in d.message_type]
-        # for name in names:
-            # print(get_csharp_class_template(name)) 
 if __name__ == "__main__":
-    #save_protoc_input(protoc_dev_input_file)
-    request = None
-    debug=False
-    # read from file for debug purpose
-    if debug:
-        file1 = open(protoc_dev_input_file, "rb") 
-        request = CodeGeneratorRequest.FromString(file1.read())
-        file1.close()
-    else:
-        request = CodeGeneratorRequest.FromString(sys.stdin.buffer.read())
-    
-    files_to_generate = request.file_to_generate
-    descriptors = request.source_file_descriptors
-    context = DescriptorContext(descriptors)
-
-    response = csharp_gen_omgpp(context)
-
-    # if not debug:
-    sys.stdout.buffer.write(response.SerializeToString())
\ No newline at end of file
+    request_data = sys.stdin.buffer.read()
+    (response_data,log) = generate(request_data)
+    # stdout is reserved for the response; protoc forwards plugin stderr to the user
+    sys.stderr.write(log)
+    sys.stdout.buffer.write(response_data)
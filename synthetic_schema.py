@@ -0,0 +1,96 @@
+from google.protobuf.descriptor_pb2 import (
+    DescriptorProto,
+    FieldDescriptorProto,
+    FileDescriptorProto,
+)
+from google.protobuf.compiler.plugin_pb2 import (
+    CodeGeneratorRequest,
+)
+
+SCALAR_FIELD_TYPES = [
+    FieldDescriptorProto.TYPE_INT32,
+    FieldDescriptorProto.TYPE_STRING,
+    FieldDescriptorProto.TYPE_BYTES,
+    FieldDescriptorProto.TYPE_INT64,
+    FieldDescriptorProto.TYPE_BOOL,
+]
+
+class SyntheticSchema:
+    def __init__(self, files:int = 100, messages:int = 20, fields:int = 8, depth:int = 1, services:int = 1, methods:int = 10, packages:int = 10) -> None:
+        self.files = files
+        self.messages = messages
+        self.fields = fields
+        self.depth = depth
+        self.services = services
+        self.methods = methods
+        self.packages = packages
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+def get_file_name(index:int) -> str:
+    return f"bench/file_{index}.proto"
+
+def get_package(schema:SyntheticSchema,index:int) -> str:
+    return f"bench.pkg{index % max(1,schema.packages)}"
+
+def get_message_name(file_index:int,message_index:int) -> str:
+    # message names must be unique within a package, and files share packages
+    return f"File{file_index}Message{message_index}"
+
+def build_message(schema:SyntheticSchema,name:str,type_prefix:str,depth:int,reference:str) -> DescriptorProto:
+    message = DescriptorProto(name=name)
+    for i in range(schema.fields):
+        field = message.field.add(name=f"field_{i}",number=i + 1,label=FieldDescriptorProto.LABEL_OPTIONAL)
+        # every fourth field references another message to exercise type resolution
+        if reference is not None and i % 4 == 3:
+            field.type = FieldDescriptorProto.TYPE_MESSAGE
+            field.type_name = reference
+        else:
+            field.type = SCALAR_FIELD_TYPES[i % len(SCALAR_FIELD_TYPES)]
+    if depth > 1:
+        nested_name = f"{name}Nested"
+        message.nested_type.append(build_message(schema,nested_name,f"{type_prefix}.{name}",depth - 1,reference))
+        message.field.add(name="nested",number=schema.fields + 1,label=FieldDescriptorProto.LABEL_OPTIONAL,
+                          type=FieldDescriptorProto.TYPE_MESSAGE,type_name=f"{type_prefix}.{name}.{nested_name}")
+    return message
+
+def build_file(schema:SyntheticSchema,index:int) -> FileDescriptorProto:
+    package = get_package(schema,index)
+    file = FileDescriptorProto(name=get_file_name(index),package=package,syntax="proto3")
+    if index > 0:
+        file.dependency.append(get_file_name(index - 1))
+        # the first message of the imported file, used by fields and methods to cross file boundaries
+        imported = f".{get_package(schema,index - 1)}.{get_message_name(index - 1,0)}"
+    else:
+        imported = None
+
+    for m in range(schema.messages):
+        reference = imported if m == 0 else f".{package}.{get_message_name(index,m - 1)}"
+        file.message_type.append(build_message(schema,get_message_name(index,m),f".{package}",schema.depth,reference))
+
+    for s in range(schema.services):
+        service = file.service.add(name=f"File{index}Service{s}")
+        for m in range(schema.methods):
+            input_type = f".{package}.{get_message_name(index,m % schema.messages)}"
+            if imported is not None and m % 3 == 2:
+                output_type = imported
+            elif m % 5 == 4:
+                output_type = ".google.protobuf.Empty"
+            else:
+                output_type = f".{package}.{get_message_name(index,(m + 1) % schema.messages)}"
+            service.method.add(name=f"Method{m}",input_type=input_type,output_type=output_type)
+    return file
+
+def build_request(schema:SyntheticSchema,parameter:str = "") -> CodeGeneratorRequest:
+    if schema.services > 0 and schema.methods > 0 and schema.messages == 0:
+        raise Exception("Synthetic services need at least one message per file")
+    request = CodeGeneratorRequest(parameter=parameter)
+    request.proto_file.add(name="google/protobuf/empty.proto",package="google.protobuf",syntax="proto3").message_type.add(name="Empty")
+    for i in range(schema.files):
+        file = build_file(schema,i)
+        if schema.services > 0:
+            file.dependency.append("google/protobuf/empty.proto")
+        request.proto_file.append(file)
+        request.file_to_generate.append(file.name)
+    return request
@@ -0,0 +1,18 @@
+import os
+import sys
+import types
+
+import pytest
+
+# the generator is a set of top-level modules run from the repository root
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def omgpp_runtime():
+    # the emitted omgpp_runtime.py, importable by generated client modules
+    from languages.python.python_runtime_templates import RUNTIME_MODULE, get_runtime
+    module = types.ModuleType(RUNTIME_MODULE)
+    exec(compile(get_runtime(),f"{RUNTIME_MODULE}.py","exec"),module.__dict__)
+    sys.modules[RUNTIME_MODULE] = module
+    yield module
+    del sys.modules[RUNTIME_MODULE]
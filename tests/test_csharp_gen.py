@@ -0,0 +1,346 @@
+import pytest
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto, FileDescriptorProto
+
+from descriptor_context import DescriptorContext
+from generator_options import GeneratorOptions
+from languages.csharp.csharp_gen import csharp_gen_omgpp
+from omgpp_options import FIELD_COALESCE_KEY, MESSAGE_DELTA, METHOD_CACHE_SIZE, METHOD_CACHE_TTL_MS, METHOD_CACHEABLE, METHOD_COALESCE, METHOD_MAX_CONCURRENCY, METHOD_QUEUE_DEPTH, METHOD_STREAM_WINDOW, METHOD_TIMEOUT_MS
+
+EMPTY = ".google.protobuf.Empty"
+
+def set_extension(options,field_number:int,value:int):
+    # omgpp options are read back as unknown fields, so they are written as raw varints
+    data = bytearray()
+    for number in [field_number << 3,value]:
+        while number >= 0x80:
+            data.append(number & 0x7f | 0x80)
+            number >>= 7
+        data.append(number)
+    options.MergeFromString(bytes(data))
+
+def add_field(message,name:str,number:int,field_type:int = FieldDescriptorProto.TYPE_INT32):
+    return message.field.add(name=name,number=number,type=field_type,label=FieldDescriptorProto.LABEL_OPTIONAL)
+
+def build_files() -> list:
+    empty = FileDescriptorProto(name="google/protobuf/empty.proto",package="google.protobuf",syntax="proto3")
+    empty.message_type.add(name="Empty")
+    game = FileDescriptorProto(name="game.proto",package="test",syntax="proto3",dependency=["google/protobuf/empty.proto"])
+    position = game.message_type.add(name="Position")
+    add_field(position,"x",1)
+    add_field(position,"name",2,FieldDescriptorProto.TYPE_STRING)
+    add_field(position,"id",3,FieldDescriptorProto.TYPE_INT64)
+    add_field(game.message_type.add(name="Ack"),"ok",1,FieldDescriptorProto.TYPE_BOOL)
+    service = game.service.add(name="Game")
+    service.method.add(name="Move",input_type=".test.Position",output_type=".test.Ack")
+    service.method.add(name="Notify",input_type=".test.Position",output_type=EMPTY)
+    service.method.add(name="Ping",input_type=EMPTY,output_type=".test.Ack")
+    return [empty,game]
+
+def get_method(files:list,name:str):
+    return next(method for method in files[1].service[0].method if method.name == name)
+
+def generate(files:list,parameter:str = "") -> dict:
+    context = DescriptorContext(files,["game.proto"])
+    response = csharp_gen_omgpp(context,GeneratorOptions(parameter))
+    return dict((f.name,f.content) for f in response.file)
+
+def get_method_ids(files:list,parameter:str = "") -> dict:
+    context = DescriptorContext(files,["game.proto"])
+    symbol = context.get_symbol(".test.Game")
+    return dict((method.name,id) for method, (id,_) in zip(symbol.descriptor.method,symbol.get_method_ids(GeneratorOptions(parameter).id_scheme)))
+
+def test_server_dispatches_every_method_with_a_switch():
+    files = build_files()
+    server = generate(files)["Game.Service.Server.Omgpp.cs"]
+    assert "switch (methodId)" in server
+    assert "Dictionary" not in server
+    for name, id in get_method_ids(files).items():
+        assert f"case {id}:\n                    Handle{name}(server, clientGuid, ip, port, isReliable, methodId, requestId, argType, argData);\n                    return;" in server
+
+def test_zero_copy_handlers_take_spans():
+    default = generate(build_files())
+    files = generate(build_files(),"zero_copy=true")
+    server = files["Game.Service.Server.Omgpp.cs"]
+    client = files["Game.Service.Client.Omgpp.cs"]
+    assert "private void HandleMove(global::OmgppSharpClientServer.Server server, Guid clientGuid, IPAddress ip, ushort port, bool isReliable, long methodId, ulong requestId, long argType, ReadOnlySpan<byte> argData)" in server
+    assert "long argType, ReadOnlySpan<byte> argData)\n" in server
+    assert "long argType, in ReadOnlySequence<byte> argData)\n" in server
+    assert "public void HandleRpcResponse(long methodId, ulong requestId, long argType, ReadOnlySpan<byte> argData)" in client
+    assert "public void HandleRpcResponse(long methodId, ulong requestId, long argType, in ReadOnlySequence<byte> argData)" in client
+    # spans need no null check and are never copied into an array
+    assert "Array.Empty<byte>()" not in server
+    assert "ToArray()" not in server
+    assert "long argType, byte[]? argData){" in default["Game.Service.Server.Omgpp.cs"]
+
+def test_pooled_messages_reset_every_field():
+    messages = generate(build_files(),"pooling=true,pool_size=32")["Game.Omgpp.cs"]
+    assert "new global::Omgpp.Runtime.ObjectPool<Position>(32);" in messages
+    assert "\tvoid ResetForPool()\n\t{\n\t\tX = default;\n\t\tName = \"\";\n\t\tId = default;\n\t\t_unknownFields = null;\n\t}\n" in messages
+
+@pytest.mark.parametrize("parameter,release",[
+    # the synchronous handler returns the message after the call, the async one only if parsing fails
+    ("pooling=true","\n    result = service.Move(clientGuid, ip, port, message);\n}\nfinally\n{\n    global::Test.Position.ReturnToPool(message);\n}\n"),
+    ("pooling=true,async_server=true","\n}\ncatch\n{\n    global::Test.Position.ReturnToPool(message);\n    throw;\n}\n"),
+])
+def test_pooled_messages_are_returned_when_parsing_fails(parameter:str,release:str):
+    files = generate(build_files(),parameter)
+    server = files["Game.Service.Server.Omgpp.cs"]
+    client = files["Game.Service.Client.Omgpp.cs"]
+    assert "var message = global::Test.Position.RentFromPool();\ntry\n{\n    message.MergeFrom(argData);" + release in server
+    assert "msg.MergeFrom(argData);\n                  }\n                  catch\n                  {\n                      global::Test.Ack.ReturnToPool(msg);\n                      throw;\n" in client
+
+def test_slot_requests_are_matched_on_method_and_request_id():
+    files = build_files()
+    set_extension(get_method(files,"Move").options,METHOD_TIMEOUT_MS,250)
+    ids = get_method_ids(files)
+    generated = generate(files,"client_requests=slots,pending_slots=256,timer_tick_ms=5")
+    client = generated["Game.Service.Client.Omgpp.cs"]
+    runtime = generated["Omgpp.Runtime.cs"]
+    assert "new global::Omgpp.Runtime.PendingRequestTable(256);" in client
+    assert f"pendingRequests.Register(request, {ids['Move']}, 250);" in client
+    assert f"pendingRequests.Register(request, {ids['Ping']}, 1000);" in client
+    # every client handler of a Client sees every response, so the method must match as well
+    assert "pendingRequests.Complete(methodId, requestId, argType, argData);" in client
+    assert "request.MethodId != methodId.Value" in runtime
+    assert "new TimerWheel(5, 1024);" in runtime
+
+def test_responses_are_tagged_with_the_response_message_id():
+    files = generate(build_files())
+    server = files["Game.Service.Server.Omgpp.cs"]
+    client = files["Game.Service.Client.Omgpp.cs"]
+    assert server.count("server.CallRpc(clientGuid, methodId, requestId, global::Test.Ack.MessageId, data, isReliable);") == 2
+    assert "global::Test.Position.MessageId, data" not in server
+    ids = get_method_ids(build_files())
+    # a method without a request message sends no payload
+    assert f"client.CallRpc({ids['Ping']}, reqId, 0, Span<byte>.Empty, isReliable);" in client
+
+@pytest.mark.parametrize("parameter,buffer",[
+    ("","Span<byte> data = size <= 512 ? stackalloc byte[size] : (rented = ArrayPool<byte>.Shared.Rent(size)).AsSpan(0, size);"),
+    ("stackalloc_threshold=64","Span<byte> data = size <= 64 ? stackalloc byte[size] : (rented = ArrayPool<byte>.Shared.Rent(size)).AsSpan(0, size);"),
+    ("stackalloc_threshold=0","var rented = ArrayPool<byte>.Shared.Rent(size);\nvar data = new Span<byte>(rented, 0, size);"),
+])
+def test_messages_are_serialized_into_exactly_sized_spans(parameter:str,buffer:str):
+    server = generate(build_files(),parameter)["Game.Service.Server.Omgpp.cs"]
+    assert "var size = result?.CalculateSize() ?? 0;\n" in server
+    assert buffer in server
+    assert "result?.WriteTo(data);" in server
+
+def build_bundle_files() -> list:
+    files = build_files()
+    extra = FileDescriptorProto(name="extra.proto",package="test",syntax="proto3")
+    extra.message_type.add(name="Extra")
+    # same package, other C# namespace
+    tools = FileDescriptorProto(name="tools.proto",package="test",syntax="proto3")
+    tools.options.csharp_namespace = "Test.Tools"
+    tools.message_type.add(name="Tool")
+    return files + [extra,tools]
+
+def generate_bundle(parameter:str) -> dict:
+    files = build_bundle_files()
+    context = DescriptorContext(files,["game.proto","extra.proto","tools.proto"])
+    response = csharp_gen_omgpp(context,GeneratorOptions(parameter))
+    return dict((f.name,f.content) for f in response.file if f.name != "Omgpp.Runtime.cs")
+
+def test_bundle_merges_usings_of_all_fragments():
+    files = generate_bundle("bundle=namespace")
+    assert sorted(files) == ["Test.Omgpp.cs","Test.Tools.Omgpp.cs"]
+    bundle = files["Test.Omgpp.cs"]
+    usings = [line for line in bundle.splitlines() if line.startswith("using ")]
+    # message, server and client usings, each once and in order of first use
+    assert usings == [
+        "using global::OmgppSharpCore.Interfaces;",
+        "using Google.Protobuf;",
+        "using System.Net;",
+        "using OmgppSharpClientServer;",
+        "using System.Buffers;",
+        "using static OmgppSharpClientServer.IServerRpcHandler;",
+    ]
+    assert bundle.count("/** <auto-generated>") == 1
+    assert bundle.count("namespace Test\n") == 1
+    for name in ["class Position","class Ack","class Extra","class GameServerHandler","class GameClientHandler"]:
+        assert name in bundle
+    tools = files["Test.Tools.Omgpp.cs"]
+    assert [line for line in tools.splitlines() if line.startswith("using ")] == ["using global::OmgppSharpCore.Interfaces;","using Google.Protobuf;"]
+
+def test_bundle_by_package_keeps_namespaces_apart():
+    files = generate_bundle("bundle=package")
+    assert sorted(files) == ["Test.Omgpp.cs"]
+    bundle = files["Test.Omgpp.cs"]
+    assert bundle.count("namespace Test\n") == 1
+    assert bundle.count("namespace Test.Tools\n") == 1
+    assert bundle.index("class Tool ") > bundle.index("namespace Test.Tools\n")
+
+def test_async_server_runs_calls_on_bounded_queues():
+    files = build_files()
+    set_extension(get_method(files,"Move").options,METHOD_MAX_CONCURRENCY,2)
+    set_extension(get_method(files,"Move").options,METHOD_QUEUE_DEPTH,8)
+    generated = generate(files,"async_server=true,max_concurrency=4,queue_depth=16")
+    server = generated["Game.Service.Server.Omgpp.cs"]
+    assert "\tValueTask<global::Test.Ack> Move(System.Guid clientGuid,System.Net.IPAddress ip,ushort port,global::Test.Position message);" in server
+    assert "\tValueTask Notify(System.Guid clientGuid,System.Net.IPAddress ip,ushort port,global::Test.Position message);" in server
+    # per-method options override the plugin defaults
+    assert "MoveQueue { get; } = new global::Omgpp.Runtime.BoundedWorkQueue(2, 8);" in server
+    assert "PingQueue { get; } = new global::Omgpp.Runtime.BoundedWorkQueue(4, 16);" in server
+    assert "PingQueue.TryEnqueue(() => RunPing(server, clientGuid, ip, port, isReliable, methodId, requestId));" in server
+    assert "var result = await service.Move(clientGuid, ip, port, message);" in server
+    assert "class BoundedWorkQueue" in generated["Omgpp.Runtime.cs"]
+    assert "ValueTask" not in generate(build_files())["Game.Service.Server.Omgpp.cs"]
+
+def build_streaming_files() -> list:
+    files = build_files()
+    service = files[1].service[0]
+    service.method.add(name="Watch",input_type=".test.Position",output_type=".test.Ack",server_streaming=True)
+    service.method.add(name="Upload",input_type=".test.Position",output_type=".test.Ack",client_streaming=True)
+    service.method.add(name="Chat",input_type=".test.Position",output_type=".test.Ack",client_streaming=True,server_streaming=True)
+    return files
+
+def test_streaming_methods_get_async_enumerables():
+    files = build_streaming_files()
+    set_extension(get_method(files,"Chat").options,METHOD_STREAM_WINDOW,8)
+    generated = generate(files)
+    server = generated["Game.Service.Server.Omgpp.cs"]
+    client = generated["Game.Service.Client.Omgpp.cs"]
+    assert "\tIAsyncEnumerable<global::Test.Ack> Watch(global::Test.Position message,CancellationToken cancellationToken = default);" in client
+    assert "\tTask<global::Test.Ack> Upload(IAsyncEnumerable<global::Test.Position> messages,CancellationToken cancellationToken = default);" in client
+    assert "\tIAsyncEnumerable<global::Test.Ack> Chat(IAsyncEnumerable<global::Test.Position> messages,CancellationToken cancellationToken = default);" in client
+    assert "\tValueTask<global::Test.Ack> Upload(System.Guid clientGuid,System.Net.IPAddress ip,ushort port,IAsyncEnumerable<global::Test.Position> messages,CancellationToken cancellationToken);" in server
+    assert "stream.ServeServerStreaming(" in server
+    assert "stream.ServeClientStreaming(" in server
+    assert "stream.ServeDuplexStreaming(" in server
+    # the credit window comes from (omgpp.stream_window), falling back to the stream_window option
+    assert "OpenStream<global::Test.Ack>(" in client
+    assert ", global::Test.Ack.Parser, 8);" in client
+    assert ", global::Test.Ack.Parser, 64);" in client
+    assert "class StreamFrames" in generated["Omgpp.Runtime.cs"]
+    # schemas without streams get no stream runtime
+    assert "Omgpp.Runtime.cs" not in generate(build_files())
+
+def test_stream_window_must_not_be_zero():
+    files = build_streaming_files()
+    set_extension(get_method(files,"Watch").options,METHOD_STREAM_WINDOW,0)
+    with pytest.raises(Exception,match="stream_window"):
+        generate(files)
+
+def test_batch_entries_have_a_28_byte_header():
+    generated = generate(build_files(),"batching=true,zero_copy=true,batch_max_bytes=600,batch_flush_ms=5")
+    runtime = generated["Omgpp.Runtime.cs"]
+    assert "public const int EntryHeaderSize = 28;" in runtime
+    # methodId, requestId and argType as 64 bit, then the payload length as 32 bit, little endian
+    assert "WriteInt64LittleEndian(entry, methodId);" in runtime
+    assert "WriteUInt64LittleEndian(entry.Slice(8), requestId);" in runtime
+    assert "WriteInt64LittleEndian(entry.Slice(16), argType);" in runtime
+    assert "WriteInt32LittleEndian(entry.Slice(24), length);" in runtime
+
+def test_batched_calls_are_appended_and_dispatched_from_the_frame():
+    ids = get_method_ids(build_files())
+    generated = generate(build_files(),"batching=true,zero_copy=true,batch_max_bytes=600,batch_flush_ms=5")
+    client = generated["Game.Service.Client.Omgpp.cs"]
+    server = generated["Game.Service.Server.Omgpp.cs"]
+    assert "RpcBatch.MethodId, 0, 0, data, isReliable), 600, 5);" in client
+    assert f"batch.Append({ids['Move']}, reqId, global::Test.Position.MessageId, message, isReliable);" in client
+    assert f"batch.Append({ids['Notify']}, 0, global::Test.Position.MessageId, message, isReliable);" in client
+    assert f"batch.Append({ids['Ping']}, reqId, 0, null, isReliable);" in client
+    assert "case global::Omgpp.Runtime.RpcBatch.MethodId:\n                    HandleBatch(server, clientGuid, ip, port, isReliable, argData);" in server
+    # every call gets a slice of the frame, never a copy
+    assert "HandleRpc(server, clientGuid, ip, port, isReliable, methodId, requestId, argType, payload);" in server
+
+def mark_coalesce_key(files:list,field_name:str):
+    field = next(field for field in files[1].message_type[0].field if field.name == field_name)
+    set_extension(field.options,FIELD_COALESCE_KEY,1)
+
+def test_coalescing_requests_are_kept_per_key():
+    files = build_files()
+    set_extension(get_method(files,"Notify").options,METHOD_COALESCE,1)
+    mark_coalesce_key(files,"id")
+    client = generate(files)["Game.Service.Client.Omgpp.cs"]
+    assert "readonly global::Omgpp.Runtime.LatestValueSlots<long, global::Test.Position> coalescedNotify" in client
+    assert "coalescedNotify.Set(message.Id, message, isReliable);" in client
+    assert "public void FlushCoalesced()" in client
+    assert "public long SupersededCalls => coalescedNotify.Superseded;" in client
+
+@pytest.mark.parametrize("method,configure,error",[
+    # a superseded request is dropped, so the method must not return anything
+    ("Move",lambda files: None,"needs a unary method"),
+    ("Notify",lambda files: setattr(get_method(files,"Notify"),"input_type",EMPTY),"needs a unary method"),
+    ("Notify",lambda files: setattr(get_method(files,"Notify"),"client_streaming",True),"needs a unary method"),
+    ("Notify",lambda files: (mark_coalesce_key(files,"x"),mark_coalesce_key(files,"id")),"more than one field"),
+    ("Notify",lambda files: (mark_coalesce_key(files,"id"),setattr(files[1].message_type[0].field[2],"label",FieldDescriptorProto.LABEL_REPEATED)),"must not be repeated"),
+    ("Notify",lambda files: (mark_coalesce_key(files,"id"),setattr(files[1].message_type[0].field[2],"type",FieldDescriptorProto.TYPE_BYTES)),"scalar, string or enum"),
+])
+def test_invalid_coalesce_options_are_rejected(method:str,configure,error:str):
+    files = build_files()
+    set_extension(get_method(files,method).options,METHOD_COALESCE,1)
+    configure(files)
+    with pytest.raises(Exception,match=error):
+        generate(files)
+
+def build_delta_files() -> list:
+    files = build_files()
+    state = files[1].message_type.add(name="State")
+    # field numbers run backwards, the mask follows declaration order
+    for i in range(8):
+        add_field(state,f"f{i}",20 - i)
+    state.oneof_decl.add(name="target")
+    add_field(state,"unit",30).oneof_index = 0
+    add_field(state,"tile",31,FieldDescriptorProto.TYPE_STRING).oneof_index = 0
+    add_field(state,"after",1)
+    set_extension(state.options,MESSAGE_DELTA,1)
+    return files
+
+def test_delta_mask_bits_follow_field_order():
+    messages = generate(build_delta_files())["Game.Omgpp.cs"]
+    state = messages[messages.index("class State"):]
+    assert "public const int DeltaMaskSize = 2;" in state
+    for i in range(8):
+        assert f"\t\tif (F{i} != baseline.F{i})\n\t\t{{\n\t\t\tmask[0] |= {1 << i};\n\t\t\tdelta.F{i} = F{i};\n" in state
+        assert f"\t\tif ((mask[0] & {1 << i}) != 0)\n\t\t{{\n\t\t\tF{i} = delta.F{i};\n" in state
+    # the members of a oneof share one bit
+    assert "\t\t})\n\t\t{\n\t\t\tmask[1] |= 1;\n\t\t\tswitch (TargetCase)\n" in state
+    assert "\t\tif (After != baseline.After)\n\t\t{\n\t\t\tmask[1] |= 2;\n" in state
+    # messages without (omgpp.delta) get no delta members
+    assert messages[:messages.index("class State")].count("DeltaMaskSize") == 0
+
+def test_metrics_instrument_every_method():
+    ids = get_method_ids(build_files())
+    generated = generate(build_files(),"metrics=true")
+    server = generated["Game.Service.Server.Omgpp.cs"]
+    client = generated["Game.Service.Client.Omgpp.cs"]
+    for name, id in ids.items():
+        assert f"static readonly global::Omgpp.Runtime.RpcMethodMetrics metrics{name} = new global::Omgpp.Runtime.RpcMethodMetrics({id}, \"Game.{name}\", \"server\");" in server
+        assert f"static readonly global::Omgpp.Runtime.RpcMethodMetrics metrics{name} = new global::Omgpp.Runtime.RpcMethodMetrics({id}, \"Game.{name}\", \"client\");" in client
+    # the call is counted before the argType check, and failures are recorded and rethrown
+    assert "metricsMove.Call(argData?.Length ?? 0);\nif (argType != global::Test.Position.MessageId)\n{\n    metricsMove.Failed(global::Omgpp.Runtime.RpcMetrics.ArgTypeMismatch);\n    return;\n}\ntry\n{\n" in server
+    assert "    metricsMove.Completed(started, size);\n}\ncatch (Exception e)\n{\n    metricsMove.Failed(global::Omgpp.Runtime.RpcMetrics.GetErrorType(e));\n    throw;\n}\n" in server
+    assert "new System.Diagnostics.Metrics.Meter(\"Omgpp.Rpc\");" in generated["Omgpp.Runtime.cs"]
+    assert "Metrics" not in generate(build_files())["Game.Service.Server.Omgpp.cs"]
+
+def test_cacheable_methods_answer_from_the_response_cache():
+    files = build_files()
+    set_extension(get_method(files,"Move").options,METHOD_CACHEABLE,1)
+    set_extension(get_method(files,"Move").options,METHOD_CACHE_TTL_MS,500)
+    set_extension(get_method(files,"Ping").options,METHOD_CACHEABLE,1)
+    set_extension(get_method(files,"Ping").options,METHOD_CACHE_SIZE,4)
+    generated = generate(files,"response_cache_size=32")
+    server = generated["Game.Service.Server.Omgpp.cs"]
+    assert "public global::Omgpp.Runtime.ResponseCache MoveCache { get; } = new global::Omgpp.Runtime.ResponseCache(32, 500);" in server
+    assert "public global::Omgpp.Runtime.ResponseCache PingCache { get; } = new global::Omgpp.Runtime.ResponseCache(4, 0);" in server
+    assert "public bool InvalidateMove(global::Test.Position message) => MoveCache.Invalidate(message.ToByteArray());" in server
+    assert "if (MoveCache.TryGet(argData, out var cached))\n{\n    server.CallRpc(clientGuid, methodId, requestId, global::Test.Ack.MessageId, cached, isReliable);\n    return;\n}\n" in server
+    # a response computed while the cache was invalidated carries an old version and is not stored
+    assert "var cacheVersion = MoveCache.Version;" in server
+    assert "MoveCache.Add(argData, data, cacheVersion);" in server
+    assert "class ResponseCache" in generated["Omgpp.Runtime.cs"]
+    assert "ResponseCache" not in generate(build_files())["Game.Service.Server.Omgpp.cs"]
+
+@pytest.mark.parametrize("method,configure,error",[
+    # a fire and forget method has no response to cache
+    ("Notify",lambda files: None,"needs a unary method returning a message"),
+    ("Move",lambda files: setattr(get_method(files,"Move"),"server_streaming",True),"needs a unary method returning a message"),
+    ("Move",lambda files: set_extension(get_method(files,"Move").options,METHOD_CACHE_SIZE,0),"cache_size"),
+])
+def test_invalid_cacheable_options_are_rejected(method:str,configure,error:str):
+    files = build_files()
+    set_extension(get_method(files,method).options,METHOD_CACHEABLE,1)
+    configure(files)
+    with pytest.raises(Exception,match=error):
+        generate(files)
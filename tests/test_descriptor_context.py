@@ -0,0 +1,40 @@
+from google.protobuf.descriptor_pb2 import FileDescriptorProto
+
+from descriptor_context import SYMBOL_ENUM, SYMBOL_MESSAGE, SYMBOL_SERVICE, DescriptorContext
+
+def build_files() -> list:
+    dependency = FileDescriptorProto(name="dep.proto",package="dep")
+    dependency.message_type.add(name="Shared")
+    main = FileDescriptorProto(name="main.proto",package="game.state",dependency=["dep.proto"])
+    main.options.csharp_namespace = "Game.State"
+    outer = main.message_type.add(name="player_state")
+    outer.nested_type.add(name="inventory")
+    outer.nested_type.add(name="TagsEntry").options.map_entry = True
+    outer.enum_type.add(name="Mode").value.add(name="MODE_IDLE",number=0)
+    main.service.add(name="Players")
+    unused = FileDescriptorProto(name="unused.proto",package="unused")
+    unused.message_type.add(name="Unused")
+    return [dependency,main,unused]
+
+def test_nested_symbols_get_csharp_and_python_names():
+    context = DescriptorContext(build_files(),["main.proto"])
+    nested = context.get_symbol(".game.state.player_state.inventory")
+    assert nested.kind == SYMBOL_MESSAGE
+    assert nested.csharp_full_name == "global::Game.State.PlayerState.Types.Inventory"
+    assert nested.python_name == "player_state.inventory"
+    assert context.get_symbol(".game.state.player_state.Mode").kind == SYMBOL_ENUM
+    assert context.get_symbol(".game.state.Players").kind == SYMBOL_SERVICE
+
+def test_map_entries_are_not_nested_messages():
+    context = DescriptorContext(build_files(),["main.proto"])
+    outer = context.get_symbol(".game.state.player_state")
+    assert [symbol.descriptor.name for symbol in outer.nested_messages] == ["inventory"]
+
+def test_files_are_indexed_lazily_along_imports():
+    context = DescriptorContext(build_files(),["main.proto"])
+    context.get_symbol(".game.state.Players")
+    assert "dep.proto" not in context.file_symbols
+    assert context.get_symbol(".dep.Shared") is not None
+    # files outside the import closure of the files to generate are never visited
+    assert context.get_symbol(".unused.Unused") is None
+    assert "unused.proto" not in context.file_symbols
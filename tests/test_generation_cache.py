@@ -0,0 +1,51 @@
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto, FileDescriptorProto
+
+from descriptor_context import DescriptorContext
+from generation_cache import get_cache_key
+
+def build_files(dependency_field:str = "value") -> list:
+    dependency = FileDescriptorProto(name="dep.proto",package="test")
+    dependency.message_type.add(name="Dep").field.add(name=dependency_field,number=1,type=FieldDescriptorProto.TYPE_INT32,label=FieldDescriptorProto.LABEL_OPTIONAL)
+    main = FileDescriptorProto(name="main.proto",package="test",dependency=["dep.proto"])
+    main.message_type.add(name="Main").field.add(name="dep",number=1,type=FieldDescriptorProto.TYPE_MESSAGE,type_name=".test.Dep",label=FieldDescriptorProto.LABEL_OPTIONAL)
+    unrelated = FileDescriptorProto(name="unrelated.proto",package="other")
+    unrelated.message_type.add(name="Other")
+    return [dependency,main,unrelated]
+
+def get_main_key(files:list,fingerprint:str = "") -> str:
+    context = DescriptorContext(files,["main.proto"])
+    return get_cache_key([context.descriptor_map["main.proto"]],context,fingerprint)
+
+def test_cache_key_is_stable():
+    assert get_main_key(build_files()) == get_main_key(build_files())
+
+def test_cache_key_changes_with_dependency():
+    assert get_main_key(build_files()) != get_main_key(build_files(dependency_field="renamed"))
+
+def test_cache_key_ignores_files_outside_the_import_closure():
+    files = build_files()
+    changed = build_files()
+    changed[2].message_type[0].name = "Renamed"
+    assert get_main_key(files) == get_main_key(changed)
+
+def test_cache_key_changes_with_options():
+    assert get_main_key(build_files(),"zero_copy=true") != get_main_key(build_files(),"")
+
+def test_cache_key_changes_with_transitive_dependency():
+    files = build_files()
+    base = FileDescriptorProto(name="base.proto",package="test")
+    base.message_type.add(name="Base")
+    files[0].dependency.append("base.proto")
+    changed = build_files()
+    changed_base = FileDescriptorProto(name="base.proto",package="test")
+    changed_base.message_type.add(name="Renamed")
+    changed[0].dependency.append("base.proto")
+    assert get_main_key(files + [base]) != get_main_key(changed + [changed_base])
+
+def test_cache_key_memoizes_file_digests():
+    # chained imports must not re-serialize the whole closure for every file
+    files = [FileDescriptorProto(name=f"file_{i}.proto",package="test",dependency=[f"file_{i - 1}.proto"] if i > 0 else []) for i in range(50)]
+    context = DescriptorContext(files)
+    keys = [get_cache_key([descriptor],context,"") for descriptor in context.descriptors]
+    assert len(set(keys)) == len(files)
+    assert len(context.file_digests) == len(files)
@@ -0,0 +1,58 @@
+import os
+import threading
+
+import pytest
+
+from generation_cache import MemoryCache
+from generator_daemon import STATUS_OK, STATUS_STALE, GeneratorDaemon, request_daemon
+from generator_runner import run_generator
+from synthetic_schema import SyntheticSchema, build_request
+
+def build_request_data(parameter:str) -> bytes:
+    return build_request(SyntheticSchema(files=6,messages=3,fields=3,methods=2,packages=2),parameter).SerializeToString()
+
+@pytest.fixture
+def daemon(tmp_path):
+    server = GeneratorDaemon(str(tmp_path / "omgpp.sock"),64,0)
+    thread = threading.Thread(target=server.serve,daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join(5)
+
+def test_daemon_output_matches_in_process_output(daemon,tmp_path):
+    request_data = build_request_data("id_scheme=fnv1a64")
+    (status,response_data,_) = request_daemon(daemon.socket_path,request_data,str(tmp_path))
+    assert status == STATUS_OK
+    assert response_data == run_generator(request_data)[0]
+
+def test_daemon_resolves_cache_dir_against_plugin_cwd(daemon,tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    (status,_,log) = request_daemon(daemon.socket_path,build_request_data("id_scheme=fnv1a64,cache_dir=omgpp-cache"),str(project))
+    assert status == STATUS_OK
+    assert (project / "omgpp-cache").is_dir()
+    assert not os.path.exists("omgpp-cache")
+    assert str(project / "omgpp-cache") in log
+
+def test_daemon_runs_parallel_jobs(daemon,tmp_path):
+    # the daemon serves on threads, so workers must be spawned rather than forked
+    request_data = build_request_data("id_scheme=fnv1a64,jobs=2")
+    (status,response_data,log) = request_daemon(daemon.socket_path,request_data,str(tmp_path))
+    assert status == STATUS_OK, log
+    assert response_data == run_generator(build_request_data("id_scheme=fnv1a64"))[0]
+
+def test_daemon_rejects_other_plugin_sources(daemon,tmp_path):
+    daemon.code_fingerprint = "outdated"
+    (status,_,log) = request_daemon(daemon.socket_path,build_request_data(""),str(tmp_path))
+    assert status == STATUS_STALE
+    assert "outdated" in log
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(2)
+    cache.put("a",[])
+    cache.put("b",[])
+    cache.get("a")
+    cache.put("c",[])
+    assert cache.get("a") == []
+    assert cache.get("b") is None
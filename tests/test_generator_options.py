@@ -0,0 +1,38 @@
+import pytest
+
+from generator_options import GeneratorOptions, parse_parameter
+
+def test_parse_parameter():
+    assert parse_parameter(" zero_copy , jobs=4,cache_dir=a=b,") == {"zero_copy": "true","jobs": "4","cache_dir": "a=b"}
+
+def test_defaults():
+    options = GeneratorOptions("")
+    assert options.jobs == 1
+    assert options.id_scheme == "legacy"
+    assert options.lang == "csharp"
+    assert options.bundle == "none"
+    assert options.emit_runtime
+
+def test_fingerprint_ignores_runtime_only_options():
+    assert GeneratorOptions("jobs=4,cache_dir=x,zero_copy=true").fingerprint() == GeneratorOptions("zero_copy=true").fingerprint()
+    assert GeneratorOptions("zero_copy=true").fingerprint() != GeneratorOptions("zero_copy=false").fingerprint()
+
+@pytest.mark.parametrize("parameter",[
+    "jobs=-1",
+    "jobs=four",
+    "id_scheme=md5",
+    "zero_copy=yes",
+    "client_requests=list",
+    "pending_slots=1000",
+    "pending_slots=0",
+    "timer_tick_ms=0",
+    "stream_window=0",
+    "batch_max_bytes=0",
+    "batching=true",
+    "response_cache_size=0",
+    "bundle=file",
+    "lang=java",
+])
+def test_rejects_invalid_values(parameter:str):
+    with pytest.raises(Exception,match="Option"):
+        GeneratorOptions(parameter)
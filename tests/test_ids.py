@@ -0,0 +1,55 @@
+import json
+
+import pytest
+from google.protobuf.descriptor_pb2 import FileDescriptorProto
+
+from descriptor_context import DescriptorContext
+from id_registry import ID_KIND_MESSAGE, ID_KIND_METHOD, IdRegistry
+from utils import get_fnv1a64_id_from_string, get_id_from_string
+
+def to_signed(value:int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+@pytest.mark.parametrize("text,expected",[
+    # reference vectors of 64-bit FNV-1a
+    ("",0xcbf29ce484222325),
+    ("a",0xaf63dc4c8601ec8c),
+    ("foobar",0x85944171f73967e8),
+])
+def test_fnv1a64_vectors(text:str,expected:int):
+    assert get_fnv1a64_id_from_string(text) == to_signed(expected)
+    assert get_id_from_string(text,"fnv1a64") == to_signed(expected)
+
+def test_fnv1a64_hashes_utf8():
+    assert get_fnv1a64_id_from_string("é") != get_fnv1a64_id_from_string("e")
+
+def test_registry_accepts_the_same_name_twice():
+    registry = IdRegistry("legacy")
+    registry.register(1,ID_KIND_MESSAGE,"p.A")
+    registry.register(1,ID_KIND_MESSAGE,"p.A")
+
+def test_registry_raises_on_collision():
+    registry = IdRegistry("legacy")
+    registry.register(1,ID_KIND_MESSAGE,"p.A")
+    with pytest.raises(Exception,match="ID collision: method p.S.M and message p.A"):
+        registry.register(1,ID_KIND_METHOD,"p.S.M")
+
+def build_colliding_file() -> FileDescriptorProto:
+    # "p.Aad" and "p.Aea" have the same legacy position-weighted sum
+    file = FileDescriptorProto(name="p.proto",package="p")
+    file.message_type.add(name="Aad")
+    file.message_type.add(name="Aea")
+    return file
+
+def test_register_file_detects_colliding_messages():
+    file = build_colliding_file()
+    context = DescriptorContext([file])
+    with pytest.raises(Exception,match="ID collision"):
+        IdRegistry("legacy").register_file(file,context)
+
+def test_fnv1a64_resolves_legacy_collision():
+    file = build_colliding_file()
+    registry = IdRegistry("fnv1a64")
+    registry.register_file(file,DescriptorContext([file]))
+    messages = json.loads(registry.to_json())["messages"]
+    assert sorted(messages.values()) == ["p.Aad","p.Aea"]
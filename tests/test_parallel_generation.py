@@ -0,0 +1,19 @@
+from google.protobuf.compiler.plugin_pb2 import CodeGeneratorResponse
+
+from generator_runner import run_generator
+from synthetic_schema import SyntheticSchema, build_request
+
+def generate(parameter:str) -> bytes:
+    schema = SyntheticSchema(files=12,messages=4,fields=4,methods=3,packages=3)
+    (response_data,_) = run_generator(build_request(schema,parameter).SerializeToString())
+    return response_data
+
+def test_parallel_output_matches_serial_output():
+    serial = generate("id_scheme=fnv1a64")
+    response = CodeGeneratorResponse.FromString(serial)
+    assert response.error == ""
+    assert len(response.file) > 12
+    assert generate("id_scheme=fnv1a64,jobs=3") == serial
+
+def test_parallel_bundles_match_serial_bundles():
+    assert generate("id_scheme=fnv1a64,bundle=package,jobs=4") == generate("id_scheme=fnv1a64,bundle=package")
@@ -0,0 +1,36 @@
+import pytest
+from google.protobuf.descriptor_pb2 import FileDescriptorProto
+
+from descriptor_context import DescriptorContext
+from generator_options import GeneratorOptions
+from languages.python.python_gen import python_gen_omgpp
+
+EMPTY = ".google.protobuf.Empty"
+
+def build_file(method_names:list) -> FileDescriptorProto:
+    file = FileDescriptorProto(name="tools.proto",package="test",dependency=["google/protobuf/empty.proto"])
+    service = file.service.add(name="Tools")
+    for name in method_names:
+        service.method.add(name=name,input_type=EMPTY,output_type=EMPTY)
+    return file
+
+def generate(file:FileDescriptorProto) -> dict:
+    empty = FileDescriptorProto(name="google/protobuf/empty.proto",package="google.protobuf")
+    empty.message_type.add(name="Empty")
+    response = python_gen_omgpp(DescriptorContext([empty,file],[file.name]),GeneratorOptions("lang=python"))
+    return dict((f.name,f.content) for f in response.file)
+
+def test_generated_client_keeps_runtime_members(omgpp_runtime):
+    files = generate(build_file(["call","connection","methods","import","Ping"]))
+    namespace = {}
+    exec(compile(files["tools_omgpp.py"],"tools_omgpp.py","exec"),namespace)
+    client_type = namespace["ToolsClient"]
+    assert client_type.call is omgpp_runtime.RpcClient.call
+    assert sorted(client_type.methods) == ["Ping","call","connection","import","methods"]
+    for name in ["call_","connection_","methods_","import_","Ping"]:
+        assert callable(getattr(client_type,name))
+    assert omgpp_runtime.find_method("Tools.call") == (client_type,client_type.methods["call"])
+
+def test_methods_mapping_to_the_same_python_name_are_rejected():
+    with pytest.raises(Exception,match="call_"):
+        generate(build_file(["call","call_"]))
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+from google.protobuf.wrappers_pb2 import Int32Value, StringValue
+
+class LoopbackTransport:
+    def __init__(self, host:str = "", port:int = 0) -> None:
+        self.sent = []
+        self.on_rpc = None
+        self.on_closed = None
+
+    async def connect(self):
+        pass
+
+    def send(self, method_id:int, request_id:int, arg_type:int, data:bytes, reliable:bool):
+        self.sent.append((method_id,request_id,arg_type,data))
+
+    async def drain(self):
+        pass
+
+    async def close(self):
+        pass
+
+def build_clients(runtime,transport):
+    class NumbersClient(runtime.RpcClient):
+        methods = {"Get": runtime.Method(1,"test.Numbers.Get",None,0,Int32Value,11,1000)}
+
+    class NamesClient(runtime.RpcClient):
+        methods = {"Get": runtime.Method(2,"test.Names.Get",None,0,StringValue,12,1000)}
+
+    return (NumbersClient(transport),NamesClient(transport))
+
+def test_clients_sharing_a_transport_get_their_own_responses(omgpp_runtime):
+    async def run():
+        transport = LoopbackTransport()
+        (numbers,names) = build_clients(omgpp_runtime,transport)
+        number = asyncio.ensure_future(numbers.call(numbers.methods["Get"],None))
+        name = asyncio.ensure_future(names.call(names.methods["Get"],None))
+        await asyncio.sleep(0)
+        [(_,number_request,_,_),(_,name_request,_,_)] = transport.sent
+        assert number_request != name_request
+        # answered in reverse order
+        transport.on_rpc(2,name_request,12,StringValue(value="x").SerializeToString())
+        transport.on_rpc(1,number_request,11,Int32Value(value=7).SerializeToString())
+        return (await number,await name)
+
+    (number,name) = asyncio.run(run())
+    assert number.value == 7
+    assert name.value == "x"
+
+def test_response_for_another_method_is_dropped(omgpp_runtime):
+    async def run():
+        transport = LoopbackTransport()
+        (numbers,_) = build_clients(omgpp_runtime,transport)
+        method = omgpp_runtime.Method(1,"test.Numbers.Get",None,0,Int32Value,11,50)
+        call = asyncio.ensure_future(numbers.call(method,None))
+        await asyncio.sleep(0)
+        (_,request_id,_,_) = transport.sent[0]
+        transport.on_rpc(2,request_id,12,b"")
+        await call
+
+    with pytest.raises(omgpp_runtime.RpcTimeoutError):
+        asyncio.run(run())
+
+def test_closing_the_transport_fails_calls_of_every_client(omgpp_runtime):
+    async def run():
+        transport = LoopbackTransport()
+        (numbers,names) = build_clients(omgpp_runtime,transport)
+        closed = []
+        numbers.connection.close_handlers.append(closed.append)
+        calls = [asyncio.ensure_future(client.call(client.methods["Get"],None)) for client in [numbers,names]]
+        await asyncio.sleep(0)
+        transport.on_closed(ConnectionResetError())
+        results = await asyncio.gather(*calls,return_exceptions=True)
+        return (results,closed)
+
+    (results,closed) = asyncio.run(run())
+    assert all(isinstance(result,omgpp_runtime.RpcError) for result in results)
+    assert len(closed) == 1
+
+def test_fire_and_forget_methods_do_not_wait(omgpp_runtime):
+    async def run():
+        transport = LoopbackTransport()
+        (numbers,_) = build_clients(omgpp_runtime,transport)
+        method = omgpp_runtime.Method(3,"test.Numbers.Set",Int32Value,11,None,0,1000)
+        result = await numbers.call(method,Int32Value(value=3))
+        return (result,transport.sent)
+
+    (result,sent) = asyncio.run(run())
+    assert result is None
+    assert sent == [(3,0,11,Int32Value(value=3).SerializeToString())]
+
+def test_load_generator_reports_completed_calls(omgpp_runtime):
+    async def call():
+        await asyncio.sleep(0)
+
+    summary = asyncio.run(omgpp_runtime.run_load(call,0,4,0.05))
+    assert summary["completed"] == summary["started"] > 0
+    assert summary["errors"] == 0
+
+def test_transport_is_loaded_from_module_and_class(omgpp_runtime):
+    assert omgpp_runtime.get_transport_type(f"{__name__}:LoopbackTransport") is LoopbackTransport
+    with pytest.raises(Exception,match="module:Class"):
+        omgpp_runtime.get_transport_type("LoopbackTransport")
+    with pytest.raises(Exception,match="module:Class"):
+        omgpp_runtime.get_transport_type("tcp")
+
+def test_load_generator_requires_a_transport(omgpp_runtime):
+    with pytest.raises(SystemExit):
+        omgpp_runtime.main(["--method","Numbers.Get","--port","5000"])
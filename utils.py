@@ -7,6 +7,9 @@ from google.protobuf.descriptor_pb2 import (
     MethodDescriptorProto,
     DescriptorProto,
 )
+
+GENERATOR_VERSION = "0.1.0"
+
 def get_output_filename(proto_file_name:str) -> str:
     file = os.path.basename(proto_file_name)
     without_extension = file.split(".")
@@ -17,12 +20,25 @@ def get_output_filename(proto_file_name:str) -> str:
 
     return "".join(part.capitalize() for part in without_extension.split("_"))
 
+def get_namespace(d:FileDescriptorProto) -> str:
+    csharp_namespace = None
+    if len(d.package) > 0:
+        csharp_namespace = ".".join([to_upper(part) for part in d.package.split(".")])
+    if len(d.options.csharp_namespace) > 0:
+        csharp_namespace = d.options.csharp_namespace
+    return csharp_namespace
+
 def to_camel_case(message_name:str) -> str:
     return "".join(to_upper(part) for part in message_name.split("_"))
 def to_upper(string:str):
    return string.replace(string[0],string[0].upper(),1)
 
-def get_id_from_string(text):
+ID_SCHEMES = ["legacy","fnv1a64"]
+
+FNV1A64_OFFSET_BASIS = 0xcbf29ce484222325
+FNV1A64_PRIME = 0x100000001b3
+
+def get_legacy_id_from_string(text):
     i = 0
     id = 0
     # just sum up each character;
@@ -32,14 +48,32 @@ def get_id_from_string(text):
         i = i+1
     return id    # only Integer
 
-def get_message_id(message:DescriptorProto,descriptor:FileDescriptorProto):
+def get_fnv1a64_id_from_string(text):
+    id = FNV1A64_OFFSET_BASIS
+    for byte in text.encode("utf-8"):
+        id = ((id ^ byte) * FNV1A64_PRIME) & 0xffffffffffffffff
+    # IDs are C# longs, so reinterpret the unsigned hash as two's complement
+    if id >= 1 << 63:
+        id -= 1 << 64
+    return id
+
+def get_id_from_string(text, id_scheme="legacy"):
+    if id_scheme == "fnv1a64":
+        return get_fnv1a64_id_from_string(text)
+    return get_legacy_id_from_string(text)
+
+def get_message_full_name(message:DescriptorProto,descriptor:FileDescriptorProto):
     csharp_name = to_camel_case(message.name)
     package = descriptor.package or "EMPTY"
-    full_qualified_name = ".".join([package,csharp_name])
-    return get_id_from_string(full_qualified_name)
-
+    return ".".join([package,csharp_name])
 
-def get_method_id(service:ServiceDescriptorProto,method:MethodDescriptorProto, file_descriptor:FileDescriptorProto):
+def get_method_full_name(service:ServiceDescriptorProto,method:MethodDescriptorProto, file_descriptor:FileDescriptorProto):
     package = file_descriptor.package or "EMPTY"
-    full_name = ".".join([package,service.name,method.name,method.input_type,method.output_type])
-    return get_id_from_string(full_name)
+    return ".".join([package,service.name,method.name,method.input_type,method.output_type])
+
+def get_message_id(message:DescriptorProto,descriptor:FileDescriptorProto,id_scheme="legacy"):
+    return get_id_from_string(get_message_full_name(message,descriptor),id_scheme)
+
+
+def get_method_id(service:ServiceDescriptorProto,method:MethodDescriptorProto, file_descriptor:FileDescriptorProto,id_scheme="legacy"):
+    return get_id_from_string(get_method_full_name(service,method,file_descriptor),id_scheme)